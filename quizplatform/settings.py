@@ -78,16 +78,59 @@ if os.getenv('DATABASE_URL'):
 # Redis for Channels (Render Redis)
 REDIS_URL = os.getenv('REDIS_URL')
 if REDIS_URL:
+    # Pub/sub layer guruh xabarini har bir worker uchun bir marta publish qiladi va
+    # uni shu jarayondagi consumerlarga xotirada tarqatadi (core layer esa har bir
+    # a'zo kanal uchun alohida Redis buyrug'i bajaradi)
     CHANNEL_LAYERS = {
         "default": {
-            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "BACKEND": os.getenv(
+                'CHANNEL_LAYER_BACKEND', "channels_redis.pubsub.RedisPubSubChannelLayer",
+            ),
             "CONFIG": {"hosts": [REDIS_URL]},
         }
     }
+    # Kahoot live o'yin holati barcha workerlar uchun umumiy
+    KAHOOT_STATE_STORE = {
+        "BACKEND": "quizzes.kahoot_state.RedisGameStateStore",
+        "CONFIG": {"url": REDIS_URL},
+    }
 else:
     CHANNEL_LAYERS = {
         "default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}
     }
+    KAHOOT_STATE_STORE = {
+        "BACKEND": "quizzes.kahoot_state.InMemoryGameStateStore",
+    }
+
+# Kahoot: host ekranidagi javoblar hisoblagichi eng ko'pi bilan shu intervalda yuboriladi (soniya)
+KAHOOT_ANSWER_COUNT_INTERVAL = float(os.getenv('KAHOOT_ANSWER_COUNT_INTERVAL', '0.1'))
+# Kahoot: lobby roster o'zgarishlari (join, chiqish, kick) shu intervalda bitta xabar bilan yuboriladi (soniya)
+KAHOOT_ROSTER_INTERVAL = float(os.getenv('KAHOOT_ROSTER_INTERVAL', '0.25'))
+# Kahoot: savol vaqti tugagandan keyin yo'ldagi javoblar uchun qo'shimcha vaqt (soniya)
+KAHOOT_ANSWER_GRACE = float(os.getenv('KAHOOT_ANSWER_GRACE', '0.5'))
+# Kahoot: savol umumiy server vaqtida shuncha keyin ochiladi, hamma ekranda bir vaqtda (soniya)
+KAHOOT_QUESTION_LEAD = float(os.getenv('KAHOOT_QUESTION_LEAD', '0.5'))
+# Kahoot: savol ochilishidan shuncha oldin (soniya, soat xatosi uchun) kelgan javob qabul qilinadi
+KAHOOT_EARLY_ANSWER_TOLERANCE = float(os.getenv('KAHOOT_EARLY_ANSWER_TOLERANCE', '0.1'))
+# Kahoot: javob vaqtidan ayiriladigan tarmoq kechikishining yuqori chegarasi (soniya, bir tomonlama)
+KAHOOT_MAX_LATENCY_COMPENSATION = float(os.getenv('KAHOOT_MAX_LATENCY_COMPENSATION', '0.5'))
+# Kahoot: birinchi savol o'yinchilarning shu qismi tayyor bo'lganda yoki timeout'da (soniya) ochiladi
+KAHOOT_READY_FRACTION = float(os.getenv('KAHOOT_READY_FRACTION', '0.9'))
+KAHOOT_READY_TIMEOUT = float(os.getenv('KAHOOT_READY_TIMEOUT', '10'))
+# Kahoot: o'yinni boshqaruvchi worker lease'i (soniya); worker o'lsa, boshqasi shu vaqtdan keyin davom ettiradi
+KAHOOT_LEASE_TTL = float(os.getenv('KAHOOT_LEASE_TTL', '10'))
+# Kahoot: savol natijalaridan keyin shuncha vaqt (soniya) davom ettirilmagan o'yin tugatiladi
+KAHOOT_IDLE_TIMEOUT = float(os.getenv('KAHOOT_IDLE_TIMEOUT', str(30 * 60)))
+# Kahoot: tugamagan sessiya PIN'i shu vaqtdan (soniya) keyin yangi sessiyaga berilishi mumkin
+KAHOOT_PIN_REUSE_AFTER = float(os.getenv('KAHOOT_PIN_REUSE_AFTER', str(24 * 60 * 60)))
+# Kahoot: sekin ulanishlarga shu vaqtdan (soniya) ko'proq kechikkan hisoblagich va roster yangilanishlari yuborilmaydi
+KAHOOT_SHED_LAG = float(os.getenv('KAHOOT_SHED_LAG', '1.0'))
+# Kahoot: ulanishlarga heartbeat yuborish oralig'i (soniya)
+KAHOOT_HEARTBEAT_INTERVAL = float(os.getenv('KAHOOT_HEARTBEAT_INTERVAL', '15'))
+# Kahoot: shuncha vaqt (soniya) hech narsa yubormagan ulanish o'lik hisoblanib yopiladi
+KAHOOT_HEARTBEAT_TIMEOUT = float(os.getenv('KAHOOT_HEARTBEAT_TIMEOUT', '45'))
+# Kahoot: consumer va game loop baza ishlari uchun alohida thread pool hajmi
+KAHOOT_DB_WORKERS = int(os.getenv('KAHOOT_DB_WORKERS', '8'))
 
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
@@ -1,5 +1,12 @@
+import atexit
+
 from django.apps import AppConfig
 
 
 class QuizzesConfig(AppConfig):
     name = 'quizzes'
+
+    def ready(self):
+        # Kahoot: buferdagi javoblarni jarayon to'xtaganda bazaga yozish
+        from .kahoot_persistence import flush_on_shutdown
+        atexit.register(flush_on_shutdown)
@@ -1,51 +1,101 @@
 # Kahoot Mode WebSocket Consumer
 import asyncio
-import json
+import time
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
-from django.utils import timezone
+
+from .kahoot_admission import remove_player
+from .kahoot_clock import EARLY_ANSWER_TOLERANCE, ClockSync
+from .kahoot_codec import CODECS, DEFAULT_CODEC, negotiate_codec
+from .kahoot_db import db_task
+from .kahoot_limits import ActionLimiter, is_sheddable
+from .kahoot_loop import (
+    ANSWER_GRACE, answer_count_emitter, get_game_loop, host_group_name, record_roster_change,
+    room_group_name,
+)
+from .kahoot_persistence import flush_pending_answers, get_live_state
+from .kahoot_presence import HEARTBEAT_INTERVAL, HEARTBEAT_TIMEOUT, everyone_answered
+from .kahoot_state import ANSWER_OPTIONS, current_question, get_state_store, question_data
 
 
 class KahootConsumer(AsyncWebsocketConsumer):
     """
     Real-time WebSocket consumer for Kahoot game sessions.
     Handles: player join, host controls, answer submission, score updates.
+    Frames are JSON text, or msgpack when the client asks for the
+    "kahoot.msgpack" subprotocol. Incoming actions are rate limited per
+    connection and stale counters are shed for slow sockets. Roster changes
+    reach the host as batched roster_update diffs.
+    Game events carry a per-session sequence number: a player reconnecting
+    with `last_seq` only receives the events it missed. A clock_ping
+    exchange estimates each connection's clock offset and RTT: questions open
+    at a shared server timestamp and answer times exclude network delay.
+    Heartbeats close connections that stay silent for HEARTBEAT_TIMEOUT;
+    connected players are tracked in the store's presence set.
+    A player connection is bound at connect to the player kahoot_join stored
+    in the Django session; a client-sent player_id is ignored.
     """
+    codec = DEFAULT_CODEC
 
     async def connect(self):
+        # connect() o'rtada xato bersa ham disconnect() ishlashi uchun
+        self.heartbeat_task = None
         self.session_pin = self.scope['url_route']['kwargs']['session_pin']
-        self.room_group_name = f'kahoot_{self.session_pin}'
+        self.room_group_name = room_group_name(self.session_pin)
+        self.host_group_name = host_group_name(self.session_pin)
         self.player_id = None
+        self.player = None  # bog'langan o'yinchining roster qatori (bir marta yuklanadi)
+        self.score = None  # o'yinchining oxirgi ma'lum bali
         self.is_host = False
+        self.store = get_state_store()
+        self.limiter = ActionLimiter()
+        self.last_answer = None  # ((question_id, player_id), answer_result)
+        self.last_seq = None  # replay qilingan oxirgi voqea
+        self.clock = ClockSync()
+        self.codec, subprotocol = negotiate_codec(self.scope.get('subprotocols'))
+        self.last_seen = time.monotonic()  # klientdan oxirgi xabar vaqti
+        # O'yinchi kimligi klientdan emas, kahoot_join yozgan Django sessiyasidan olinadi
+        self.session_player_id = await self.get_session_player_id()
 
         # Join room group
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
-        await self.accept()
+        await self.accept(subprotocol)
+        self.heartbeat_task = asyncio.ensure_future(self.heartbeat())
 
     async def disconnect(self, close_code):
+        if self.heartbeat_task is not None:
+            self.heartbeat_task.cancel()
         # Leave room group
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
         
-        # Notify others if player left
-        if self.player_id:
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'player_left',
-                    'player_id': self.player_id,
-                }
-            )
-
-    async def receive(self, text_data):
+        # Host chiqib ketsa, buferdagi javoblar yo'qolmasligi uchun bazaga yoziladi
+        if self.is_host:
+            await self.channel_layer.group_discard(self.host_group_name, self.channel_name)
+            await flush_pending_answers(self.session_pin, self.store)
+        
+        # Notify host if player left (roster_update bilan birga). O'yinchi boshqa
+        # ulanishdan (masalan game sahifasidan) qaytgan bo'lsa, u chiqmagan hisoblanadi
+        if self.player_id and await self.store.mark_absent(
+            self.session_pin, self.player_id, self.channel_name,
+        ):
+            record_roster_change(self.session_pin, self.player_id, 'left')
+
+    async def receive(self, text_data=None, bytes_data=None):
         """Handle incoming WebSocket messages"""
-        data = json.loads(text_data)
+        if bytes_data is not None:
+            data = CODECS['msgpack'].decode(bytes_data)
+        else:
+            data = CODECS['json'].decode(text_data)
+        self.last_seen = time.monotonic()
         action = data.get('action')
+        # Limitdan oshgan xabarlar bazaga va guruhga yetmasdan tashlab yuboriladi
+        if not self.limiter.allow(action):
+            return
 
         if action == 'host_join':
             await self.handle_host_join(data)
@@ -65,12 +115,17 @@ class KahootConsumer(AsyncWebsocketConsumer):
             await self.handle_end_game()
         elif action == 'kick_player':
             await self.handle_kick_player(data)
+        elif action == 'clock_pong':
+            await self.handle_clock_pong(data)
+        elif action == 'heartbeat':
+            await self.mark_present()
 
     # ==================== HOST ACTIONS ====================
 
     async def handle_host_join(self, data):
         """Host joins the session"""
         self.is_host = True
+        await self.channel_layer.group_add(self.host_group_name, self.channel_name)
         session = await self.get_session()
         if session:
             players = await self.get_players_list()
@@ -81,54 +136,73 @@ class KahootConsumer(AsyncWebsocketConsumer):
                 'total_questions': session['total_questions'],
                 'max_players': session.get('max_players', 50),
                 'players': players,
+                'connected': await self.store.count_present(self.session_pin),
                 'status': session.get('status', 'LOBBY'),
             }
             
             # Agar o'yin davom etayotgan bo'lsa, joriy savolni yuborish
+            if session.get('status') == 'PLAYING':
+                # Worker qayta ishga tushgan yoki o'yin egasi o'lgan bo'lsa, savol taymeri tiklanadi
+                get_game_loop(self.session_pin).ensure_running()
             if session.get('status') == 'PLAYING' and session.get('current_question_index', -1) >= 0:
                 current_q = await self.get_current_question_data()
                 if current_q:
                     payload['current_question'] = current_q
             
-            await self.send(text_data=json.dumps(payload))
+            await self.send_payload(payload)
+            await self.start_clock_sync()
 
     async def handle_player_join(self, data):
         """Player joins the session"""
-        player_id = data.get('player_id')
-        nickname = data.get('nickname')
-        avatar_id = data.get('avatar_id')
+        player = await self.get_bound_player()
+        if player is None:
+            return
         
-        self.player_id = player_id
+        self.player_id = self.session_player_id
+        await self.mark_present()
         
-        # Notify all (including host) about new player
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'player_joined',
-                'player_id': player_id,
-                'nickname': nickname,
-                'avatar_id': avatar_id,
-            }
-        )
+        # Notify host about new player (roster_update bilan birga)
+        record_roster_change(self.session_pin, self.player_id, 'joined', {
+            'nickname': player['nickname'],
+            'avatar_id': player['avatar_id'],
+        })
 
     async def handle_player_ready(self, data):
         """
         O'yinchi game sahifasiga o'tdi va WebSocket tayyor.
         Agar o'yin allaqachon boshlangan bo'lsa, joriy savolni yuborish.
         """
-        player_id = data.get('player_id')
+        player_id = self.session_player_id
         if not player_id:
             return
         
         self.player_id = player_id
-        
+        await self.mark_present()
+        await self.start_clock_sync()
+
+        # Qayta ulangan o'yinchi: holat qayta yig'ilmaydi, faqat o'tkazib yuborilgan voqealar
+        if await self.replay_events(data.get('last_seq')):
+            get_game_loop(self.session_pin).ensure_running()
+            return
+
+        # Holatdan oldin o'qiladi: undan keyingi voqealar klientga baribir yetib keladi
+        seq = await self.store.get_event_seq(self.session_pin)
+
         # Sessiya holatini tekshirish
         session = await self.get_session()
         if not session:
             return
         
+        # Readiness barrier: o'yin boshlanishini kutayotgan loop'ga xabar beriladi
+        if await self.get_bound_player() is not None:
+            await self.store.mark_ready(self.session_pin, player_id)
+            if session.get('status') == 'PLAYING' and session.get('current_question_index', -1) < 0:
+                get_game_loop(self.session_pin).submit('check_ready')
+        
         # Agar o'yin PLAYING holatida bo'lsa va savol mavjud bo'lsa
         if session.get('status') == 'PLAYING':
+            # O'yinchi ulangan har bir worker lease egasi o'lsa o'yinni davom ettira oladi
+            get_game_loop(self.session_pin).ensure_running()
             current_index = session.get('current_question_index', -1)
             
             # Joriy savolni olish
@@ -139,13 +213,15 @@ class KahootConsumer(AsyncWebsocketConsumer):
                     # O'yinchining bu savolga javob berganligini tekshirish
                     has_answered = await self.check_player_answered(player_id, question_data.get('question_id'))
                     
-                    # Player scoreni yuborish
-                    player_score = await self.get_player_score(player_id)
+                    # Player scoreni yuborish (boshqa ulanishdan javob bergan bo'lishi mumkin)
+                    self.score = None
+                    player_score = await self.get_player_score()
                     
                     # O'yinchiga shaxsiy xabar yuborish
-                    await self.send(text_data=json.dumps({
+                    await self.send_payload({
                         'type': 'sync_current_state',
                         'status': 'PLAYING',
+                        'seq': seq,
                         'current_score': player_score,
                         'question': {
                             'question_id': question_data.get('question_id'),
@@ -160,16 +236,19 @@ class KahootConsumer(AsyncWebsocketConsumer):
                                 'D': question_data.get('options', {}).get('D', ''),
                             },
                             'time_limit': question_data.get('time_limit', 20),
+                            'starts_at': question_data.get('starts_at'),
+                            'deadline': question_data.get('deadline'),
                             'has_answered': has_answered,
                         }
-                    }))
+                    })
                     return
         
         # Agar LOBBY yoki FINISHED holatida bo'lsa
-        await self.send(text_data=json.dumps({
+        await self.send_payload({
             'type': 'sync_current_state',
             'status': session.get('status', 'LOBBY'),
-        }))
+            'seq': seq,
+        })
 
     async def handle_kick_player(self, data):
         """Host o'yinchini kick qiladi (faqat LOBBY holatida)"""
@@ -178,409 +257,326 @@ class KahootConsumer(AsyncWebsocketConsumer):
         session = await self.get_session()
         if not session or session.get('status') != 'LOBBY':
             return
-        player_id = data.get('player_id')
+        player_id = self.parse_player_id(data.get('player_id'))
         if not player_id:
             return
         removed = await self.remove_player_from_session(player_id)
         if removed:
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {'type': 'player_kicked', 'player_id': player_id},
-            )
+            record_roster_change(self.session_pin, player_id, 'kicked')
 
     async def handle_start_game(self):
         """Host starts the game"""
         if not self.is_host:
             return
-        
-        await self.update_session_status('PLAYING')
-        
-        # Notify all players to switch to game screen
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {'type': 'game_started'},
-        )
-        
-        # O'yinchilar sahifaga o'tib WebSocket ulanishini o'rnatishi uchun kutish
-        await asyncio.sleep(2.0)
-        
-        # Birinchi savolni yuborish
-        session = await self.get_session()
-        if session and session.get('total_questions', 0) > 0:
-            await self.handle_next_question()
+        get_game_loop(self.session_pin).submit('start_game')
 
     async def handle_next_question(self):
         """Move to next question"""
         if not self.is_host:
             return
-        
-        question_data = await self.advance_to_next_question()
-        
-        if question_data:
-            # Player va Host uchun savol matni va variant matnlari aniq yuboriladi
-            payload = {
-                'type': 'show_question',
-                'question': {
-                    'question_id': question_data.get('question_id'),
-                    'index': question_data.get('index'),
-                    'total': question_data.get('total'),
-                    'text': question_data.get('text', ''),
-                    'image': question_data.get('image'),
-                    'options': {
-                        'A': question_data.get('options', {}).get('A', ''),
-                        'B': question_data.get('options', {}).get('B', ''),
-                        'C': question_data.get('options', {}).get('C', ''),
-                        'D': question_data.get('options', {}).get('D', ''),
-                    },
-                    'time_limit': question_data.get('time_limit', 20),
-                },
-            }
-            await self.channel_layer.group_send(self.room_group_name, payload)
-        else:
-            # No more questions, end game
-            await self.handle_end_game()
+        get_game_loop(self.session_pin).submit('next_question')
 
     async def handle_submit_answer(self, data):
         """Player submits answer"""
-        player_id = data.get('player_id')
         selected_option = data.get('selected_option')
-        time_taken = data.get('time_taken', 0)
         
-        result = await self.save_answer(player_id, selected_option, time_taken)
+        result = await self.save_answer(self.session_player_id, selected_option)
         
         # Send feedback to the player who answered
-        await self.send(text_data=json.dumps({
+        await self.send_payload({
             'type': 'answer_result',
             'is_correct': result['is_correct'],
             'points_earned': result['points_earned'],
             'total_score': result['total_score'],
             'rank': result['rank'],
-        }))
+            'late': result.get('late', False),
+        })
         
-        # Notify host about answer count
-        answer_count = await self.get_answer_count()
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'answer_count_update',
-                'count': answer_count['count'],
-                'total': answer_count['total'],
-            }
-        )
+        # Takroriy javob hech narsani o'zgartirmaydi: hisoblagich va yopish tekshirilmaydi
+        if result.get('repeat'):
+            return
+
+        # Notify host about answer count (faqat host guruhiga, coalesced)
+        answer_count_emitter.trigger(self.session_pin)
+        if result.get('question_id'):
+            await self.close_if_everyone_answered(result['question_id'])
+
+    async def heartbeat(self):
+        """Ping the client every HEARTBEAT_INTERVAL; close the socket once it stays silent too long"""
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            if time.monotonic() - self.last_seen > HEARTBEAT_TIMEOUT:
+                # disconnect() ulanishni guruhlardan va presence'dan chiqaradi
+                await self.close()
+                return
+            await self.send_payload({'type': 'heartbeat'})
+
+    async def mark_present(self):
+        """O'yinchi shu ulanish orqali ulangan (heartbeat'lar muddatini uzaytiradi)"""
+        if self.player_id:
+            await self.store.mark_present(
+                self.session_pin, self.player_id, self.channel_name, HEARTBEAT_TIMEOUT,
+            )
+
+    async def start_clock_sync(self):
+        """Ulanishning birinchi ping'i (qayta player_ready'da takrorlanmaydi)"""
+        if self.clock.samples == 0 and self.clock.pending is None:
+            await self.send_payload(self.clock.ping())
+
+    async def handle_clock_pong(self, data):
+        """Pong kelishi bilan keyingi ping (yoki yakuniy clock_sync) yuboriladi"""
+        if self.clock.pong(data.get('server_time'), data.get('client_time')):
+            await self.send_payload(self.clock.ping())
 
     async def handle_show_results(self):
-        """Show results after question timer ends"""
+        """Host savolni vaqtidan oldin yopadi (odatda server taymeri yopadi)"""
         if not self.is_host:
             return
-        
-        results = await self.get_question_results()
-        
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'question_results',
-                'results': results,
-            }
-        )
+        get_game_loop(self.session_pin).submit('close_question')
 
     async def handle_end_game(self):
         """End the game and show podium"""
-        await self.update_session_status('FINISHED')
-        
-        podium = await self.get_podium()
-        
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'game_ended',
-                'podium': podium,
-            }
-        )
+        if not self.is_host:
+            return
+        get_game_loop(self.session_pin).submit('end_game')
 
     # ==================== GROUP MESSAGE HANDLERS ====================
 
-    async def player_joined(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'player_joined',
-            'player_id': event['player_id'],
-            'nickname': event['nickname'],
-            'avatar_id': event['avatar_id'],
-        }))
-
-    async def player_left(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'player_left',
-            'player_id': event['player_id'],
-        }))
-
-    async def game_started(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'game_started',
-        }))
-
-    async def show_question(self, event):
-        # Player va Host uchun savol matni va options (A,B,C,D) yuboriladi
-        q = event.get('question') or {}
-        await self.send(text_data=json.dumps({
-            'type': 'show_question',
-            'question': {
-                'question_id': q.get('question_id'),
-                'index': q.get('index'),
-                'total': q.get('total'),
-                'text': q.get('text', ''),
-                'image': q.get('image'),
-                'options': {
-                    'A': q.get('options', {}).get('A', ''),
-                    'B': q.get('options', {}).get('B', ''),
-                    'C': q.get('options', {}).get('C', ''),
-                    'D': q.get('options', {}).get('D', ''),
-                },
-                'time_limit': q.get('time_limit', 20),
-            },
-        }))
-
-    async def answer_count_update(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'answer_count_update',
-            'count': event['count'],
-            'total': event['total'],
-        }))
-
-    async def question_results(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'question_results',
-            'results': event['results'],
-        }))
-
-    async def game_ended(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'game_ended',
-            'podium': event['podium'],
-        }))
-
-    async def player_kicked(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'player_kicked',
-            'player_id': event['player_id'],
-        }))
+    async def send_payload(self, payload):
+        """Faqat shu ulanishga yuboriladigan xabar"""
+        await self.send_encoded(self.codec.encode(payload))
 
-    # ==================== DATABASE OPERATIONS ====================
-
-    @database_sync_to_async
-    def get_session(self):
-        from .models import KahootSession
-        try:
-            session = KahootSession.objects.select_related('quiz').get(pin=self.session_pin)
-            return {
-                'quiz_title': session.quiz.title,
-                'total_questions': session.quiz.questions.count(),
-                'status': session.status,
-                'current_question_index': session.current_question_index,
-                'max_players': getattr(session, 'max_players', 50) or 50,
-            }
-        except KahootSession.DoesNotExist:
-            return None
+    async def send_encoded(self, frame):
+        if self.codec.binary:
+            await self.send(bytes_data=frame)
+        else:
+            await self.send(text_data=frame)
 
-    @database_sync_to_async
-    def remove_player_from_session(self, player_id):
-        from .models import KahootSession, KahootPlayer
-        try:
-            session = KahootSession.objects.get(pin=self.session_pin)
-            deleted, _ = KahootPlayer.objects.filter(session=session, id=player_id).delete()
-            return deleted > 0
-        except KahootSession.DoesNotExist:
+    async def replay_events(self, last_seq):
+        """Send buffered game events after `last_seq`; False if a full sync is needed"""
+        if not isinstance(last_seq, int) or isinstance(last_seq, bool):
             return False
+        events = await self.store.get_events_since(self.session_pin, last_seq)
+        if events is None:
+            return False
+        for payload in events:
+            await self.send_payload(payload)
+        self.last_seq = events[-1]['seq'] if events else last_seq
+        return True
 
-    @database_sync_to_async
-    def get_players_list(self):
-        from .models import KahootSession
-        try:
-            session = KahootSession.objects.get(pin=self.session_pin)
-            players = list(session.players.values('id', 'nickname', 'avatar_id', 'score'))
-            return players
-        except KahootSession.DoesNotExist:
-            return []
-
-    @database_sync_to_async
-    def update_session_status(self, status):
-        from .models import KahootSession
-        KahootSession.objects.filter(pin=self.session_pin).update(status=status)
-
-    @database_sync_to_async
-    def get_current_question_data(self):
-        """Joriy savolni (index o'zgartirmasdan) qaytaradi"""
-        from .models import KahootSession
+    async def send_frame(self, event):
+        if is_sheddable(event):
+            return
+        seq = event.get('seq')
+        if seq is not None and self.last_seq is not None:
+            # Replay paytida guruhdan ham kelgan voqea ikki marta yuborilmaydi
+            if seq <= self.last_seq:
+                return
+            self.last_seq = seq
+        # Tayyor (oldindan serialize qilingan) frame o'zgarishsiz uzatiladi
+        await self.send_encoded(event['frames'][self.codec.name])
+
+    async def roster_update(self, event):
+        # O'yinchiga faqat o'zi kick qilingani yuboriladi
+        if self.is_host:
+            await self.send_frame(event)
+        elif self.player_id and self.player_id in event['kicked']:
+            # Kick qilingan ulanish boshqa javob yubora olmaydi, heartbeat'lari uni
+            # presence'ga qaytarmaydi va disconnect'da 'left' yozilmaydi
+            await self.store.mark_absent(self.session_pin, self.player_id, self.channel_name)
+            self.player_id = self.session_player_id = self.player = None
+            await self.send_frame(event)
+            await self.close()
+
+    game_started = send_frame
+    show_question = send_frame
+    answer_count_update = send_frame
+    ready_progress = send_frame
+    question_results = send_frame
+    game_ended = send_frame
+
+    # ==================== LIVE STATE ====================
+
+    @staticmethod
+    def parse_player_id(value):
         try:
-            session = KahootSession.objects.select_related('quiz').get(pin=self.session_pin)
-            questions = list(session.quiz.questions.all().order_by('order'))
-            if session.current_question_index < 0 or session.current_question_index >= len(questions):
-                return None
-            q = questions[session.current_question_index]
-            return {
-                'index': session.current_question_index,
-                'total': len(questions),
-                'text': q.text,
-                'image': q.image.url if q.image else None,
-                'options': {'A': q.option_a, 'B': q.option_b, 'C': q.option_c, 'D': q.option_d},
-                'time_limit': q.time_limit,
-                'question_id': q.id,
-            }
-        except KahootSession.DoesNotExist:
+            return int(value)
+        except (TypeError, ValueError):
             return None
 
-    @database_sync_to_async
-    def check_player_answered(self, player_id, question_id):
-        """O'yinchi bu savolga javob berganmi?"""
-        from .models import KahootAnswer
-        try:
-            return KahootAnswer.objects.filter(
-                player_id=player_id,
-                question_id=question_id
-            ).exists()
-        except:
-            return False
+    async def get_live_state(self):
+        return await get_live_state(self.session_pin, self.store)
 
-    @database_sync_to_async
-    def get_player_score(self, player_id):
-        """O'yinchining hozirgi balini olish"""
-        from .models import KahootPlayer
-        try:
-            player = KahootPlayer.objects.get(id=player_id)
-            return player.score
-        except:
-            return 0
-
-    @database_sync_to_async
-    def advance_to_next_question(self):
-        from .models import KahootSession
-        try:
-            session = KahootSession.objects.select_related('quiz').get(pin=self.session_pin)
-            session.current_question_index += 1
-            session.question_start_time = timezone.now()
-            session.save()
-            
-            questions = list(session.quiz.questions.all().order_by('order'))
-            if session.current_question_index < len(questions):
-                q = questions[session.current_question_index]
-                return {
-                    'index': session.current_question_index,
-                    'total': len(questions),
-                    'text': q.text,
-                    'image': q.image.url if q.image else None,
-                    'options': {
-                        'A': q.option_a,
-                        'B': q.option_b,
-                        'C': q.option_c,
-                        'D': q.option_d,
-                    },
-                    'time_limit': q.time_limit,
-                    'question_id': q.id,
-                }
+    async def get_session(self):
+        state = await self.get_live_state()
+        if state is None:
             return None
-        except KahootSession.DoesNotExist:
+        return {
+            'quiz_title': state['quiz_title'],
+            'total_questions': len(state['questions']),
+            'status': state['status'],
+            'current_question_index': state['current_question_index'],
+            'max_players': state['max_players'],
+        }
+
+    async def get_players_list(self):
+        roster = await self.store.get_roster(self.session_pin)
+        scores = await self.store.get_scores(self.session_pin)
+        return [
+            {
+                'id': player_id,
+                'nickname': info['nickname'],
+                'avatar_id': info['avatar_id'],
+                'score': scores.get(player_id, 0),
+            }
+            for player_id, info in roster.items()
+        ]
+
+    async def get_bound_player(self):
+        """Roster row of the session's player, loaded once per connection"""
+        if self.player is None and self.session_player_id:
+            if await self.get_live_state() is not None:
+                self.player = await self.get_roster_player(self.session_player_id)
+        return self.player
+
+    async def get_roster_player(self, player_id):
+        """Rosterdan o'yinchini olish; topilmasa bazadan tekshiriladi"""
+        player = await self.store.get_player(self.session_pin, player_id)
+        if player is None:
+            loaded = await self.load_player(player_id)
+            if loaded is None:
+                return None
+            player, score = loaded
+            await self.store.add_player(self.session_pin, player_id, player, score)
+        return player
+
+    async def remove_player_from_session(self, player_id):
+        removed = await self.delete_player(player_id)
+        if removed:
+            await self.store.remove_player(self.session_pin, player_id)
+        return removed
+
+    async def get_current_question_data(self):
+        """Joriy savolni (index o'zgartirmasdan) ochilish va tugash vaqti bilan qaytaradi"""
+        state = await self.get_live_state()
+        if state is None:
             return None
+        question = question_data(state, state['current_question_index'])
+        if question:
+            question['starts_at'] = state['question_start_time']
+            question['deadline'] = state['question_deadline']
+        return question
 
-    @database_sync_to_async
-    def save_answer(self, player_id, selected_option, time_taken):
-        from .models import KahootSession, KahootPlayer, KahootQuestion, KahootAnswer
-        try:
-            session = KahootSession.objects.get(pin=self.session_pin)
-            player = KahootPlayer.objects.get(id=player_id, session=session)
-            question = session.get_current_question()
-            
-            if not question:
-                return {'is_correct': False, 'points_earned': 0, 'total_score': 0, 'rank': 0}
-            
-            is_correct = (selected_option == question.correct_option)
-            
-            # Ball hisoblash: 1000 * (Qolgan_Vaqt / Umumiy_Vaqt)
-            if is_correct:
-                remaining_time = max(0, question.time_limit - time_taken)
-                points = int(1000 * (remaining_time / question.time_limit))
-            else:
-                points = 0
-            
-            # Javobni saqlash
-            answer, created = KahootAnswer.objects.update_or_create(
-                player=player,
-                question=question,
-                defaults={
-                    'selected_option': selected_option,
-                    'is_correct': is_correct,
-                    'time_taken': time_taken,
-                    'points_earned': points,
-                }
+    async def check_player_answered(self, player_id, question_id):
+        """O'yinchi bu savolga javob berganmi?"""
+        answer = await self.store.get_answer(self.session_pin, question_id, player_id)
+        return answer is not None
+
+    async def get_player_score(self):
+        """O'yinchining hozirgi bali (ulanishda keshlanadi)"""
+        if self.score is None:
+            self.score = await self.store.get_score(self.session_pin, self.session_player_id)
+        return self.score
+
+    async def save_answer(self, player_id, selected_option):
+        empty = {'is_correct': False, 'points_earned': 0, 'total_score': 0, 'rank': 0}
+        # Faqat A-D: boshqa qiymat bazaga yozilmaydi va buferni to'sib qo'yadi
+        if selected_option not in ANSWER_OPTIONS:
+            return empty
+        state = await self.get_live_state()
+        if state is None or state['status'] != 'PLAYING':
+            return empty
+        question = current_question(state)
+        if not question:
+            return empty
+        # Shu ulanishdan takroriy javob: store'ga murojaat qilinmaydi
+        if self.last_answer and self.last_answer[0] == (question['question_id'], player_id):
+            return dict(self.last_answer[1], repeat=True)
+        if await self.get_bound_player() is None:
+            return empty
+
+        # Vaqt server soati bo'yicha hisoblanadi (klient yuborgan vaqtga ishonilmaydi)
+        now = time.time()
+        if state['question_closed'] or now > state['question_deadline'] + ANSWER_GRACE:
+            return dict(empty, late=True, total_score=await self.get_player_score())
+        # show_question starts_at'dan oldin yuboriladi: ochilmagan savolga javob
+        # (0 soniya, to'liq ball bo'lardi) yozilmaydi, o'yinchi keyin javob bera oladi
+        if now < state['question_start_time'] - EARLY_ANSWER_TOLERANCE:
+            return dict(empty, total_score=await self.get_player_score())
+        # O'yinchining tarmoq kechikishi (clock sync bo'yicha) javob vaqtiga kirmaydi
+        time_taken = max(0.0, now - state['question_start_time'] - self.clock.latency())
+
+        is_correct = (selected_option == question['correct_option'])
+
+        # Ball hisoblash: 1000 * (Qolgan_Vaqt / Umumiy_Vaqt)
+        if is_correct:
+            remaining_time = max(0, question['time_limit'] - time_taken)
+            points = int(1000 * (remaining_time / question['time_limit']))
+        else:
+            points = 0
+
+        answer = {
+            'selected_option': selected_option,
+            'is_correct': is_correct,
+            'time_taken': time_taken,
+            'points_earned': points,
+            'answered_at': now,
+        }
+        created = await self.store.record_answer(
+            self.session_pin, question['question_id'], player_id, answer
+        )
+        if created and points:
+            self.score = await self.store.add_points(self.session_pin, player_id, points)
+        elif not created:
+            # Takroriy javob: birinchi javob natijasi qaytariladi
+            answer = await self.store.get_answer(
+                self.session_pin, question['question_id'], player_id
             )
-            
-            # Umumiy balni yangilash
-            if created or points > 0:
-                player.score = sum(a.points_earned for a in player.answers.all())
-                player.save()
-            
-            # Joriy o'rin (rank)
-            all_players = list(session.players.order_by('-score', 'joined_at'))
-            rank = next((i + 1 for i, p in enumerate(all_players) if p.id == player.id), 0)
-            
-            return {
-                'is_correct': is_correct,
-                'points_earned': points,
-                'total_score': player.score,
-                'rank': rank,
-            }
-        except Exception as e:
-            print(f"Error saving answer: {e}")
-            return {'is_correct': False, 'points_earned': 0, 'total_score': 0, 'rank': 0}
+        total_score = await self.get_player_score()
+
+        result = {
+            'is_correct': answer['is_correct'],
+            'points_earned': answer['points_earned'],
+            'total_score': total_score,
+            'rank': await self.get_player_rank(player_id),
+            'question_id': question['question_id'],
+            'repeat': not created,
+        }
+        self.last_answer = ((question['question_id'], player_id), result)
+        return result
+
+    async def close_if_everyone_answered(self, question_id):
+        """Hamma ulangan o'yinchi javob bergan bo'lsa, taymerni kutmasdan savol yopiladi"""
+        if await everyone_answered(self.store, self.session_pin, question_id):
+            get_game_loop(self.session_pin).submit('close_question')
+
+    async def get_player_rank(self, player_id):
+        return await self.store.get_rank(self.session_pin, player_id)
 
-    @database_sync_to_async
-    def get_answer_count(self):
-        from .models import KahootSession
-        try:
-            session = KahootSession.objects.get(pin=self.session_pin)
-            question = session.get_current_question()
-            if not question:
-                return {'count': 0, 'total': 0}
-            
-            count = question.player_answers.filter(player__session=session).count()
-            total = session.players.count()
-            return {'count': count, 'total': total}
-        except:
-            return {'count': 0, 'total': 0}
-
-    @database_sync_to_async
-    def get_question_results(self):
-        from .models import KahootSession
-        try:
-            session = KahootSession.objects.get(pin=self.session_pin)
-            question = session.get_current_question()
-            if not question:
-                return {}
-            
-            # Har bir variant uchun javoblar soni
-            from django.db.models import Count
-            answer_counts = {
-                'A': question.player_answers.filter(player__session=session, selected_option='A').count(),
-                'B': question.player_answers.filter(player__session=session, selected_option='B').count(),
-                'C': question.player_answers.filter(player__session=session, selected_option='C').count(),
-                'D': question.player_answers.filter(player__session=session, selected_option='D').count(),
-            }
-            
-            # Top 5 o'yinchi
-            top_players = list(session.players.order_by('-score')[:5].values('nickname', 'score', 'avatar_id'))
-            
-            return {
-                'correct_option': question.correct_option,
-                'answer_counts': answer_counts,
-                'top_players': top_players,
-            }
-        except:
-            return {}
+    # ==================== DATABASE OPERATIONS ====================
+
+    @db_task
+    def get_session_player_id(self):
+        """Player that kahoot_join stored in the Django session for this PIN"""
+        session = self.scope.get('session')
+        if session is None or session.get('kahoot_session_pin') != self.session_pin:
+            return None
+        return self.parse_player_id(session.get('kahoot_player_id'))
 
-    @database_sync_to_async
-    def get_podium(self):
-        from .models import KahootSession
+    @db_task
+    def load_player(self, player_id):
+        from .models import KahootPlayer
         try:
-            session = KahootSession.objects.get(pin=self.session_pin)
-            top3 = list(session.players.order_by('-score')[:3].values('nickname', 'score', 'avatar_id'))
-            return top3
-        except:
-            return []
\ No newline at end of file
+            p = KahootPlayer.objects.get(id=player_id, session__pin=self.session_pin)
+        except (KahootPlayer.DoesNotExist, ValueError, TypeError):
+            return None
+        info = {
+            'nickname': p.nickname,
+            'avatar_id': p.avatar_id,
+            'joined_at': p.joined_at.timestamp(),
+        }
+        return info, p.score
+
+    @db_task
+    def delete_player(self, player_id):
+        return remove_player(self.session_pin, player_id)
@@ -0,0 +1,57 @@
+# Kahoot Mode player admission
+#
+# O'yinchi qo'shilishi bitta tranzaksiyada ikki so'rov: sessiyadagi joy
+# hisoblagichi shartli UPDATE bilan band qilinadi (max_players'dan oshib
+# ketmaydi), o'yinchi esa INSERT qilinadi (nickname unikalligini bazadagi
+# unique_together ta'minlaydi). Xato bo'lsa band qilingan joy qaytariladi.
+from django.db import IntegrityError, transaction
+from django.db.models import F, Subquery
+
+
+class JoinRejected(Exception):
+    """The player cannot join; `str(exc)` is the message shown to the player"""
+
+
+def admit_player(pin, nickname, avatar_id=1, session_key=''):
+    """Atomically take a seat in a LOBBY session; returns the new player's id"""
+    from .models import KahootPlayer, KahootSession
+
+    try:
+        with transaction.atomic():
+            seated = KahootSession.objects.filter(
+                pin=pin, status='LOBBY', player_count__lt=F('max_players'),
+            ).update(player_count=F('player_count') + 1)
+            if not seated:
+                raise JoinRejected(rejection_reason(pin))
+            player = KahootPlayer.objects.create(
+                session_id=Subquery(KahootSession.objects.filter(pin=pin).order_by().values('id')),
+                nickname=nickname,
+                avatar_id=avatar_id,
+                session_key=session_key,
+            )
+    except IntegrityError:
+        raise JoinRejected("Bu ism allaqachon band. Boshqa ism tanlang.")
+    return player.id
+
+
+def rejection_reason(pin):
+    """Why the seat was not taken (only queried when a join fails)"""
+    from .models import KahootSession
+
+    session = KahootSession.objects.filter(pin=pin, status='LOBBY').values('max_players').first()
+    if session is None:
+        return "Bu PIN bilan o'yin topilmadi yoki u allaqachon boshlangan."
+    return f"O'yin to'ldi. Maksimal o'yinchilar soni: {session['max_players']}"
+
+
+def remove_player(pin, player_id):
+    """Delete a player and free its seat; returns False if it did not exist"""
+    from .models import KahootPlayer, KahootSession
+
+    with transaction.atomic():
+        deleted, _ = KahootPlayer.objects.filter(session__pin=pin, id=player_id).delete()
+        if deleted:
+            KahootSession.objects.filter(pin=pin, player_count__gt=0).update(
+                player_count=F('player_count') - 1,
+            )
+    return deleted > 0
@@ -0,0 +1,72 @@
+# Kahoot Mode broadcast helpers
+import asyncio
+import time
+
+from .kahoot_codec import encode_frames
+
+
+class CoalescingEmitter:
+    """
+    Runs `emit(key)` at most once per `interval` seconds for each key.
+
+    The first trigger is emitted right away; triggers arriving inside the
+    interval are merged into a single trailing emit, so `emit` always
+    reads and sends the latest value.
+    """
+
+    def __init__(self, interval, emit):
+        self.interval = interval
+        self.emit = emit
+        self._tasks = {}
+        self._last_sent = {}
+
+    def trigger(self, key):
+        if key in self._tasks:
+            return
+        elapsed = time.monotonic() - self._last_sent.get(key, float('-inf'))
+        delay = max(0.0, self.interval - elapsed)
+        self._tasks[key] = asyncio.ensure_future(self._run(key, delay))
+
+    async def _run(self, key, delay):
+        try:
+            if delay:
+                await asyncio.sleep(delay)
+        finally:
+            # emit paytida kelgan trigger yangi (keyingi) emitni rejalashtiradi
+            self._tasks.pop(key, None)
+        sent_at = self._last_sent[key] = time.monotonic()
+        # Interval o'tgach vaqt kerak emas: tugagan sessiyalar kalitlari to'planib qolmaydi
+        asyncio.get_running_loop().call_later(self.interval, self._forget, key, sent_at)
+        try:
+            await self.emit(key)
+        except Exception as e:
+            print(f"Error emitting update for {key}: {e}")
+
+    def _forget(self, key, sent_at):
+        if self._last_sent.get(key) == sent_at:
+            del self._last_sent[key]
+
+    def discard(self, key):
+        """Forget a key (e.g. when the game ends)"""
+        task = self._tasks.pop(key, None)
+        if task:
+            task.cancel()
+        self._last_sent.pop(key, None)
+
+
+async def group_send_frame(channel_layer, group, payload, **fields):
+    """
+    Send pre-encoded frames to a group. The message type doubles as the
+    consumer handler name; handlers forward the frame of their connection's
+    codec from event['frames'] verbatim. Extra `fields` travel next to the
+    frames for handlers that filter per connection.
+    """
+    await channel_layer.group_send(group, {
+        **fields,
+        'type': payload['type'],
+        'frames': encode_frames(payload),
+        # Qayta ulangan ulanish replay qilingan voqealarni takrorlamasligi uchun
+        'seq': payload.get('seq'),
+        # Sekin ulanishlar eskirgan yangilanishlarni tashlab yuborishi uchun
+        'sent_at': time.time(),
+    })
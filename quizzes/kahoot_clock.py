@@ -0,0 +1,66 @@
+# Kahoot Mode clock sync
+#
+# Server har bir ulanishga bir nechta clock_ping yuboradi (NTP uslubida):
+# klient darhol o'z soati bilan clock_pong qaytaradi. Eng kichik RTT'li
+# o'lchov klient soati farqini (offset) va tarmoq kechikishini beradi.
+# Savollar umumiy server vaqtida ochiladi, javob vaqtidan esa o'yinchining
+# kechikishi ayiriladi.
+import time
+
+from django.conf import settings
+
+
+# Ulanish boshida yuboriladigan ping'lar soni
+SYNC_SAMPLES = 3
+
+# Bir tomonlama kechikish uchun maksimal tuzatish (soniya): soxta kechikish bilan
+# ball yutib bo'lmaydi
+MAX_LATENCY_COMPENSATION = getattr(settings, 'KAHOOT_MAX_LATENCY_COMPENSATION', 0.5)
+
+# Savol shu vaqtdan (soniya) keyin ochiladi: hamma klient uni bir vaqtda ko'rsatadi
+QUESTION_LEAD = getattr(settings, 'KAHOOT_QUESTION_LEAD', 0.5)
+
+# Soat sinxronizatsiyasi xatosi uchun: savol ochilishidan shuncha (soniya) oldin
+# kelgan javob qabul qilinadi, undan oldingisi rad etiladi
+EARLY_ANSWER_TOLERANCE = getattr(settings, 'KAHOOT_EARLY_ANSWER_TOLERANCE', 0.1)
+
+
+class ClockSync:
+    """RTT and clock offset of one connection, from the best of SYNC_SAMPLES pings"""
+
+    def __init__(self):
+        self.samples = 0
+        self.rtt = None
+        self.offset = None  # klient soati - server soati
+        self.pending = None  # javob kutilayotgan ping vaqti
+
+    def ping(self):
+        """Next clock_ping payload, or the final clock_sync once enough samples arrived"""
+        if self.samples >= SYNC_SAMPLES:
+            return {'type': 'clock_sync', 'offset': self.offset, 'rtt': self.rtt}
+        self.pending = time.time()
+        return {'type': 'clock_ping', 'server_time': self.pending, 'offset': self.offset}
+
+    def pong(self, server_time, client_time):
+        """Record a clock_pong; False if it does not answer the outstanding ping"""
+        # JSON kodlashda float oxirgi xonalarini yo'qotishi mumkin
+        if self.pending is None or not isinstance(server_time, (int, float)):
+            return False
+        if abs(server_time - self.pending) > 1e-3:
+            return False
+        if not isinstance(client_time, (int, float)) or isinstance(client_time, bool):
+            return False
+        sent_at, self.pending = self.pending, None
+        self.samples += 1
+        rtt = time.time() - sent_at
+        if self.rtt is None or rtt < self.rtt:
+            self.rtt = rtt
+            # Pong ping'dan taxminan RTT/2 keyin jo'natilgan
+            self.offset = client_time - (sent_at + rtt / 2)
+        return True
+
+    def latency(self):
+        """One-way network delay to deduct from answer times"""
+        if self.rtt is None:
+            return 0.0
+        return min(self.rtt / 2, MAX_LATENCY_COMPENSATION)
@@ -0,0 +1,86 @@
+# Kahoot Mode wire codecs
+#
+# Har bir WebSocket ulanishi o'z codec'ini tanlaydi: standart holatda JSON
+# matn, "kahoot.msgpack" subprotocol bilan esa qisqa kalitli binary msgpack.
+try:
+    import ujson as json
+except ImportError:  # pragma: no cover
+    import json
+
+import msgpack
+
+
+MSGPACK_SUBPROTOCOL = 'kahoot.msgpack'
+
+# Eng ko'p yuboriladigan xabarlar uchun qisqa kalitlar (msgpack rejimida)
+SHORT_KEYS = {
+    'type': 't',
+    'action': 'a',
+    'player_id': 'p',
+    'selected_option': 'o',
+    'is_correct': 'c',
+    'points_earned': 'e',
+    'total_score': 's',
+    'rank': 'r',
+    'late': 'l',
+    'question': 'q',
+    'question_id': 'i',
+    'index': 'x',
+    'total': 'n',
+    'text': 'tx',
+    'image': 'im',
+    'options': 'op',
+    'time_limit': 'tl',
+}
+LONG_KEYS = {short: key for key, short in SHORT_KEYS.items()}
+
+COMPACT_TYPES = {'submit_answer', 'answer_result', 'show_question'}
+
+
+def _rename_keys(value, mapping):
+    if isinstance(value, dict):
+        return {mapping.get(k, k): _rename_keys(v, mapping) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_rename_keys(v, mapping) for v in value]
+    return value
+
+
+class JsonCodec:
+    name = 'json'
+    binary = False
+
+    def encode(self, payload):
+        return json.dumps(payload)
+
+    def decode(self, data):
+        return json.loads(data)
+
+
+class MsgpackCodec:
+    """Binary frames; hot messages travel with SHORT_KEYS"""
+    name = 'msgpack'
+    binary = True
+
+    def encode(self, payload):
+        if payload.get('type') in COMPACT_TYPES:
+            payload = _rename_keys(payload, SHORT_KEYS)
+        return msgpack.packb(payload)
+
+    def decode(self, data):
+        return _rename_keys(msgpack.unpackb(data), LONG_KEYS)
+
+
+CODECS = {codec.name: codec for codec in (JsonCodec(), MsgpackCodec())}
+DEFAULT_CODEC = CODECS['json']
+
+
+def negotiate_codec(subprotocols):
+    """Pick the codec requested by the client's Sec-WebSocket-Protocol list"""
+    if MSGPACK_SUBPROTOCOL in (subprotocols or []):
+        return CODECS['msgpack'], MSGPACK_SUBPROTOCOL
+    return DEFAULT_CODEC, None
+
+
+def encode_frames(payload):
+    """Serialize a broadcast once per codec: {codec name: frame}"""
+    return {name: codec.encode(payload) for name, codec in CODECS.items()}
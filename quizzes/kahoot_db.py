@@ -0,0 +1,111 @@
+# Kahoot Mode database executor
+#
+# Consumer va game loop'ning baza ishlari asgiref'ning umumiy thread-sensitive
+# executor'ida (bitta thread) emas, shu yerdagi cheklangan thread pool'da
+# bajariladi: bitta o'yindagi sekin so'rov boshqa o'yinlarning baza ishini
+# navbatda ushlab turmaydi. Django'ning async ORM metodlari (aget, aupdate...)
+# ham o'sha umumiy thread'da ishlaydi, shu sababli ular ishlatilmaydi.
+# Navbat chuqurligi va kutish vaqti DB_STATS'da yig'iladi.
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+
+
+# Bir vaqtda bazaga murojaat qiladigan thread'lar soni (DB ulanishlari ham shuncha)
+DB_WORKERS = getattr(settings, 'KAHOOT_DB_WORKERS', 8)
+
+
+class ExecutorStats:
+    """Queue depth and wait times of the database executor (thread-safe)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.queued = 0  # thread kutayotgan ishlar
+            self.running = 0
+            self.completed = 0
+            self.max_queued = 0
+            self.total_wait = 0.0
+            self.max_wait = 0.0
+
+    def submit(self):
+        """Count a new job; returns its ticket ({'enqueued_at', 'claimed'})"""
+        with self.lock:
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+        return {'enqueued_at': time.monotonic(), 'claimed': False}
+
+    def start(self, ticket):
+        """A worker thread picked the job up; False if the caller already gave up on it"""
+        with self.lock:
+            if ticket['claimed']:
+                return False
+            ticket['claimed'] = True
+            wait = time.monotonic() - ticket['enqueued_at']
+            self.queued -= 1
+            self.running += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            return True
+
+    def finish(self):
+        with self.lock:
+            self.running -= 1
+            self.completed += 1
+
+    def abandon(self, ticket):
+        """The awaiting task was cancelled; drop the job if no thread has started it"""
+        with self.lock:
+            if not ticket['claimed']:
+                ticket['claimed'] = True
+                self.queued -= 1
+
+    def snapshot(self):
+        with self.lock:
+            started = self.completed + self.running
+            return {
+                'queued': self.queued,
+                'running': self.running,
+                'completed': self.completed,
+                'max_queued': self.max_queued,
+                'avg_wait': self.total_wait / started if started else 0.0,
+                'max_wait': self.max_wait,
+            }
+
+
+DB_STATS = ExecutorStats()
+
+_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix='kahoot-db')
+
+
+def db_task(func):
+    """
+    Like database_sync_to_async, but runs `func` on the dedicated Kahoot
+    executor (connections are still closed per Django's CONN_MAX_AGE).
+    """
+    def run(ticket, *args, **kwargs):
+        if not DB_STATS.start(ticket):
+            return None
+        try:
+            return func(*args, **kwargs)
+        finally:
+            DB_STATS.finish()
+
+    run_async = database_sync_to_async(run, thread_sensitive=False, executor=_executor)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        ticket = DB_STATS.submit()
+        try:
+            return await run_async(ticket, *args, **kwargs)
+        finally:
+            DB_STATS.abandon(ticket)
+
+    return wrapper
@@ -0,0 +1,81 @@
+# Kahoot Mode per-connection limits
+#
+# Har bir WebSocket ulanishi har bir action uchun o'z token bucket'iga ega:
+# limitdan oshgan xabarlar bazaga yoki guruhga yetmasdan tashlab yuboriladi.
+# Sekin ulanishlarga esa eskirgan, muhim bo'lmagan yangilanishlar yuborilmaydi.
+import time
+
+from django.conf import settings
+
+
+# action: (sekundiga token, maksimal zaxira)
+DEFAULT_ACTION_LIMITS = {
+    'host_join': (0.5, 3),
+    'player_join': (0.5, 3),
+    'player_ready': (1, 5),
+    'submit_answer': (1, 3),
+    'start_game': (1, 3),
+    'next_question': (2, 5),
+    'show_results': (2, 5),
+    'end_game': (1, 3),
+    'kick_player': (5, 20),
+    'clock_pong': (1, 5),
+    'heartbeat': (1, 3),
+    '*': (10, 20),  # noma'lum actionlar
+}
+
+ACTION_LIMITS = {**DEFAULT_ACTION_LIMITS, **getattr(settings, 'KAHOOT_ACTION_LIMITS', {})}
+
+# Shu vaqtdan (soniya) ko'proq kechikkan muhim bo'lmagan frame'lar tashlab yuboriladi
+SHED_LAG = getattr(settings, 'KAHOOT_SHED_LAG', 1.0)
+
+# Keyingi yangilanish eskisini bekor qiladi
+COUNTER_FRAMES = {'answer_count_update', 'ready_progress'}
+
+
+class TokenBucket:
+    """`rate` tokens per second, holding at most `burst`"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class ActionLimiter:
+    """Token buckets of one connection, one per action"""
+
+    def __init__(self, limits=None):
+        self.limits = limits or ACTION_LIMITS
+        self.buckets = {}
+
+    def allow(self, action):
+        key = action if action in self.limits else '*'
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(*self.limits[key])
+        return bucket.take()
+
+
+def is_sheddable(event, lag=None):
+    """
+    Outbound backpressure: a counter frame that waited in this connection's
+    channel longer than SHED_LAG is dropped instead of growing the backlog
+    of a slow socket; the next update carries the current value anyway.
+    """
+    if event['type'] not in COUNTER_FRAMES:
+        return False
+    sent_at = event.get('sent_at')
+    if sent_at is None:
+        return False
+    return time.time() - sent_at > (SHED_LAG if lag is None else lag)
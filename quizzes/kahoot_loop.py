@@ -0,0 +1,507 @@
+# Kahoot Mode server-side game loop
+#
+# Har bir sessiya uchun bitta asyncio task o'yin holatini boshqaradi: savolni
+# ochadi, vaqtni server soati bo'yicha hisoblaydi va vaqt tugaganda savolni
+# o'zi yopadi. Host brauzeri qotib qolsa ham o'yin davom etadi.
+import asyncio
+import math
+import time
+from collections import deque
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from .kahoot_broadcast import CoalescingEmitter, group_send_frame
+from .kahoot_clock import QUESTION_LEAD
+from .kahoot_persistence import (
+    flush_pending_answers, get_live_state, save_checkpoint, save_standings,
+)
+from .kahoot_state import current_question, get_state_store, question_data
+
+
+# Tarmoqdagi kechikish uchun deadline'dan keyin qabul qilinadigan qo'shimcha vaqt
+ANSWER_GRACE = getattr(settings, 'KAHOOT_ANSWER_GRACE', 0.5)
+
+# Birinchi savol rosterning shu qismi game sahifasida tayyor bo'lganda
+# (player_ready) yoki READY_TIMEOUT o'tganda yuboriladi
+READY_FRACTION = getattr(settings, 'KAHOOT_READY_FRACTION', 0.9)
+READY_TIMEOUT = getattr(settings, 'KAHOOT_READY_TIMEOUT', 10.0)
+
+# Sessiyani boshqaruvchi worker lease'i; egasi javob bermasa shu vaqtdan keyin
+# boshqa worker o'yinni davom ettiradi
+LEASE_TTL = getattr(settings, 'KAHOOT_LEASE_TTL', 10.0)
+LEASE_RENEW_INTERVAL = LEASE_TTL / 3
+
+# Savol natijalaridan keyin shuncha vaqt (soniya) hech narsa bo'lmasa, tashlab
+# ketilgan o'yin tugatiladi (aks holda uning loop'lari abadiy lease kutadi)
+IDLE_TIMEOUT = getattr(settings, 'KAHOOT_IDLE_TIMEOUT', 30 * 60)
+
+
+class LeaseLost(Exception):
+    """The lease moved to another worker (or expired) before a transition was written"""
+
+
+def room_group_name(session_pin):
+    return f'kahoot_{session_pin}'
+
+
+def host_group_name(session_pin):
+    """Faqat host ekranlari (javoblar hisoblagichi kabi xabarlar uchun)"""
+    return f'kahoot_{session_pin}_host'
+
+
+async def get_answer_count(session_pin):
+    store = get_state_store()
+    state = await store.get_state(session_pin)
+    question = state and current_question(state)
+    if not question:
+        return {'count': 0, 'total': 0, 'connected': 0}
+    count = await store.count_answers(session_pin, question['question_id'])
+    total = await store.count_players(session_pin)
+    # Savol ulangan o'yinchilar javob berganda yopiladi: host shu sonni ko'radi
+    connected = await store.count_present(session_pin)
+    return {'count': count, 'total': total, 'connected': connected}
+
+
+async def send_answer_count(session_pin):
+    answer_count = await get_answer_count(session_pin)
+    await group_send_frame(get_channel_layer(), host_group_name(session_pin), {
+        'type': 'answer_count_update',
+        'count': answer_count['count'],
+        'total': answer_count['total'],
+        'connected': answer_count['connected'],
+    })
+
+
+# Har bir javobda emas, interval ichida bitta (oxirgi qiymat bilan) yuboriladi
+answer_count_emitter = CoalescingEmitter(
+    getattr(settings, 'KAHOOT_ANSWER_COUNT_INTERVAL', 0.1),
+    send_answer_count,
+)
+
+
+async def get_ready_progress(session_pin):
+    store = get_state_store()
+    ready = await store.count_ready(session_pin)
+    total = await store.count_players(session_pin)
+    return {'ready': ready, 'total': total, 'required': math.ceil(total * READY_FRACTION)}
+
+
+async def send_ready_progress(session_pin):
+    progress = await get_ready_progress(session_pin)
+    await group_send_frame(get_channel_layer(), host_group_name(session_pin), {
+        'type': 'ready_progress',
+        'ready': progress['ready'],
+        'total': progress['total'],
+        'required': progress['required'],
+    })
+
+
+ready_progress_emitter = CoalescingEmitter(
+    getattr(settings, 'KAHOOT_ANSWER_COUNT_INTERVAL', 0.1),
+    send_ready_progress,
+)
+
+
+# Roster o'zgarishlari shu jarayonda yig'iladi: {pin: {player_id: (change, info)}}
+_roster_changes = {}
+
+
+def record_roster_change(session_pin, player_id, change, info=None):
+    """`change` is 'joined', 'left' or 'kicked'; the latest change of a player wins"""
+    _roster_changes.setdefault(session_pin, {})[player_id] = (change, info)
+    roster_emitter.trigger(session_pin)
+
+
+async def send_roster_update(session_pin):
+    changes = _roster_changes.pop(session_pin, None)
+    if not changes:
+        return
+    payload = {
+        'type': 'roster_update',
+        'joined': [],
+        'left': [],
+        'kicked': [],
+        'total': await get_state_store().count_players(session_pin),
+        'connected': await get_state_store().count_present(session_pin),
+    }
+    for player_id, (change, info) in changes.items():
+        if change == 'joined':
+            payload['joined'].append(dict(info, player_id=player_id))
+        else:
+            payload[change].append(player_id)
+
+    # O'yinchi ekranlari rosterni ko'rsatmaydi: faqat host'ga, kick bo'lsa
+    # kick qilingan o'yinchi ham olishi uchun butun xonaga
+    group = room_group_name(session_pin) if payload['kicked'] else host_group_name(session_pin)
+    await group_send_frame(get_channel_layer(), group, payload, kicked=payload['kicked'])
+
+
+# Lobby to'lishi yoki o'yin oxiridagi uzilishlar N ta emas, interval ichida bitta xabar
+roster_emitter = CoalescingEmitter(
+    getattr(settings, 'KAHOOT_ROSTER_INTERVAL', 0.25),
+    send_roster_update,
+)
+
+
+class GameLoop:
+    """
+    State machine of one session, run as a single asyncio task.
+
+    Consumers submit commands ('start_game', 'check_ready', 'next_question',
+    'close_question', 'end_game'); the task executes them one at a time and
+    fires its own timer (question deadline, readiness timeout) on the server
+    clock.
+
+    With several workers every process holding sockets of the game has a
+    loop, but only the holder of the session lease (see the state store)
+    executes commands and timers. The others forward their commands to the
+    leader's channel and take over once the lease expires, so a game keeps
+    running when its worker dies. Phase transitions are compare-and-set
+    writes fenced by the lease: a leader that stalls past LEASE_TTL cannot
+    advance the game a second time. An end interrupted by a lost lease is
+    resumed by the next leader, and a command forwarded to an owner that
+    died before executing it is run by the loop that takes over. A game
+    left idle after a question's results for IDLE_TIMEOUT is ended.
+    """
+
+    def __init__(self, session_pin):
+        self.session_pin = session_pin
+        self.store = get_state_store()
+        self.commands = asyncio.Queue()
+        self.timer = None  # (deadline, command)
+        self.forwarded = deque()  # (command, phase): lease egasiga yuborilgan buyruqlar
+        self.finished = False
+        self.leader = False
+        self.channel_name = None
+        self.task = None
+
+    def ensure_running(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.run())
+
+    def submit(self, command):
+        self.commands.put_nowait(command)
+        self.ensure_running()
+
+    async def run(self):
+        layer = get_channel_layer()
+        # Boshqa workerlar buyruqlarni shu kanal orqali yuboradi (lease egasi nomi)
+        self.channel_name = await layer.new_channel()
+        receiver = asyncio.ensure_future(self.receive_commands(layer))
+        try:
+            while not self.finished:
+                if await self.acquire_lease():
+                    await self.resume_forwarded()
+                    await self.lead()
+                else:
+                    await self.follow(layer)
+        finally:
+            receiver.cancel()
+            if self.leader:
+                await self.store.release_lease(self.session_pin, self.channel_name)
+            if _game_loops.get(self.session_pin) is self:
+                del _game_loops[self.session_pin]
+
+    async def acquire_lease(self):
+        return await self.store.acquire_lease(self.session_pin, self.channel_name, LEASE_TTL)
+
+    async def receive_commands(self, layer):
+        while True:
+            message = await layer.receive(self.channel_name)
+            self.commands.put_nowait(message['command'])
+
+    async def lead(self):
+        """Execute commands and timers until the game ends or the lease is lost"""
+        self.leader = True
+        # Yangi leader ochiq savol yoki tayyorlik taymerini umumiy holatdan tiklaydi
+        state = await get_live_state(self.session_pin, self.store)
+        if state is None or state['status'] == 'FINISHED':
+            self.finished = True
+            return
+        self.timer = None
+        if state['status'] == 'PLAYING':
+            if state['ending']:
+                # Oldingi leader end_game'ni yarmida to'xtatgan: yakun davom ettiriladi
+                self.timer = (time.time(), 'end_game')
+            elif not state['question_closed']:
+                self.timer = (state['question_deadline'] + ANSWER_GRACE, 'close_question')
+            elif self.waiting_for_players(state):
+                self.timer = (state['ready_deadline'], 'next_question')
+            elif state['question_deadline'] is not None:
+                self.timer = (state['question_deadline'] + IDLE_TIMEOUT, 'end_game')
+
+        while not self.finished:
+            timeout = LEASE_RENEW_INTERVAL
+            if self.timer is not None:
+                timeout = min(timeout, max(0.0, self.timer[0] - time.time()))
+            try:
+                command = await asyncio.wait_for(self.commands.get(), timeout)
+            except asyncio.TimeoutError:
+                command = None
+
+            # Har bir qadamdan oldin lease yangilanadi; boshqa worker olib
+            # qo'ygan bo'lsa, bu worker o'yinni boshqarmaydi (double-advance yo'q)
+            if not await self.acquire_lease():
+                if command is not None:
+                    self.commands.put_nowait(command)
+                self.leader = False
+                self.timer = None
+                return
+
+            if command is None:
+                if self.timer is None or self.timer[0] > time.time():
+                    continue
+                command = self.timer[1]
+                self.timer = None
+            try:
+                await getattr(self, command)()
+            except LeaseLost:
+                # Boshqa worker o'yinni olgan: holat va taymerlar lease bilan qayta o'qiladi
+                self.leader = False
+                self.timer = None
+                return
+            except Exception as e:
+                print(f"Error in game loop {self.session_pin} ({command}): {e}")
+
+    async def follow(self, layer):
+        """Forward commands to the lease owner until it is time to retry the lease"""
+        state = await self.store.get_state(self.session_pin)
+        if state is None or state['status'] == 'FINISHED':
+            self.finished = True
+            return
+        owner = await self.store.get_lease_owner(self.session_pin)
+        if owner is None:
+            # Lease hozirgina bo'shadi: darhol qayta urinish
+            return
+        # Bosqichni o'zgartirgan buyruqlar egasi tomonidan bajarilgan
+        phase = self.phase(state)
+        self.forwarded = deque(item for item in self.forwarded if item[1] == phase)
+        retry_at = time.monotonic() + LEASE_RENEW_INTERVAL
+        while True:
+            timeout = retry_at - time.monotonic()
+            if timeout <= 0:
+                return
+            try:
+                command = await asyncio.wait_for(self.commands.get(), timeout)
+            except asyncio.TimeoutError:
+                return
+            # Egasi bajarmasdan o'lsa, buyruq lease'ni olgan loop'da qayta bajariladi
+            self.forwarded.append((command, self.phase(await self.store.get_state(self.session_pin))))
+            await layer.send(owner, {'type': 'game.command', 'command': command})
+
+    async def resume_forwarded(self):
+        """
+        Queue the commands forwarded to the previous owner that it never
+        executed: the game is still in the phase they were sent in
+        """
+        if not self.forwarded:
+            return
+        phase = self.phase(await self.store.get_state(self.session_pin))
+        for command, sent_in in self.forwarded:
+            if sent_in == phase:
+                self.commands.put_nowait(command)
+        self.forwarded.clear()
+
+    @staticmethod
+    def phase(state):
+        """Fields every command changes; equal phases mean a command had no effect"""
+        if state is None:
+            return None
+        return (
+            state['status'], state['current_question_index'], state['question_closed'], state['ending'],
+        )
+
+    async def broadcast(self, payload):
+        """O'yin voqeasi ketma-ketlik raqami bilan yuboriladi va replay buferida saqlanadi"""
+        seq = await self.store.append_event(self.session_pin, payload)
+        await group_send_frame(
+            get_channel_layer(), room_group_name(self.session_pin), dict(payload, seq=seq),
+        )
+
+    async def transition(self, state, expected, **fields):
+        """
+        Write a phase transition only if this loop still holds the lease and
+        the `expected` fields still have the values read into `state`
+        """
+        applied = await self.store.compare_and_set_state(
+            self.session_pin, self.channel_name, {key: state[key] for key in expected}, **fields,
+        )
+        if not applied:
+            raise LeaseLost()
+
+    @staticmethod
+    def waiting_for_players(state):
+        """O'yin boshlangan, lekin birinchi savol hali yuborilmagan"""
+        return (
+            state['status'] == 'PLAYING'
+            and state['current_question_index'] < 0
+            and state.get('ready_deadline') is not None
+        )
+
+    # ==================== COMMANDS ====================
+
+    async def start_game(self):
+        state = await get_live_state(self.session_pin, self.store)
+        if state is None or state['status'] != 'LOBBY':
+            return
+        ready_deadline = time.time() + READY_TIMEOUT
+        await self.transition(state, ('status',), status='PLAYING', ready_deadline=ready_deadline)
+
+        # Notify all players to switch to game screen
+        await self.broadcast({'type': 'game_started'})
+        # Checkpoint voqeadan keyin: tiklangan seq klientlar ko'rgan oxirgi raqam bo'ladi
+        await save_checkpoint(self.session_pin, self.store)
+
+        # Birinchi savol o'yinchilar tayyor bo'lganda (yoki timeout'da) yuboriladi
+        if state['questions']:
+            self.timer = (ready_deadline, 'next_question')
+            await self.check_ready()
+
+    async def check_ready(self):
+        """Readiness barrier: yetarli o'yinchi tayyor bo'lsa, birinchi savol ochiladi"""
+        state = await get_live_state(self.session_pin, self.store)
+        if state is None or not self.waiting_for_players(state):
+            return
+        ready_progress_emitter.trigger(self.session_pin)
+        progress = await get_ready_progress(self.session_pin)
+        if progress['ready'] >= progress['required']:
+            self.timer = None
+            await self.next_question()
+
+    async def next_question(self):
+        state = await get_live_state(self.session_pin, self.store)
+        if state is None or state['status'] != 'PLAYING' or state['ending']:
+            return
+
+        # Oldingi savol javoblari (yopilmagan bo'lsa ham) saqlanadi
+        await flush_pending_answers(self.session_pin, self.store)
+
+        index = state['current_question_index'] + 1
+        question = question_data(state, index)
+        if question is None:
+            # No more questions, end game
+            await self.end_game()
+            return
+
+        # Savol umumiy server vaqtida ochiladi (klientlar soat farqini hisobga oladi)
+        start_time = time.time() + QUESTION_LEAD
+        deadline = start_time + question['time_limit']
+        # Flush paytida lease boshqa workerga o'tgan bo'lsa, savol ikki marta ochilmaydi
+        await self.transition(
+            state, ('status', 'current_question_index'),
+            current_question_index=index,
+            question_start_time=start_time,
+            question_deadline=deadline,
+            question_closed=False,
+            ready_deadline=None,
+        )
+        self.timer = (deadline + ANSWER_GRACE, 'close_question')
+
+        # Player va Host uchun savol matni va variant matnlari aniq yuboriladi
+        await self.broadcast({
+            'type': 'show_question',
+            'question': {
+                'question_id': question['question_id'],
+                'index': question['index'],
+                'total': question['total'],
+                'text': question['text'],
+                'image': question['image'],
+                'options': question['options'],
+                'time_limit': question['time_limit'],
+                'starts_at': start_time,
+                'deadline': deadline,
+            },
+        })
+        await save_checkpoint(self.session_pin, self.store)
+
+    async def close_question(self):
+        """Savolni yopish: javoblar saqlanadi va natijalar hammaga yuboriladi"""
+        state = await get_live_state(self.session_pin, self.store)
+        if state is None or state['status'] != 'PLAYING' or state['question_closed']:
+            return
+        self.timer = None
+        await self.transition(
+            state, ('current_question_index', 'question_closed'), question_closed=True,
+        )
+
+        # Savol yopildi: buferdagi javoblar bitta bulk_create bilan yoziladi
+        await flush_pending_answers(self.session_pin, self.store)
+        results = await self.get_question_results(state)
+        # Host keyingi savolni ochmasa, o'yin IDLE_TIMEOUT'dan keyin tugatiladi
+        self.timer = (time.time() + IDLE_TIMEOUT, 'end_game')
+
+        await self.broadcast({
+            'type': 'question_results',
+            'results': results,
+        })
+        await save_checkpoint(self.session_pin, self.store)
+
+    async def end_game(self):
+        """
+        End the game and show podium. FINISHED is checkpointed only after the
+        last answers and the final standings are written (the podium page
+        treats a FINISHED session as complete) and after game_ended, whose
+        sequence number the checkpoint records.
+        """
+        state = await get_live_state(self.session_pin, self.store)
+        if state is None or state['status'] == 'FINISHED':
+            self.finished = True
+            return
+        self.timer = None
+        # Javoblar qabul qilinmaydi; status yakuniy reyting yozilgandan keyin o'zgaradi.
+        # Lease shu orada yo'qolsa, keyingi leader `ending`ni ko'rib yakunni davom ettiradi
+        await self.transition(state, ('status',), question_closed=True, ending=True)
+        await flush_pending_answers(self.session_pin, self.store)
+        await save_standings(self.session_pin)
+        await self.transition(state, ('status',), status='FINISHED')
+        self.finished = True
+        answer_count_emitter.discard(self.session_pin)
+        ready_progress_emitter.discard(self.session_pin)
+
+        podium = await self.get_podium()
+
+        await self.broadcast({
+            'type': 'game_ended',
+            'podium': podium,
+        })
+        await save_checkpoint(self.session_pin, self.store)
+
+    # ==================== RESULTS ====================
+
+    async def get_question_results(self, state):
+        question = current_question(state)
+        if not question:
+            return {}
+
+        # Har bir variant uchun javoblar soni (javob kelganda hisoblab boriladi)
+        answer_counts = await self.store.get_answer_tally(self.session_pin, question['question_id'])
+
+        # Top 5 o'yinchi
+        top_players = [
+            {'nickname': p['nickname'], 'score': p['score'], 'avatar_id': p['avatar_id']}
+            for p in await self.store.get_top_players(self.session_pin, 5)
+        ]
+
+        return {
+            'correct_option': question['correct_option'],
+            'answer_counts': answer_counts,
+            'top_players': top_players,
+        }
+
+    async def get_podium(self):
+        return [
+            {'nickname': p['nickname'], 'score': p['score'], 'avatar_id': p['avatar_id']}
+            for p in await self.store.get_top_players(self.session_pin, 3)
+        ]
+
+
+_game_loops = {}
+
+
+def get_game_loop(session_pin):
+    """Shu jarayondagi sessiya game loop'i (kerak bo'lsa yaratiladi)"""
+    loop = _game_loops.get(session_pin)
+    if loop is None:
+        loop = _game_loops[session_pin] = GameLoop(session_pin)
+    return loop
@@ -0,0 +1,275 @@
+# Kahoot Mode write-behind persistence
+#
+# Javoblar o'yin davomida state store'da buferlanadi va savol yopilganda
+# (yoki o'yin tugaganda) bitta bulk_create bilan bazaga yoziladi. Har bir
+# bosqich o'zgarishida jonli holat checkpoint qilinadi: qayta ishga tushgan
+# worker o'yinni shu yerdan davom ettiradi. O'yin tugaganda yakuniy reyting
+# KahootStanding'ga bir marta yoziladi: podium va natijalar sahifalari
+# o'yinchilar jadvalini qayta saralamaydi.
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import DatabaseError, transaction
+from django.db.models import Avg, Count, Q
+
+from .kahoot_db import db_task
+from .kahoot_state import ANSWER_OPTIONS, InMemoryGameStateStore, current_question, get_state_store
+
+
+# Ustunlarda saqlanmaydigan holat maydonlari (checkpoint JSON'ida)
+CHECKPOINT_FIELDS = ('question_deadline', 'question_closed', 'ready_deadline')
+
+
+def load_live_state(session_pin):
+    """
+    Sessiya, savollar, o'yinchilar, ballar va joriy savolning saqlangan
+    javoblarini bazadan bir marta yuklash (oxirgi checkpoint bilan)
+    """
+    from .models import KahootAnswer, KahootSession
+    try:
+        session = KahootSession.objects.select_related('quiz').get(pin=session_pin)
+    except KahootSession.DoesNotExist:
+        return None
+
+    questions = session.get_questions()
+    index = session.current_question_index
+    start_time = session.question_start_time.timestamp() if session.question_start_time else None
+    deadline = None
+    if start_time is not None and 0 <= index < len(questions):
+        deadline = start_time + questions[index]['time_limit']
+    state = {
+        'session_id': session.id,
+        'quiz_title': session.quiz.title,
+        'status': session.status,
+        'current_question_index': index,
+        'question_start_time': start_time,
+        'question_deadline': deadline,
+        # Qayta yuklanganda ochiq savol vaqti o'tgan bo'lsa, u yopilgan hisoblanadi
+        'question_closed': deadline is None,
+        'ready_deadline': None,
+        # end_game boshlangan, lekin FINISHED hali yozilmagan
+        'ending': False,
+        'max_players': getattr(session, 'max_players', 50) or 50,
+        'questions': questions,
+    }
+    checkpoint = session.live_checkpoint or {}
+    for key in CHECKPOINT_FIELDS:
+        if key in checkpoint:
+            state[key] = checkpoint[key]
+
+    roster, scores = {}, {}
+    for p in session.players.all():
+        roster[p.id] = {
+            'nickname': p.nickname,
+            'avatar_id': p.avatar_id,
+            'joined_at': p.joined_at.timestamp(),
+        }
+        scores[p.id] = p.score
+
+    # Qayta yuklangan joriy savolga takroriy javob (ikki marta ball) berilmasligi uchun
+    answers = {}
+    question = current_question(state)
+    if question and session.status == 'PLAYING':
+        answers[question['question_id']] = {
+            a.player_id: {
+                'selected_option': a.selected_option,
+                'is_correct': a.is_correct,
+                'time_taken': a.time_taken,
+                'points_earned': a.points_earned,
+                'answered_at': a.answered_at.timestamp(),
+            }
+            for a in KahootAnswer.objects.filter(
+                player__session=session, question_id=question['question_id'],
+            )
+        }
+    return state, roster, scores, answers, checkpoint.get('seq', 0)
+
+
+async def get_live_state(session_pin, store=None):
+    """Sessiya holatini storedan olish (birinchi marta bazadan yuklanadi)"""
+    store = store or get_state_store()
+    state = await store.get_state(session_pin)
+    if state is None:
+        snapshot = await db_task(load_live_state)(session_pin)
+        if snapshot is None:
+            return None
+        await store.init_session(session_pin, *snapshot)
+        state = await store.get_state(session_pin)
+    return state
+
+
+def write_checkpoint(session_pin, state, seq):
+    from .models import KahootSession
+    start_time = state.get('question_start_time')
+    KahootSession.objects.filter(pin=session_pin).update(
+        status=state['status'],
+        current_question_index=state['current_question_index'],
+        question_start_time=(
+            datetime.fromtimestamp(start_time, tz=dt_timezone.utc) if start_time else None
+        ),
+        live_checkpoint=dict({key: state.get(key) for key in CHECKPOINT_FIELDS}, seq=seq),
+    )
+
+
+async def save_checkpoint(session_pin, store=None):
+    """
+    Checkpoint a phase transition with one UPDATE: status and question
+    columns plus the timers and event sequence they cannot express. Scores
+    and answers reach the database through flush_pending_answers.
+    """
+    store = store or get_state_store()
+    state = await store.get_state(session_pin)
+    if state is None:
+        return
+    seq = await store.get_event_seq(session_pin)
+    await db_task(write_checkpoint)(session_pin, state, seq)
+
+
+def persist_answers(pending, scores):
+    """
+    Write buffered answers with one bulk_create and the affected players'
+    totals with one bulk_update. Safe to repeat: existing answers are skipped.
+    Answers whose question or player was deleted meanwhile are dropped, so
+    one such row cannot make every later flush fail.
+    """
+    # Kick qilingan (rosterda yo'q) o'yinchilarning va yaroqsiz variantli javoblar tashlab yuboriladi
+    pending = [
+        (qid, pid, answer) for qid, pid, answer in pending
+        if pid in scores and answer.get('selected_option') in ANSWER_OPTIONS
+    ]
+    if not pending:
+        return 0
+    try:
+        return write_answers(pending, scores)
+    except DatabaseError as e:
+        # Odatda o'yin davomida o'chirilgan savol yoki o'yinchi (FK): faqat shu qatorlar tashlanadi
+        kept = drop_orphaned_answers(pending)
+        print(f"Error persisting answers ({e}): dropped {len(pending) - len(kept)} orphaned")
+        return write_answers(kept, scores) if kept else 0
+
+
+def write_answers(pending, scores):
+    from .models import KahootAnswer, KahootPlayer
+
+    answers = [
+        KahootAnswer(
+            player_id=player_id,
+            question_id=question_id,
+            selected_option=answer['selected_option'],
+            is_correct=answer['is_correct'],
+            time_taken=answer['time_taken'],
+            points_earned=answer['points_earned'],
+            answered_at=datetime.fromtimestamp(answer['answered_at'], tz=dt_timezone.utc),
+        )
+        for question_id, player_id, answer in pending
+    ]
+    players = [
+        KahootPlayer(id=player_id, score=scores[player_id])
+        for player_id in {pid for _, pid, _ in pending}
+    ]
+    with transaction.atomic():
+        KahootAnswer.objects.bulk_create(answers, ignore_conflicts=True)
+        KahootPlayer.objects.bulk_update(players, ['score'])
+    return len(answers)
+
+
+def drop_orphaned_answers(pending):
+    """Keep the answers whose question and player still exist"""
+    from .models import KahootPlayer, KahootQuestion
+
+    question_ids = set(KahootQuestion.objects.filter(
+        id__in={qid for qid, _, _ in pending},
+    ).values_list('id', flat=True))
+    player_ids = set(KahootPlayer.objects.filter(
+        id__in={pid for _, pid, _ in pending},
+    ).values_list('id', flat=True))
+    return [
+        (qid, pid, answer) for qid, pid, answer in pending
+        if qid in question_ids and pid in player_ids
+    ]
+
+
+async def flush_pending_answers(pin, store=None):
+    """
+    Persist every buffered answer of a session; returns the number written.
+    Never raises: a failed flush keeps the buffer for the next one and must
+    not stop the game loop from broadcasting or advancing.
+    """
+    store = store or get_state_store()
+    pending = await store.get_pending_answers(pin)
+    if not pending:
+        return 0
+    scores = await store.get_scores(pin)
+    try:
+        written = await db_task(persist_answers)(pending, scores)
+    except Exception as e:
+        print(f"Error flushing answers for session {pin}: {e}")
+        return 0
+    # Bazaga yozilgandan (yoki tashlangandan) keyingina buferdan o'chiriladi (crash bo'lsa qayta yoziladi)
+    await store.discard_pending_answers(pin, [(qid, pid) for qid, pid, _ in pending])
+    return written
+
+
+def write_standings(session_pin):
+    """
+    Materialize the final ranking with one aggregate SELECT and one bulk
+    upsert. Safe to repeat: existing standings are replaced, so a rerun
+    after late answers were flushed corrects them.
+    """
+    from .models import KahootPlayer, KahootStanding
+
+    players = (
+        KahootPlayer.objects.filter(session__pin=session_pin)
+        .annotate(
+            correct_count=Count('answers', filter=Q(answers__is_correct=True)),
+            avg_time=Avg('answers__time_taken'),
+        )
+        .order_by('-score', 'joined_at', 'id')
+        .values('id', 'session_id', 'score', 'correct_count', 'avg_time')
+    )
+    standings, rank, previous = [], 0, None
+    for position, p in enumerate(players, 1):
+        # Teng ball - teng o'rin (1, 2, 2, 4), store'dagi get_rank kabi
+        if p['score'] != previous:
+            rank, previous = position, p['score']
+        standings.append(KahootStanding(
+            session_id=p['session_id'],
+            player_id=p['id'],
+            rank=rank,
+            score=p['score'],
+            correct_count=p['correct_count'],
+            avg_time=p['avg_time'],
+        ))
+    KahootStanding.objects.bulk_create(
+        standings, update_conflicts=True, unique_fields=['player'],
+        update_fields=['rank', 'score', 'correct_count', 'avg_time'],
+    )
+    return len(standings)
+
+
+async def save_standings(session_pin):
+    """
+    Write the final standings once the last answers are flushed. Never
+    raises: standings missing after an error are written by the
+    kahoot_standings management command.
+    """
+    try:
+        return await db_task(write_standings)(session_pin)
+    except Exception as e:
+        print(f"Error saving standings for session {session_pin}: {e}")
+        return 0
+
+
+def flush_on_shutdown():
+    """
+    atexit hook: the in-process buffer would be lost with the process, so it
+    is written synchronously. The Redis buffer outlives the worker and is
+    flushed by the next question close instead.
+    """
+    store = get_state_store()
+    if not isinstance(store, InMemoryGameStateStore):
+        return
+    for pin, pending, scores in store.drain_pending():
+        try:
+            persist_answers(pending, scores)
+        except Exception as e:
+            print(f"Error flushing answers for session {pin}: {e}")
@@ -0,0 +1,77 @@
+# Kahoot Mode PIN allocation
+#
+# PIN tasodifiy emas: sessiya id'si 10^6 ta PIN ustidagi kalitli Feistel
+# permutatsiyasidan o'tkaziladi. Ketma-ket id'lar takrorlanmaydigan (va
+# taxmin qilib bo'lmaydigan) PIN beradi, shuning uchun odatda collision yo'q.
+# 10^6 sessiyadan keyin PIN faqat tugagan yoki eskirgan sessiyadan qaytarib
+# olinadi. PIN'ni eski (tasodifiy yoki boshqa SECRET_KEY bilan olingan) tirik
+# sessiya ushlab turgan bo'lsa, boshqa kalitli permutatsiya sinab ko'riladi.
+import hashlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+
+PIN_SPACE = 10 ** 6
+HALF = 10 ** 3  # PIN = 3 xonali chap va o'ng yarim
+ROUNDS = 4
+
+# Tugamagan sessiya PIN'i shu vaqtdan (soniya) keyin eskirgan hisoblanadi
+PIN_REUSE_AFTER = getattr(settings, 'KAHOOT_PIN_REUSE_AFTER', 24 * 60 * 60)
+
+# Band PIN uchun nechta permutatsiya sinab ko'riladi
+PIN_ATTEMPTS = 8
+
+
+def _round_keys(attempt):
+    # Birinchi urinish kaliti o'zgarmaydi: mavjud sessiyalar PIN'i shunga tayanadi
+    salt = f'kahoot-pin:{attempt}:' if attempt else 'kahoot-pin:'
+    digest = hashlib.sha256(f'{salt}{settings.SECRET_KEY}'.encode()).digest()
+    return [int.from_bytes(digest[i * 4:(i + 1) * 4], 'big') for i in range(ROUNDS)]
+
+
+def _round(value, key):
+    digest = hashlib.sha256(f'{key}:{value}'.encode()).digest()
+    return int.from_bytes(digest[:4], 'big') % HALF
+
+
+def permute_pin(number, attempt=0):
+    """
+    Bijection of range(PIN_SPACE) onto itself, as a zero-padded 6 digit
+    string; every `attempt` is a differently keyed permutation.
+    """
+    left, right = divmod(number % PIN_SPACE, HALF)
+    for key in _round_keys(attempt):
+        left, right = right, (left + _round(right, key)) % HALF
+    return f'{left * HALF + right:06d}'
+
+
+def allocate_pin(session_id):
+    """
+    Give a freshly inserted session its PIN. The only older session that can
+    hold the same PIN is one created PIN_SPACE ids earlier (or a legacy random
+    PIN, or one allocated under an older SECRET_KEY); it releases the PIN if
+    finished or older than PIN_REUSE_AFTER. A PIN still held by a live session
+    is skipped for the next permutation; IntegrityError is raised only after
+    PIN_ATTEMPTS of them. Call inside the transaction that inserted the session.
+    """
+    from .models import KahootSession
+
+    cutoff = timezone.now() - timedelta(seconds=PIN_REUSE_AFTER)
+    for attempt in range(PIN_ATTEMPTS):
+        pin = permute_pin(session_id, attempt)
+        try:
+            # Savepoint: band PIN sessiyani yozgan tranzaksiyani buzmaydi
+            with transaction.atomic():
+                KahootSession.objects.filter(pin=pin).filter(
+                    Q(status='FINISHED') | Q(created_at__lt=cutoff)
+                ).update(pin=None)
+                KahootSession.objects.filter(id=session_id).update(pin=pin)
+        except IntegrityError:
+            if attempt + 1 == PIN_ATTEMPTS:
+                raise
+            continue
+        return pin
@@ -0,0 +1,23 @@
+# Kahoot Mode presence
+#
+# Server har bir ulanishga HEARTBEAT_INTERVAL'da heartbeat yuboradi, klient
+# heartbeat bilan javob qaytaradi. HEARTBEAT_TIMEOUT davomida hech narsa
+# yubormagan ulanish (yarim ochiq TCP, uxlab qolgan telefon) yopiladi va
+# guruhdan chiqariladi. Ulangan o'yinchilar store'dagi presence to'plamida
+# turadi: hisoblagichlar bazadan emas, shu to'plamdan olinadi.
+from django.conf import settings
+
+
+HEARTBEAT_INTERVAL = getattr(settings, 'KAHOOT_HEARTBEAT_INTERVAL', 15.0)
+HEARTBEAT_TIMEOUT = getattr(settings, 'KAHOOT_HEARTBEAT_TIMEOUT', 45.0)
+
+
+async def everyone_answered(store, pin, question_id):
+    """Every connected player answered; disconnected players do not hold the question open"""
+    connected = await store.count_present(pin)
+    if not connected or await store.count_answers(pin, question_id) < connected:
+        return False
+    # Hisoblagichlar yetarli bo'lgandagina (savol oxirida) to'plamlar solishtiriladi:
+    # chiqib ketgan o'yinchining javobi ulanganlardan birining o'rnini bosmaydi
+    answers = await store.get_answers(pin, question_id)
+    return all(player_id in answers for player_id in await store.get_present(pin))
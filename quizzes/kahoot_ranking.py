@@ -0,0 +1,143 @@
+# Kahoot Mode incremental ranking
+#
+# Har bir javobdan keyin butun ro'yxatni saralash o'rniga o'yinchilar
+# tartiblangan daraxtda saqlanadi: ball qo'shish, o'rin va top-K O(log N).
+import random
+
+
+class _Node:
+    __slots__ = ('key', 'priority', 'left', 'right', 'size')
+
+    def __init__(self, key):
+        self.key = key
+        self.priority = random.random()
+        self.left = None
+        self.right = None
+        self.size = 1
+
+
+def _size(node):
+    return node.size if node else 0
+
+
+def _update(node):
+    node.size = 1 + _size(node.left) + _size(node.right)
+
+
+def _split(node, key):
+    """Split into (keys < key, keys >= key)"""
+    if node is None:
+        return None, None
+    if node.key < key:
+        left, right = _split(node.right, key)
+        node.right = left
+        _update(node)
+        return node, right
+    left, right = _split(node.left, key)
+    node.left = right
+    _update(node)
+    return left, node
+
+
+def _merge(left, right):
+    """Merge two treaps where every key of `left` is below every key of `right`"""
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        _update(left)
+        return left
+    right.left = _merge(left, right.left)
+    _update(right)
+    return right
+
+
+def _delete(node, key):
+    if node is None:
+        return None
+    if key == node.key:
+        return _merge(node.left, node.right)
+    if key < node.key:
+        node.left = _delete(node.left, key)
+    else:
+        node.right = _delete(node.right, key)
+    _update(node)
+    return node
+
+
+class RankingIndex:
+    """
+    Order-statistic treap of players keyed by (-score, joined_at, player_id).
+
+    Ranks are competition ranks: players with equal scores share a place.
+    top() breaks ties by join order, like the old order_by('-score', 'joined_at').
+    """
+
+    def __init__(self):
+        self._root = None
+        self._keys = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, player_id):
+        return player_id in self._keys
+
+    def set_score(self, player_id, score, joined_at=0):
+        old_key = self._keys.get(player_id)
+        if old_key is not None:
+            self._root = _delete(self._root, old_key)
+            joined_at = old_key[1]
+        key = (-score, joined_at, player_id)
+        left, right = _split(self._root, key)
+        self._root = _merge(_merge(left, _Node(key)), right)
+        self._keys[player_id] = key
+
+    def add_points(self, player_id, points):
+        """Add points and return the new score"""
+        score = self.score(player_id) + points
+        self.set_score(player_id, score)
+        return score
+
+    def remove(self, player_id):
+        key = self._keys.pop(player_id, None)
+        if key is not None:
+            self._root = _delete(self._root, key)
+
+    def score(self, player_id):
+        key = self._keys.get(player_id)
+        return -key[0] if key else 0
+
+    def scores(self):
+        return {player_id: -key[0] for player_id, key in self._keys.items()}
+
+    def rank_for_score(self, score):
+        """1 + number of players with a strictly higher score"""
+        bound = (-score,)
+        node, count = self._root, 0
+        while node is not None:
+            if node.key < bound:
+                count += _size(node.left) + 1
+                node = node.right
+            else:
+                node = node.left
+        return count + 1
+
+    def rank(self, player_id):
+        if player_id not in self._keys:
+            return 0
+        return self.rank_for_score(self.score(player_id))
+
+    def top(self, k):
+        """[(player_id, score), ...] for the best `k` players"""
+        result, stack, node = [], [], self._root
+        while (stack or node is not None) and len(result) < k:
+            while node is not None:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            result.append((node.key[2], -node.key[0]))
+            node = node.right
+        return result
@@ -0,0 +1,838 @@
+# Kahoot Mode live game state
+#
+# O'yin davomida sessiya holati (status, joriy savol, vaqt, o'yinchilar, ballar)
+# shu yerda saqlanadi. Ma'lumotlar bazasiga faqat holat o'zgarganda yoziladi.
+import asyncio
+import json
+import time
+import weakref
+from collections import deque
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .kahoot_ranking import RankingIndex
+
+
+DEFAULT_STATE_TTL = 6 * 60 * 60  # 6 soat
+
+# Qayta ulangan klientga yuborish uchun saqlanadigan oxirgi o'yin voqealari soni
+DEFAULT_REPLAY_SIZE = 128
+
+ANSWER_OPTIONS = ('A', 'B', 'C', 'D')
+
+
+def current_question(state):
+    """Joriy savol (to'g'ri javob bilan) yoki None"""
+    index = state['current_question_index']
+    questions = state.get('questions', [])
+    if index < 0 or index >= len(questions):
+        return None
+    return questions[index]
+
+
+def question_data(state, index):
+    """Savolning o'yinchilarga ko'rinadigan qismi (to'g'ri javobsiz)"""
+    questions = state.get('questions', [])
+    if index < 0 or index >= len(questions):
+        return None
+    q = questions[index]
+    return {
+        'index': index,
+        'total': len(questions),
+        'text': q['text'],
+        'image': q['image'],
+        'options': q['options'],
+        'time_limit': q['time_limit'],
+        'question_id': q['question_id'],
+    }
+
+
+class BaseGameStateStore:
+    """
+    Live state of running Kahoot sessions, keyed by session PIN.
+
+    state:   status, current_question_index, question_start_time,
+             question_deadline, question_closed, ready_deadline, ending,
+             quiz_title, max_players, session_id, questions
+    roster:  {player_id: {'nickname', 'avatar_id', 'joined_at'}}
+    scores:  {player_id: score}, kept in a ranking index (O(log N) updates)
+    answers: {question_id: {player_id: answer}}
+    tally:   {question_id: {option: count}}, updated as answers arrive
+    pending: answers not yet written to the database (write-behind buffer)
+    ready:   players whose game screen sent player_ready
+    lease:   owner (game loop channel) that drives the session, with expiry
+    events:  last `replay_size` game events, each with its sequence number
+    presence: connected players, each with its owner connection and an
+             expiry refreshed by heartbeats
+    """
+
+    def __init__(self, ttl=DEFAULT_STATE_TTL, replay_size=DEFAULT_REPLAY_SIZE, **kwargs):
+        self.ttl = ttl
+        self.replay_size = replay_size
+
+    async def init_session(self, pin, state, roster, scores, answers=None, seq=0):
+        """
+        Seed a session from the database without overwriting live values.
+        `answers` ({question_id: {player_id: answer}}) are already persisted
+        and do not enter the pending buffer; `seq` restores the event counter.
+        """
+        raise NotImplementedError
+
+    async def get_state(self, pin):
+        raise NotImplementedError
+
+    async def update_state(self, pin, **fields):
+        raise NotImplementedError
+
+    async def compare_and_set_state(self, pin, owner, expected, **fields):
+        """
+        Atomically apply `fields` if `owner` still holds the session lease and
+        every `expected` state field still has its value; returns whether it did
+        """
+        raise NotImplementedError
+
+    async def get_roster(self, pin):
+        raise NotImplementedError
+
+    async def get_player(self, pin, player_id):
+        raise NotImplementedError
+
+    async def count_players(self, pin):
+        raise NotImplementedError
+
+    async def add_player(self, pin, player_id, info, score=0):
+        raise NotImplementedError
+
+    async def remove_player(self, pin, player_id):
+        raise NotImplementedError
+
+    async def add_points(self, pin, player_id, points):
+        """Add points and return the player's new total"""
+        raise NotImplementedError
+
+    async def get_score(self, pin, player_id):
+        raise NotImplementedError
+
+    async def get_scores(self, pin):
+        raise NotImplementedError
+
+    async def get_rank(self, pin, player_id):
+        """Competition rank (equal scores share a place); 0 if unknown"""
+        raise NotImplementedError
+
+    async def get_top_players(self, pin, k):
+        """[{'id', 'nickname', 'avatar_id', 'score'}, ...] best first, ties by join order"""
+        raise NotImplementedError
+
+    async def record_answer(self, pin, question_id, player_id, answer):
+        """Store the first answer of a player; returns False for repeats"""
+        raise NotImplementedError
+
+    async def get_answer(self, pin, question_id, player_id):
+        raise NotImplementedError
+
+    async def get_answers(self, pin, question_id):
+        raise NotImplementedError
+
+    async def count_answers(self, pin, question_id):
+        raise NotImplementedError
+
+    async def get_answer_tally(self, pin, question_id):
+        """{'A': n, 'B': n, 'C': n, 'D': n} for a question"""
+        raise NotImplementedError
+
+    async def get_pending_answers(self, pin):
+        """[(question_id, player_id, answer), ...] not yet persisted"""
+        raise NotImplementedError
+
+    async def discard_pending_answers(self, pin, entries):
+        """Forget persisted answers, `entries` is [(question_id, player_id), ...]"""
+        raise NotImplementedError
+
+    async def mark_ready(self, pin, player_id):
+        """Add a player to the ready set and return the ready count"""
+        raise NotImplementedError
+
+    async def count_ready(self, pin):
+        raise NotImplementedError
+
+    async def append_event(self, pin, payload):
+        """Keep an event in the replay buffer under the next sequence number; returns it"""
+        raise NotImplementedError
+
+    async def get_event_seq(self, pin):
+        """Sequence number of the latest event (0 before the first one)"""
+        raise NotImplementedError
+
+    async def get_events_since(self, pin, seq):
+        """Events after `seq` in order, or None if some of them were already evicted"""
+        raise NotImplementedError
+
+    async def mark_present(self, pin, player_id, owner, ttl):
+        """Mark a player connected through `owner` (channel name) for `ttl` seconds"""
+        raise NotImplementedError
+
+    async def mark_absent(self, pin, player_id, owner):
+        """Drop a player's presence if `owner` still holds it; returns whether it did"""
+        raise NotImplementedError
+
+    async def get_present(self, pin):
+        """Ids of the connected players"""
+        raise NotImplementedError
+
+    async def count_present(self, pin):
+        raise NotImplementedError
+
+    async def acquire_lease(self, pin, owner, ttl):
+        """Take or renew the session lease for `ttl` seconds; False if held by another owner"""
+        raise NotImplementedError
+
+    async def get_lease_owner(self, pin):
+        raise NotImplementedError
+
+    async def release_lease(self, pin, owner):
+        """Drop the lease, but only if `owner` still holds it"""
+        raise NotImplementedError
+
+
+class InMemoryGameStateStore(BaseGameStateStore):
+    """
+    Process-local store. Only valid while a single daphne process serves
+    every socket of a game (same limitation as InMemoryChannelLayer).
+    Sessions without writes for `ttl` seconds are evicted, like the Redis keys.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.sessions = {}
+        self.leases = {}  # {pin: (owner, expires_at)}
+
+    def _session(self, pin):
+        """Session of `pin` for a write: created if missing, its expiry pushed back by `ttl`"""
+        session = self._live(pin)
+        if session is None:
+            self._evict_expired()
+            session = self.sessions[pin] = {
+                'state': {}, 'roster': {}, 'ranking': RankingIndex(), 'answers': {}, 'pending': {},
+                'tally': {}, 'ready': set(), 'seq': 0, 'events': deque(maxlen=self.replay_size),
+                'presence': {},  # {player_id: (owner, expires_at)}
+            }
+        # Redis'dagi EXPIRE kabi: har bir yozuv muddatni yangilaydi
+        session['expires_at'] = time.monotonic() + self.ttl
+        return session
+
+    def _live(self, pin):
+        """Session of `pin`, or None if it was idle (no writes) longer than `ttl`"""
+        session = self.sessions.get(pin)
+        if session is not None and session['expires_at'] <= time.monotonic():
+            del self.sessions[pin]
+            return None
+        return session
+
+    def _evict_expired(self):
+        """Tashlab ketilgan sessiyalar va lease'lar jarayon xotirasida qolmaydi"""
+        now = time.monotonic()
+        for pin in [pin for pin, session in self.sessions.items() if session['expires_at'] <= now]:
+            del self.sessions[pin]
+        for pin in [pin for pin, (_, expires_at) in self.leases.items() if expires_at <= now]:
+            del self.leases[pin]
+
+    async def init_session(self, pin, state, roster, scores, answers=None, seq=0):
+        session = self._session(pin)
+        for key, value in state.items():
+            session['state'].setdefault(key, value)
+        for player_id, info in roster.items():
+            session['roster'].setdefault(player_id, dict(info))
+        ranking = session['ranking']
+        for player_id, score in scores.items():
+            if player_id not in ranking:
+                joined_at = session['roster'].get(player_id, {}).get('joined_at', 0)
+                ranking.set_score(player_id, score, joined_at)
+        for question_id, question_answers in (answers or {}).items():
+            stored = session['answers'].setdefault(question_id, {})
+            tally = session['tally'].setdefault(question_id, dict.fromkeys(ANSWER_OPTIONS, 0))
+            for player_id, answer in question_answers.items():
+                if player_id not in stored:
+                    stored[player_id] = dict(answer)
+                    if answer['selected_option'] in tally:
+                        tally[answer['selected_option']] += 1
+        session['seq'] = max(session['seq'], seq)
+
+    async def get_state(self, pin):
+        session = self._live(pin)
+        if not session or not session['state']:
+            return None
+        return dict(session['state'])
+
+    async def update_state(self, pin, **fields):
+        self._session(pin)['state'].update(fields)
+
+    async def compare_and_set_state(self, pin, owner, expected, **fields):
+        session = self._live(pin)
+        if session is None or await self.get_lease_owner(pin) != owner:
+            return False
+        if any(session['state'].get(key) != value for key, value in expected.items()):
+            return False
+        self._session(pin)['state'].update(fields)
+        return True
+
+    async def get_roster(self, pin):
+        session = self._live(pin)
+        if not session:
+            return {}
+        return {pid: dict(info) for pid, info in session['roster'].items()}
+
+    async def get_player(self, pin, player_id):
+        session = self._live(pin)
+        if not session or player_id not in session['roster']:
+            return None
+        return dict(session['roster'][player_id])
+
+    async def count_players(self, pin):
+        session = self._live(pin)
+        return len(session['roster']) if session else 0
+
+    async def add_player(self, pin, player_id, info, score=0):
+        session = self._session(pin)
+        session['roster'][player_id] = dict(info)
+        if player_id not in session['ranking']:
+            session['ranking'].set_score(player_id, score, info.get('joined_at', 0))
+
+    async def remove_player(self, pin, player_id):
+        session = self._live(pin)
+        if not session:
+            return
+        session['roster'].pop(player_id, None)
+        session['ranking'].remove(player_id)
+        session['ready'].discard(player_id)
+        session['presence'].pop(player_id, None)
+
+    async def add_points(self, pin, player_id, points):
+        return self._session(pin)['ranking'].add_points(player_id, points)
+
+    async def get_score(self, pin, player_id):
+        session = self._live(pin)
+        if not session:
+            return 0
+        return session['ranking'].score(player_id)
+
+    async def get_scores(self, pin):
+        session = self._live(pin)
+        if not session:
+            return {}
+        return session['ranking'].scores()
+
+    async def get_rank(self, pin, player_id):
+        session = self._live(pin)
+        if not session:
+            return 0
+        return session['ranking'].rank(player_id)
+
+    async def get_top_players(self, pin, k):
+        session = self._live(pin)
+        if not session:
+            return []
+        top = []
+        for player_id, score in session['ranking'].top(k):
+            info = session['roster'].get(player_id, {})
+            top.append({
+                'id': player_id,
+                'nickname': info.get('nickname', ''),
+                'avatar_id': info.get('avatar_id', 1),
+                'score': score,
+            })
+        return top
+
+    async def record_answer(self, pin, question_id, player_id, answer):
+        answers = self._session(pin)['answers'].setdefault(question_id, {})
+        if player_id in answers:
+            return False
+        answers[player_id] = dict(answer)
+        session = self._session(pin)
+        session['pending'][(question_id, player_id)] = answers[player_id]
+        tally = session['tally'].setdefault(question_id, dict.fromkeys(ANSWER_OPTIONS, 0))
+        if answer['selected_option'] in tally:
+            tally[answer['selected_option']] += 1
+        return True
+
+    async def get_answer(self, pin, question_id, player_id):
+        session = self._live(pin)
+        if not session:
+            return None
+        return session['answers'].get(question_id, {}).get(player_id)
+
+    async def get_answers(self, pin, question_id):
+        session = self._live(pin)
+        if not session:
+            return {}
+        return dict(session['answers'].get(question_id, {}))
+
+    async def count_answers(self, pin, question_id):
+        session = self._live(pin)
+        if not session:
+            return 0
+        return len(session['answers'].get(question_id, {}))
+
+    async def get_answer_tally(self, pin, question_id):
+        tally = dict.fromkeys(ANSWER_OPTIONS, 0)
+        session = self._live(pin)
+        if session:
+            tally.update(session['tally'].get(question_id, {}))
+        return tally
+
+    async def get_pending_answers(self, pin):
+        session = self._live(pin)
+        if not session:
+            return []
+        return [(qid, pid, dict(answer)) for (qid, pid), answer in session['pending'].items()]
+
+    async def discard_pending_answers(self, pin, entries):
+        session = self._live(pin)
+        if not session:
+            return
+        for entry in entries:
+            session['pending'].pop(tuple(entry), None)
+
+    def drain_pending(self):
+        """
+        Synchronously take every buffered answer (used at interpreter exit,
+        when the event loop is already gone).
+        Returns [(pin, pending, scores), ...].
+        """
+        drained = []
+        for pin, session in self.sessions.items():
+            if session['pending']:
+                pending = [(qid, pid, a) for (qid, pid), a in session['pending'].items()]
+                drained.append((pin, pending, session['ranking'].scores()))
+                session['pending'] = {}
+        return drained
+
+    async def mark_ready(self, pin, player_id):
+        ready = self._session(pin)['ready']
+        ready.add(player_id)
+        return len(ready)
+
+    async def count_ready(self, pin):
+        session = self._live(pin)
+        return len(session['ready']) if session else 0
+
+    async def append_event(self, pin, payload):
+        session = self._session(pin)
+        session['seq'] += 1
+        session['events'].append(dict(payload, seq=session['seq']))
+        return session['seq']
+
+    async def get_event_seq(self, pin):
+        session = self._live(pin)
+        return session['seq'] if session else 0
+
+    async def get_events_since(self, pin, seq):
+        session = self._live(pin)
+        last = session['seq'] if session else 0
+        if seq < 0 or seq > last:
+            return None
+        events = [dict(event) for event in session['events'] if event['seq'] > seq] if session else []
+        if seq < last and (not events or events[0]['seq'] != seq + 1):
+            return None
+        return events
+
+    async def mark_present(self, pin, player_id, owner, ttl):
+        self._session(pin)['presence'][player_id] = (owner, time.monotonic() + ttl)
+
+    async def mark_absent(self, pin, player_id, owner):
+        session = self._live(pin)
+        if not session or session['presence'].get(player_id, (None, 0))[0] != owner:
+            return False
+        del session['presence'][player_id]
+        return True
+
+    async def get_present(self, pin):
+        session = self._live(pin)
+        if not session:
+            return set()
+        now = time.monotonic()
+        return {pid for pid, (_, expires_at) in session['presence'].items() if expires_at > now}
+
+    async def count_present(self, pin):
+        return len(await self.get_present(pin))
+
+    async def acquire_lease(self, pin, owner, ttl):
+        if await self.get_lease_owner(pin) not in (None, owner):
+            return False
+        self.leases[pin] = (owner, time.monotonic() + ttl)
+        return True
+
+    async def get_lease_owner(self, pin):
+        owner, expires_at = self.leases.get(pin, (None, 0))
+        return owner if expires_at > time.monotonic() else None
+
+    async def release_lease(self, pin, owner):
+        if self.leases.get(pin, (None, 0))[0] == owner:
+            del self.leases[pin]
+
+
+class RedisGameStateStore(BaseGameStateStore):
+    """
+    Redis-backed store shared by every daphne worker.
+
+    Keys: kahoot:{pin}:state (hash), :roster (hash of JSON), :ranking (sorted
+    set of scores; top() orders equal scores by the roster's joined_at),
+    :answers:{question_id} (hash of JSON), :tally:{question_id} (hash of
+    option counts), :pending (hash of JSON keyed by "question_id:player_id"),
+    :ready (set), :seq (event counter), :events (sorted set of JSON
+    events scored by sequence number, trimmed to `replay_size`),
+    :presence (sorted set of players scored by expiry time) and
+    :presence_owner (hash of owner channels) expire after `ttl`; :lease
+    (owner string) expires with the lease itself. Buffered answers survive a worker crash and are
+    persisted by the next flush.
+    """
+
+    # Lease faqat egasi tomonidan yangilanadi/o'chiriladi (GET + SET atomik)
+    ACQUIRE_LEASE_SCRIPT = """
+    local owner = redis.call('GET', KEYS[1])
+    if owner and owner ~= ARGV[1] then
+        return 0
+    end
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return 1
+    """
+    RELEASE_LEASE_SCRIPT = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('DEL', KEYS[1])
+    end
+    return 0
+    """
+    # Holat faqat lease egasi tomonidan va o'qilgan qiymatlari o'zgarmagan bo'lsa yoziladi:
+    # ARGV = owner, n, n ta (maydon, kutilgan qiymat), (maydon, yangi qiymat)..., ttl
+    COMPARE_AND_SET_STATE_SCRIPT = """
+    if redis.call('GET', KEYS[2]) ~= ARGV[1] then
+        return 0
+    end
+    local expected = tonumber(ARGV[2])
+    for i = 3, 2 + expected * 2, 2 do
+        if redis.call('HGET', KEYS[1], ARGV[i]) ~= ARGV[i + 1] then
+            return 0
+        end
+    end
+    for i = 3 + expected * 2, #ARGV - 1, 2 do
+        redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+    end
+    redis.call('EXPIRE', KEYS[1], ARGV[#ARGV])
+    return 1
+    """
+    # Javob, bufer va hisoblagich birga yoziladi: worker o'rtada o'lsa, saqlangan
+    # (takrori rad etiladigan) javob buferga tushmay qolmaydi.
+    # ARGV = player_id, bufer maydoni, javob JSON, variant ('' - hisoblanmaydi), ttl
+    RECORD_ANSWER_SCRIPT = """
+    if redis.call('HSETNX', KEYS[1], ARGV[1], ARGV[3]) == 0 then
+        return 0
+    end
+    redis.call('HSET', KEYS[2], ARGV[2], ARGV[3])
+    redis.call('EXPIRE', KEYS[1], ARGV[5])
+    redis.call('EXPIRE', KEYS[2], ARGV[5])
+    if ARGV[4] ~= '' then
+        redis.call('HINCRBY', KEYS[3], ARGV[4], 1)
+        redis.call('EXPIRE', KEYS[3], ARGV[5])
+    end
+    return 1
+    """
+    # Eski ulanishning disconnect'i yangi ulanish belgilagan presence'ni o'chirmaydi
+    MARK_ABSENT_SCRIPT = """
+    if redis.call('HGET', KEYS[2], ARGV[1]) == ARGV[2] then
+        redis.call('HDEL', KEYS[2], ARGV[1])
+        return redis.call('ZREM', KEYS[1], ARGV[1])
+    end
+    return 0
+    """
+
+    def __init__(self, url=None, prefix='kahoot', **kwargs):
+        super().__init__(**kwargs)
+        self.url = url or getattr(settings, 'REDIS_URL', None)
+        self.prefix = prefix
+        # redis.asyncio ulanishlari event loop'ga bog'langan
+        self._clients = weakref.WeakKeyDictionary()
+
+    def _client(self):
+        import redis.asyncio as redis
+
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = redis.from_url(self.url, decode_responses=True)
+            self._clients[loop] = client
+        return client
+
+    def _key(self, pin, *parts):
+        return ':'.join((self.prefix, str(pin)) + tuple(str(p) for p in parts))
+
+    def _session_keys(self, pin):
+        return [
+            self._key(pin, name)
+            for name in (
+                'state', 'roster', 'ranking', 'pending', 'ready', 'seq', 'events',
+                'presence', 'presence_owner',
+            )
+        ]
+
+    @staticmethod
+    def _encode_state(fields):
+        return {key: json.dumps(value) for key, value in fields.items()}
+
+    @staticmethod
+    def _decode_state(raw):
+        return {key: json.loads(value) for key, value in raw.items()}
+
+    async def init_session(self, pin, state, roster, scores, answers=None, seq=0):
+        pipe = self._client().pipeline(transaction=True)
+        for key, value in self._encode_state(state).items():
+            pipe.hsetnx(self._key(pin, 'state'), key, value)
+        for player_id, info in roster.items():
+            pipe.hsetnx(self._key(pin, 'roster'), player_id, json.dumps(info))
+        if scores:
+            pipe.zadd(self._key(pin, 'ranking'), scores, nx=True)
+        for question_id, question_answers in (answers or {}).items():
+            answers_key = self._key(pin, 'answers', question_id)
+            tally_key = self._key(pin, 'tally', question_id)
+            tally = dict.fromkeys(ANSWER_OPTIONS, 0)
+            for player_id, answer in question_answers.items():
+                pipe.hsetnx(answers_key, player_id, json.dumps(answer))
+                if answer['selected_option'] in tally:
+                    tally[answer['selected_option']] += 1
+            for option, count in tally.items():
+                pipe.hsetnx(tally_key, option, count)
+            pipe.expire(answers_key, self.ttl)
+            pipe.expire(tally_key, self.ttl)
+        pipe.set(self._key(pin, 'seq'), seq, nx=True)
+        for key in self._session_keys(pin):
+            pipe.expire(key, self.ttl)
+        await pipe.execute()
+
+    async def get_state(self, pin):
+        raw = await self._client().hgetall(self._key(pin, 'state'))
+        if not raw:
+            return None
+        return self._decode_state(raw)
+
+    async def update_state(self, pin, **fields):
+        key = self._key(pin, 'state')
+        pipe = self._client().pipeline(transaction=True)
+        pipe.hset(key, mapping=self._encode_state(fields))
+        pipe.expire(key, self.ttl)
+        await pipe.execute()
+
+    async def compare_and_set_state(self, pin, owner, expected, **fields):
+        args = [owner, len(expected)]
+        for mapping in (expected, fields):
+            for key, value in self._encode_state(mapping).items():
+                args += [key, value]
+        applied = await self._client().eval(
+            self.COMPARE_AND_SET_STATE_SCRIPT, 2, self._key(pin, 'state'), self._key(pin, 'lease'),
+            *args, self.ttl,
+        )
+        return bool(applied)
+
+    async def get_roster(self, pin):
+        raw = await self._client().hgetall(self._key(pin, 'roster'))
+        return {int(pid): json.loads(info) for pid, info in raw.items()}
+
+    async def get_player(self, pin, player_id):
+        raw = await self._client().hget(self._key(pin, 'roster'), player_id)
+        return json.loads(raw) if raw else None
+
+    async def count_players(self, pin):
+        return await self._client().hlen(self._key(pin, 'roster'))
+
+    async def add_player(self, pin, player_id, info, score=0):
+        pipe = self._client().pipeline(transaction=True)
+        pipe.hset(self._key(pin, 'roster'), player_id, json.dumps(info))
+        pipe.zadd(self._key(pin, 'ranking'), {player_id: score}, nx=True)
+        for key in self._session_keys(pin)[1:3]:
+            pipe.expire(key, self.ttl)
+        await pipe.execute()
+
+    async def remove_player(self, pin, player_id):
+        pipe = self._client().pipeline(transaction=True)
+        pipe.hdel(self._key(pin, 'roster'), player_id)
+        pipe.zrem(self._key(pin, 'ranking'), player_id)
+        pipe.srem(self._key(pin, 'ready'), player_id)
+        pipe.zrem(self._key(pin, 'presence'), player_id)
+        pipe.hdel(self._key(pin, 'presence_owner'), player_id)
+        await pipe.execute()
+
+    async def add_points(self, pin, player_id, points):
+        return int(await self._client().zincrby(self._key(pin, 'ranking'), points, player_id))
+
+    async def get_score(self, pin, player_id):
+        score = await self._client().zscore(self._key(pin, 'ranking'), player_id)
+        return int(score) if score is not None else 0
+
+    async def get_scores(self, pin):
+        raw = await self._client().zrange(self._key(pin, 'ranking'), 0, -1, withscores=True)
+        return {int(pid): int(score) for pid, score in raw}
+
+    async def get_rank(self, pin, player_id):
+        key = self._key(pin, 'ranking')
+        score = await self._client().zscore(key, player_id)
+        if score is None:
+            return 0
+        return await self._client().zcount(key, f'({score}', '+inf') + 1
+
+    async def get_top_players(self, pin, k):
+        client, key = self._client(), self._key(pin, 'ranking')
+        raw = await client.zrevrange(key, 0, k - 1, withscores=True)
+        if not raw:
+            return []
+        if len(raw) == k:
+            # Teng ballar Redis'da a'zo nomi bo'yicha tartiblanadi: chegaradagi teng
+            # ballilarning hammasi olinib, RankingIndex kabi joined_at bo'yicha tanlanadi
+            lowest = raw[-1][1]
+            raw = [(pid, score) for pid, score in raw if score > lowest]
+            raw += await client.zrangebyscore(key, lowest, lowest, withscores=True)
+        infos = await client.hmget(self._key(pin, 'roster'), [pid for pid, _ in raw])
+        top = []
+        for (player_id, score), info in zip(raw, infos):
+            info = json.loads(info) if info else {}
+            top.append({
+                'id': int(player_id),
+                'nickname': info.get('nickname', ''),
+                'avatar_id': info.get('avatar_id', 1),
+                'score': int(score),
+                'joined_at': info.get('joined_at', 0),
+            })
+        top.sort(key=lambda p: (-p['score'], p['joined_at'], p['id']))
+        for player in top:
+            del player['joined_at']
+        return top[:k]
+
+    async def record_answer(self, pin, question_id, player_id, answer):
+        option = answer['selected_option'] if answer['selected_option'] in ANSWER_OPTIONS else ''
+        created = await self._client().eval(
+            self.RECORD_ANSWER_SCRIPT, 3,
+            self._key(pin, 'answers', question_id), self._key(pin, 'pending'),
+            self._key(pin, 'tally', question_id),
+            player_id, f'{question_id}:{player_id}', json.dumps(answer), option, self.ttl,
+        )
+        return bool(created)
+
+    async def get_answer(self, pin, question_id, player_id):
+        raw = await self._client().hget(self._key(pin, 'answers', question_id), player_id)
+        return json.loads(raw) if raw else None
+
+    async def get_answers(self, pin, question_id):
+        raw = await self._client().hgetall(self._key(pin, 'answers', question_id))
+        return {int(pid): json.loads(answer) for pid, answer in raw.items()}
+
+    async def count_answers(self, pin, question_id):
+        return await self._client().hlen(self._key(pin, 'answers', question_id))
+
+    async def get_answer_tally(self, pin, question_id):
+        tally = dict.fromkeys(ANSWER_OPTIONS, 0)
+        raw = await self._client().hgetall(self._key(pin, 'tally', question_id))
+        tally.update({option: int(count) for option, count in raw.items()})
+        return tally
+
+    async def get_pending_answers(self, pin):
+        raw = await self._client().hgetall(self._key(pin, 'pending'))
+        pending = []
+        for field, answer in raw.items():
+            question_id, player_id = field.split(':')
+            pending.append((int(question_id), int(player_id), json.loads(answer)))
+        return pending
+
+    async def discard_pending_answers(self, pin, entries):
+        fields = [f'{question_id}:{player_id}' for question_id, player_id in entries]
+        if fields:
+            await self._client().hdel(self._key(pin, 'pending'), *fields)
+
+    async def mark_ready(self, pin, player_id):
+        key = self._key(pin, 'ready')
+        pipe = self._client().pipeline(transaction=True)
+        pipe.sadd(key, player_id)
+        pipe.expire(key, self.ttl)
+        pipe.scard(key)
+        _, _, count = await pipe.execute()
+        return count
+
+    async def count_ready(self, pin):
+        return await self._client().scard(self._key(pin, 'ready'))
+
+    async def append_event(self, pin, payload):
+        seq_key, events_key = self._key(pin, 'seq'), self._key(pin, 'events')
+        seq = await self._client().incr(seq_key)
+        pipe = self._client().pipeline(transaction=True)
+        pipe.zadd(events_key, {json.dumps(dict(payload, seq=seq)): seq})
+        pipe.zremrangebyrank(events_key, 0, -self.replay_size - 1)
+        pipe.expire(seq_key, self.ttl)
+        pipe.expire(events_key, self.ttl)
+        await pipe.execute()
+        return seq
+
+    async def get_event_seq(self, pin):
+        return int(await self._client().get(self._key(pin, 'seq')) or 0)
+
+    async def get_events_since(self, pin, seq):
+        pipe = self._client().pipeline(transaction=True)
+        pipe.get(self._key(pin, 'seq'))
+        pipe.zrangebyscore(self._key(pin, 'events'), f'({seq}', '+inf')
+        last, raw = await pipe.execute()
+        last = int(last or 0)
+        if seq < 0 or seq > last:
+            return None
+        events = [json.loads(event) for event in raw]
+        if seq < last and (not events or events[0]['seq'] != seq + 1):
+            return None
+        return events
+
+    async def mark_present(self, pin, player_id, owner, ttl):
+        presence_key, owners_key = self._key(pin, 'presence'), self._key(pin, 'presence_owner')
+        now = time.time()
+        pipe = self._client().pipeline(transaction=True)
+        pipe.zadd(presence_key, {player_id: now + ttl})
+        # Muddati o'tganlar (o'lgan worker ulanishlari) shu yerda tozalanadi
+        pipe.zremrangebyscore(presence_key, '-inf', now)
+        pipe.hset(owners_key, player_id, owner)
+        pipe.expire(presence_key, self.ttl)
+        pipe.expire(owners_key, self.ttl)
+        await pipe.execute()
+
+    async def mark_absent(self, pin, player_id, owner):
+        removed = await self._client().eval(
+            self.MARK_ABSENT_SCRIPT, 2, self._key(pin, 'presence'), self._key(pin, 'presence_owner'),
+            player_id, owner,
+        )
+        return bool(removed)
+
+    async def get_present(self, pin):
+        raw = await self._client().zrangebyscore(self._key(pin, 'presence'), f'({time.time()}', '+inf')
+        return {int(pid) for pid in raw}
+
+    async def count_present(self, pin):
+        return await self._client().zcount(self._key(pin, 'presence'), f'({time.time()}', '+inf')
+
+    async def acquire_lease(self, pin, owner, ttl):
+        acquired = await self._client().eval(
+            self.ACQUIRE_LEASE_SCRIPT, 1, self._key(pin, 'lease'), owner, int(ttl * 1000),
+        )
+        return bool(acquired)
+
+    async def get_lease_owner(self, pin):
+        return await self._client().get(self._key(pin, 'lease'))
+
+    async def release_lease(self, pin, owner):
+        await self._client().eval(self.RELEASE_LEASE_SCRIPT, 1, self._key(pin, 'lease'), owner)
+
+
+_state_store = None
+
+
+def get_state_store():
+    """Return the store configured in settings.KAHOOT_STATE_STORE"""
+    global _state_store
+    if _state_store is None:
+        config = getattr(settings, 'KAHOOT_STATE_STORE', {
+            'BACKEND': 'quizzes.kahoot_state.InMemoryGameStateStore',
+        })
+        backend = import_string(config['BACKEND'])
+        _state_store = backend(**config.get('CONFIG', {}))
+    return _state_store
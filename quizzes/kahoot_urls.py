@@ -7,6 +7,7 @@ urlpatterns = [
     path('join/', kahoot_views.kahoot_join, name='kahoot_join'),
     path('play/<str:pin>/lobby/', kahoot_views.kahoot_player_lobby, name='kahoot_player_lobby'),
     path('play/<str:pin>/game/', kahoot_views.kahoot_player_game, name='kahoot_player_game'),
+    path('play/<str:pin>/podium/', kahoot_views.kahoot_player_podium, name='kahoot_player_podium'),
     
     # Host (Admin)
     path('dashboard/', kahoot_views.kahoot_dashboard, name='kahoot_dashboard'),
@@ -17,6 +18,7 @@ urlpatterns = [
     path('quiz/<int:quiz_id>/start/', kahoot_views.kahoot_start_session, name='kahoot_start_session'),
     path('host/<str:pin>/lobby/', kahoot_views.kahoot_host_lobby, name='kahoot_host_lobby'),
     path('host/<str:pin>/game/', kahoot_views.kahoot_host_game, name='kahoot_host_game'),
+    path('host/<str:pin>/results/', kahoot_views.kahoot_host_results, name='kahoot_host_results'),
     
     # API
     path('api/session/<str:pin>/', kahoot_views.kahoot_session_info, name='kahoot_session_info'),
@@ -11,9 +11,16 @@ import json
 KAHOOT_AVATAR_EMOJIS = ['😀', '😎', '🤓', '😺', '🦊', '🐶', '🐱', '🦁', '🐼', '🐸', '🦄', '🐲', '🤖', '👽', '🎃']
 
 from .models import (
-    KahootQuiz, KahootQuestion, KahootSession, KahootPlayer, KahootAnswer, User
+    KahootQuiz, KahootQuestion, KahootSession, KahootPlayer, KahootAnswer, KahootStanding, User
 )
 from .decorators import admin_required
+from .kahoot_admission import JoinRejected, admit_player
+from .kahoot_codec import SHORT_KEYS
+
+
+def avatar_emoji(avatar_id):
+    avatar_id = avatar_id or 1
+    return KAHOOT_AVATAR_EMOJIS[avatar_id - 1] if 1 <= avatar_id <= 15 else KAHOOT_AVATAR_EMOJIS[0]
 
 
 # ==================== GUEST JOIN ====================
@@ -29,34 +36,18 @@ def kahoot_join(request):
             messages.error(request, 'PIN va Nickname kiritish shart!')
             return render(request, 'kahoot/join.html')
         
-        # Session mavjudligini tekshirish
+        # Sessiya holati, joy limiti va nickname bitta tranzaksiyada tekshiriladi
         try:
-            session = KahootSession.objects.get(pin=pin, status='LOBBY')
-        except KahootSession.DoesNotExist:
-            messages.error(request, 'Bu PIN bilan o\'yin topilmadi yoki u allaqachon boshlangan.')
-            return render(request, 'kahoot/join.html')
-        
-        # Nickname unikal bo'lishi kerak
-        if session.players.filter(nickname=nickname).exists():
-            messages.error(request, 'Bu ism allaqachon band. Boshqa ism tanlang.')
-            return render(request, 'kahoot/join.html')
-        
-        # Maksimal o'yinchilar limiti
-        max_players = getattr(session, 'max_players', 50) or 50
-        if session.players.count() >= max_players:
-            messages.error(request, 'O\'yin to\'ldi. Maksimal o\'yinchilar soni: ' + str(max_players))
+            player_id = admit_player(
+                pin, nickname, avatar_id,
+                session_key=request.session.session_key or '',
+            )
+        except JoinRejected as e:
+            messages.error(request, str(e))
             return render(request, 'kahoot/join.html')
         
-        # Player yaratish
-        player = KahootPlayer.objects.create(
-            session=session,
-            nickname=nickname,
-            avatar_id=avatar_id,
-            session_key=request.session.session_key or '',
-        )
-        
         # Session'da saqlash
-        request.session['kahoot_player_id'] = player.id
+        request.session['kahoot_player_id'] = player_id
         request.session['kahoot_session_pin'] = pin
         
         return redirect('kahoot_player_lobby', pin=pin)
@@ -120,6 +111,7 @@ def kahoot_player_game(request, pin):
         'session': session,
         'pin': pin,
         'avatar_emoji': avatar_emoji,
+        'codec_short_keys': SHORT_KEYS,
     }
     return render(request, 'kahoot/player_game.html', context)
 
@@ -130,29 +122,37 @@ def kahoot_player_podium(request, pin):
     if not player_id:
         return redirect('kahoot_join')
     
-    try:
-        player = KahootPlayer.objects.select_related('session').get(id=player_id)
-        session = player.session
-    except KahootPlayer.DoesNotExist:
-        return redirect('kahoot_join')
-    
-    if session.pin != pin:
+    # O'yinchining yakuniy natijasi: bitta indexli so'rov (player_id unikal)
+    standing_query = KahootStanding.objects.select_related('player', 'session__quiz').filter(
+        player_id=player_id, session__pin=pin,
+    )
+    standing = standing_query.first()
+    if standing is None:
+        # Sahifa faqat o'qiydi: reyting end_game'da (yoki kahoot_standings buyrug'ida) yoziladi
+        session = KahootSession.objects.filter(pin=pin).first()
+        if session is None or session.status != 'FINISHED':
+            # O'yin hali tugamagan: game sahifasi o'yinchini tekshiradi
+            return redirect('kahoot_player_game', pin=pin)
         return redirect('kahoot_join')
+    session = standing.session
     
-    # Top 3 o'yinchilar
-    top_players = session.players.order_by('-score')[:3]
-    all_players = session.players.order_by('-score')
-    
-    # O'yinchining o'rni
-    player_rank = list(all_players.values_list('id', flat=True)).index(player.id) + 1 if player.id in all_players.values_list('id', flat=True) else 0
+    # Top 3: (session, rank) indexi bo'yicha
+    top = list(session.standings.select_related('player').filter(rank__lte=3)[:3])
+    podium = [
+        {'standing': top[i], 'bar': bar, 'medal': medal, 'emoji': avatar_emoji(top[i].player.avatar_id)}
+        for i, bar, medal in ((1, 'silver', '🥈'), (0, 'gold', '🥇'), (2, 'bronze', '🥉'))
+        if i < len(top)
+    ]
     
     context = {
-        'player': player,
+        'player': standing.player,
         'session': session,
         'pin': pin,
-        'top_players': top_players,
-        'player_rank': player_rank,
-        'total_players': all_players.count(),
+        'standing': standing,
+        'podium': podium,
+        'player_rank': standing.rank,
+        'total_players': session.player_count,
+        'avatar_emoji': avatar_emoji(standing.player.avatar_id),
     }
     return render(request, 'kahoot/player_podium.html', context)
 
@@ -167,10 +167,15 @@ def kahoot_dashboard(request):
         host=request.user, 
         status__in=['LOBBY', 'PLAYING']
     )
+    # O'yinlar tarixi: natijalar sahifasi yakuniy reytingdan o'qiydi
+    finished_sessions = KahootSession.objects.filter(
+        host=request.user, status='FINISHED', pin__isnull=False,
+    ).select_related('quiz')[:10]
     
     context = {
         'quizzes': quizzes,
         'active_sessions': active_sessions,
+        'finished_sessions': finished_sessions,
     }
     return render(request, 'kahoot/dashboard.html', context)
 
@@ -262,6 +267,10 @@ def kahoot_delete_question(request, question_id):
     """Delete a question"""
     question = get_object_or_404(KahootQuestion, id=question_id, quiz__creator=request.user)
     quiz_id = question.quiz.id
+    # Jonli sessiya snapshot'i bu savolni ko'rsatishda davom etadi: javoblari bazaga yozilmay qoladi
+    if question.quiz.has_live_session():
+        messages.error(request, 'Quiz o\'ynalayotganda savolni o\'chirib bo\'lmaydi!')
+        return redirect('kahoot_edit_quiz', quiz_id=quiz_id)
     question.delete()
     messages.success(request, 'Savol o\'chirildi!')
     return redirect('kahoot_edit_quiz', quiz_id=quiz_id)
@@ -277,7 +286,9 @@ def kahoot_start_session(request, quiz_id):
         return redirect('kahoot_edit_quiz', quiz_id=quiz.id)
     
     # Create new session
-    session = KahootSession.objects.create(quiz=quiz, host=request.user)
+    session = KahootSession.objects.create(
+        quiz=quiz, host=request.user, quiz_snapshot=quiz.compile_snapshot(),
+    )
     
     return redirect('kahoot_host_lobby', pin=session.pin)
 
@@ -304,11 +315,32 @@ def kahoot_host_game(request, pin):
         'session': session,
         'quiz': session.quiz,
         'pin': pin,
-        'total_questions': session.quiz.questions.count(),
+        'total_questions': session.total_questions(),
     }
     return render(request, 'kahoot/host_game.html', context)
 
 
+@login_required
+def kahoot_host_results(request, pin):
+    """Host summary: final standings of a finished session"""
+    session = get_object_or_404(KahootSession.objects.select_related('quiz'), pin=pin, host=request.user)
+    if session.status != 'FINISHED':
+        return redirect('kahoot_host_game', pin=pin)
+    
+    standings = [
+        {'standing': s, 'emoji': avatar_emoji(s.player.avatar_id)}
+        for s in session.standings.select_related('player')
+    ]
+    context = {
+        'session': session,
+        'quiz': session.quiz,
+        'pin': pin,
+        'standings': standings,
+        'total_questions': session.total_questions(),
+    }
+    return render(request, 'kahoot/host_results.html', context)
+
+
 # ==================== API ENDPOINTS ====================
 
 @require_GET
@@ -320,7 +352,7 @@ def kahoot_session_info(request, pin):
         return JsonResponse({
             'status': session.status,
             'quiz_title': session.quiz.title,
-            'total_questions': session.quiz.questions.count(),
+            'total_questions': session.total_questions(),
             'current_question': session.current_question_index,
             'players': players,
             'player_count': len(players),
@@ -0,0 +1,151 @@
+# Kahoot Mode micro-benchmarks
+import asyncio
+import json
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+
+from quizzes.consumers import KahootConsumer
+from quizzes.kahoot_codec import encode_frames
+
+
+SAMPLE_QUESTION = {
+    'question_id': 42,
+    'index': 3,
+    'total': 20,
+    'text': "Qaysi sayyora Quyosh sistemasida eng katta? " * 3,
+    'image': '/media/kahoot/questions/planets.png',
+    'options': {'A': 'Yer', 'B': 'Yupiter', 'C': 'Saturn', 'D': 'Neptun'},
+    'time_limit': 20,
+}
+
+
+def legacy_show_question(event):
+    """The per-consumer work of the old show_question handler"""
+    q = event.get('question') or {}
+    return json.dumps({
+        'type': 'show_question',
+        'question': {
+            'question_id': q.get('question_id'),
+            'index': q.get('index'),
+            'total': q.get('total'),
+            'text': q.get('text', ''),
+            'image': q.get('image'),
+            'options': {
+                'A': q.get('options', {}).get('A', ''),
+                'B': q.get('options', {}).get('B', ''),
+                'C': q.get('options', {}).get('C', ''),
+                'D': q.get('options', {}).get('D', ''),
+            },
+            'time_limit': q.get('time_limit', 20),
+        },
+    })
+
+
+class _SinkConsumer(KahootConsumer):
+    """Consumer whose send() just drops the frame"""
+
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        pass
+
+
+LAYER_BACKENDS = {
+    'core': 'channels_redis.core.RedisChannelLayer',
+    'pubsub': 'channels_redis.pubsub.RedisPubSubChannelLayer',
+}
+
+
+async def count_redis_commands(client):
+    """Total number of commands Redis has executed (INFO commandstats)"""
+    stats = await client.info('commandstats')
+    return sum(entry['calls'] for entry in stats.values())
+
+
+class Command(BaseCommand):
+    help = "Kahoot broadcast micro-benchmarks: CPU per broadcast, Redis commands per broadcast"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenario', choices=['cpu', 'redis'], default='cpu')
+        parser.add_argument('--recipients', type=int, default=500)
+        parser.add_argument('--rounds', type=int, default=50)
+
+    def handle(self, *args, **options):
+        if options['scenario'] == 'redis':
+            self.bench_redis_layers(options['recipients'], options['rounds'])
+        else:
+            self.bench_cpu(options['recipients'], options['rounds'])
+
+    def bench_cpu(self, recipients, rounds):
+        payload = {'type': 'show_question', 'question': SAMPLE_QUESTION}
+        consumers = [_SinkConsumer() for _ in range(recipients)]
+
+        async def before():
+            for _ in range(rounds):
+                event = dict(payload)
+                for consumer in consumers:
+                    await consumer.send(text_data=legacy_show_question(event))
+
+        async def after():
+            for _ in range(rounds):
+                event = {'type': 'show_question', 'frames': encode_frames(payload)}
+                for consumer in consumers:
+                    await consumer.show_question(event)
+
+        results = {}
+        for name, bench in (('before', before), ('after', after)):
+            start = time.process_time()
+            asyncio.run(bench())
+            results[name] = (time.process_time() - start) / rounds
+
+        self.stdout.write(f"show_question fan-out to {recipients} consumers ({rounds} rounds)")
+        for name, seconds in results.items():
+            self.stdout.write(f"  {name:<7} {seconds * 1000:8.3f} ms CPU per broadcast")
+        if results['after']:
+            self.stdout.write(f"  speedup {results['before'] / results['after']:.1f}x")
+
+        # Bitta frame hajmi har bir codec uchun
+        for name, frame in encode_frames(payload).items():
+            self.stdout.write(f"  {name:<7} {len(frame):8d} bytes per show_question frame")
+
+    def bench_redis_layers(self, recipients, rounds):
+        """group_send to `recipients` members of one worker, per channel layer"""
+        import redis.asyncio as redis
+
+        url = getattr(settings, 'REDIS_URL', None)
+        if not url:
+            raise CommandError("REDIS_URL is not set")
+        message = {'type': 'show_question', 'frames': encode_frames(
+            {'type': 'show_question', 'question': SAMPLE_QUESTION},
+        )}
+
+        async def bench(backend):
+            layer = import_string(backend)(hosts=[url])
+            client = redis.from_url(url)
+            group = 'kahoot_bench'
+            channels = [await layer.new_channel() for _ in range(recipients)]
+            for channel in channels:
+                await layer.group_add(group, channel)
+            # pubsub layer faqat receive() chaqirilgan kanallarga obuna bo'ladi
+            receivers = [asyncio.ensure_future(layer.receive(channel)) for channel in channels]
+            await asyncio.sleep(0.5)
+
+            before = await count_redis_commands(client)
+            for _ in range(rounds):
+                await layer.group_send(group, message)
+            # INFO ning o'zi ham bitta buyruq sifatida hisoblanadi
+            commands = (await count_redis_commands(client) - before - 1) / rounds
+
+            for receiver in receivers:
+                receiver.cancel()
+            await asyncio.gather(*receivers, return_exceptions=True)
+            for channel in channels:
+                await layer.group_discard(group, channel)
+            await client.aclose()
+            return commands
+
+        self.stdout.write(f"group_send to {recipients} local consumers ({rounds} rounds)")
+        for name, backend in LAYER_BACKENDS.items():
+            commands = asyncio.run(bench(backend))
+            self.stdout.write(f"  {name:<7} {commands:8.1f} Redis commands per broadcast")
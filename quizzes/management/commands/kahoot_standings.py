@@ -0,0 +1,36 @@
+# Kahoot Mode final standings repair
+#
+# end_game yakuniy reytingni FINISHED yozilishidan oldin yozadi. Reyting
+# yozilmay qolgan tugagan sessiyalar (masalan, baza o'sha paytda xato bergan)
+# natija sahifalarida bo'sh ko'rinadi: sahifalar faqat o'qiydi, reyting shu
+# buyruq bilan yoziladi.
+from django.core.management.base import BaseCommand
+
+from quizzes.kahoot_persistence import write_standings
+from quizzes.models import KahootSession
+
+
+class Command(BaseCommand):
+    help = "Write the final standings of finished Kahoot sessions that have none"
+
+    def add_arguments(self, parser):
+        parser.add_argument('pins', nargs='*', help="only these session PINs")
+        parser.add_argument(
+            '--rewrite', action='store_true',
+            help="also replace existing standings (e.g. after late answers were flushed)",
+        )
+
+    def handle(self, *args, pins, rewrite, **options):
+        # PIN'i qaytarib olingan (None) sessiyani PIN orqali topib bo'lmaydi
+        sessions = KahootSession.objects.filter(status='FINISHED', pin__isnull=False)
+        if pins:
+            sessions = sessions.filter(pin__in=pins)
+        if not rewrite:
+            sessions = sessions.filter(standings__isnull=True)
+
+        written = 0
+        for pin in sessions.values_list('pin', flat=True).distinct():
+            count = write_standings(pin)
+            written += 1
+            self.stdout.write(f"{pin}: {count} standings")
+        self.stdout.write(self.style.SUCCESS(f"Wrote standings of {written} session(s)"))
@@ -0,0 +1,503 @@
+# Kahoot Mode swarm load test
+#
+# Bitta host va minglab simulyatsiya qilingan o'yinchilar to'liq o'yinni
+# o'ynaydi: join, readiness, har bir savolga javob, podium. Natijada join
+# kechikishi, javob tasdig'i (answer_result) p50/p95/p99, sekundiga xabarlar
+# va har bir javobga to'g'ri kelgan DB so'rovlari hamda DB executor navbati
+# chiqariladi.
+import asyncio
+import json
+import random
+import re
+import time
+
+from django.conf import settings
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.test.utils import override_settings
+
+from quizzes import kahoot_state
+from quizzes.kahoot_db import DB_STATS
+from quizzes.models import KahootPlayer, KahootQuestion, KahootQuiz, KahootSession, User
+
+
+IDLE_TIMEOUT = 120  # bitta frame uchun maksimal kutish (soniya)
+# Host roster_update'da shu vaqtda ko'rmagan o'yinchi join'i muvaffaqiyatsiz hisoblanadi
+JOIN_TIMEOUT = 10
+# Host game_ended'ni olgandan keyin o'yinchilar shuncha kutiladi
+GAME_END_GRACE = 5
+
+REDIS_URL_DEFAULT = 'redis://127.0.0.1:6379/0'
+
+
+def player_session_key(pin, player_id):
+    """Django session as kahoot_join leaves it; the consumer binds the bot from it"""
+    store = SessionStore()
+    store['kahoot_player_id'] = player_id
+    store['kahoot_session_pin'] = pin
+    store.create()
+    return store.session_key
+
+
+def session_cookie(session_key):
+    return f'{settings.SESSION_COOKIE_NAME}={session_key}'
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of `values` (0 for an empty list)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+class QueryCounter:
+    """
+    execute_wrapper counting SQL statements on every connection, including
+    the ones opened later by the Kahoot DB executor threads.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self, sender=None, connection=None, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    def __enter__(self):
+        from django.db import connections
+        connection_created.connect(self.install)
+        for connection in connections.all(initialized_only=True):
+            self.install(connection=connection)
+        return self
+
+    def __exit__(self, *exc_info):
+        connection_created.disconnect(self.install)
+
+
+class SwarmClient:
+    """
+    Reads frames in the background into a queue, so a bot that is busy
+    (thinking, timing out) never stalls or closes its socket.
+    """
+
+    def __init__(self):
+        self.frames = asyncio.Queue()
+        self.received = 0
+        self.reader = None
+
+    async def connect(self):
+        await self.open()
+        self.reader = asyncio.ensure_future(self.read_frames())
+
+    async def read_frames(self):
+        while True:
+            frame = await self.read()
+            self.received += 1
+            self.frames.put_nowait(json.loads(frame))
+
+    async def receive(self, timeout=IDLE_TIMEOUT):
+        return await asyncio.wait_for(self.frames.get(), timeout)
+
+    async def close(self):
+        await self.shutdown()
+        if self.reader:
+            self.reader.cancel()
+
+
+class CommunicatorClient(SwarmClient):
+    """In-process client driving the ASGI app through the Channels test communicator"""
+
+    def __init__(self, application, pin, session_key=None):
+        from channels.testing import WebsocketCommunicator
+
+        super().__init__()
+        headers = [(b'host', b'localhost'), (b'origin', b'http://localhost')]
+        if session_key:
+            headers.append((b'cookie', session_cookie(session_key).encode()))
+        self.communicator = WebsocketCommunicator(application, f'/ws/kahoot/{pin}/', headers=headers)
+
+    async def open(self):
+        connected, _ = await self.communicator.connect(timeout=IDLE_TIMEOUT)
+        if not connected:
+            raise ConnectionError("WebSocket connection was rejected")
+
+    async def send(self, payload):
+        await self.communicator.send_to(text_data=json.dumps(payload))
+
+    async def read(self):
+        # Communicator timeout'da ilovani bekor qiladi, shu sababli kutish cheklanmaydi
+        return await self.communicator.receive_from(timeout=None)
+
+    async def shutdown(self):
+        if not self.communicator.future.done():
+            await self.communicator.disconnect()
+
+
+class WebSocketClient(SwarmClient):
+    """Raw WebSocket client against a running daphne (needs the `websockets` package)"""
+
+    def __init__(self, url, pin, session_key=None):
+        super().__init__()
+        self.uri = f"{url.rstrip('/')}/ws/kahoot/{pin}/"
+        self.origin = re.sub(r'^ws', 'http', url.rstrip('/'))
+        self.headers = {'Cookie': session_cookie(session_key)} if session_key else None
+        self.connection = None
+
+    async def open(self):
+        import websockets
+
+        self.connection = await websockets.connect(
+            self.uri, origin=self.origin, max_size=None, open_timeout=IDLE_TIMEOUT,
+            additional_headers=self.headers,
+        )
+
+    async def send(self, payload):
+        await self.connection.send(json.dumps(payload))
+
+    async def read(self):
+        return await self.connection.recv()
+
+    async def shutdown(self):
+        await self.connection.close()
+
+
+class Swarm:
+    """One host and `players` bots playing a full game, with latency bookkeeping"""
+
+    def __init__(self, make_client, players, think_time, results_pause, connect_concurrency, log=None):
+        self.make_client = make_client
+        self.log = log
+        self.players = players
+        self.think_time = think_time
+        self.results_pause = results_pause
+        self.connect_slots = asyncio.Semaphore(connect_concurrency)
+        self.clients = []
+        self.join_latencies = []
+        self.ack_latencies = []
+        self.join_timeouts = 0
+        self.late_answers = 0
+        self.unfinished = 0
+        self.stalled = False
+        self.started = None
+        self.joins_pending = len(players)
+        self.all_joined = asyncio.Event()
+        self.seen_by_host = {}  # {player_id: asyncio.Event}
+
+    @property
+    def messages(self):
+        return sum(client.received for client in self.clients)
+
+    def seen_event(self, player_id):
+        return self.seen_by_host.setdefault(player_id, asyncio.Event())
+
+    def client(self, session_key=None):
+        client = self.make_client(session_key)
+        self.clients.append(client)
+        return client
+
+    async def run(self):
+        self.started = time.perf_counter()
+        host = self.client()
+        await host.connect()
+        await host.send({'action': 'host_join'})
+        player_tasks = [asyncio.ensure_future(self.play_player(player)) for player in self.players]
+        try:
+            try:
+                await self.play_host(host)
+            except asyncio.TimeoutError:
+                # Host IDLE_TIMEOUT davomida hech narsa olmadi: xabar tashlab yuborilgan
+                # (capacity/expiry) yoki server qotib qolgan
+                self.stalled = True
+                return
+            if player_tasks:
+                # game_ended'ni olmagan (xabari tashlab yuborilgan) o'yinchilar kutilmaydi
+                done, pending = await asyncio.wait(player_tasks, timeout=GAME_END_GRACE)
+                self.unfinished = len(pending)
+                for task in done:
+                    task.result()
+        finally:
+            for task in player_tasks:
+                task.cancel()
+            await asyncio.gather(*player_tasks, return_exceptions=True)
+            await host.close()
+
+    async def play_host(self, client):
+        # Hamma o'yinchi join qilib bo'lgach o'yin boshlanadi
+        starter = asyncio.ensure_future(self.start_when_joined(client))
+        try:
+            while True:
+                message = await client.receive()
+                kind = message.get('type')
+                if self.log and kind != 'roster_update':
+                    self.log(f"  [{time.perf_counter() - self.started:7.2f}s] host <- {kind}")
+                if kind == 'roster_update':
+                    for player in message['joined']:
+                        self.seen_event(player['player_id']).set()
+                elif kind == 'heartbeat':
+                    await client.send({'action': 'heartbeat'})
+                elif kind == 'question_results':
+                    await asyncio.sleep(self.results_pause)
+                    await client.send({'action': 'next_question'})
+                elif kind == 'game_ended':
+                    return
+        finally:
+            starter.cancel()
+
+    async def start_when_joined(self, client):
+        if self.players:
+            await self.all_joined.wait()
+        await client.send({'action': 'start_game'})
+
+    def join_finished(self):
+        self.joins_pending -= 1
+        if self.joins_pending == 0:
+            self.all_joined.set()
+
+    async def play_player(self, player):
+        player_id = player['id']
+        # Server o'yinchini Django sessiyasidan aniqlaydi (kahoot_join'dagi kabi)
+        client = self.client(player['session_key'])
+        try:
+            async with self.connect_slots:
+                started = time.perf_counter()
+                await client.connect()
+                await client.send({'action': 'player_join'})
+                # Join host o'yinchini roster_update'da ko'rguncha hisoblanadi (layer
+                # capacity to'lsa, group_send xabarni jimgina tashlab yuborishi mumkin)
+                try:
+                    await asyncio.wait_for(
+                        self.seen_event(player_id).wait(),
+                        max(0.0, started + JOIN_TIMEOUT - time.perf_counter()),
+                    )
+                    self.join_latencies.append(time.perf_counter() - started)
+                except asyncio.TimeoutError:
+                    self.join_timeouts += 1
+        finally:
+            self.join_finished()
+
+        answer_sent_at = None
+        try:
+            while True:
+                message = await client.receive()
+                kind = message.get('type')
+                if kind == 'heartbeat':
+                    await client.send({'action': 'heartbeat'})
+                elif kind == 'clock_ping':
+                    await client.send({
+                        'action': 'clock_pong',
+                        'server_time': message['server_time'],
+                        'client_time': time.time(),
+                    })
+                elif kind == 'game_started':
+                    await client.send({'action': 'player_ready'})
+                elif kind == 'show_question':
+                    # Brauzer kabi savol ochilishini (starts_at) kutadi; bot soati server soati
+                    opens_in = message['question']['starts_at'] - time.time()
+                    await asyncio.sleep(max(0.0, opens_in) + random.uniform(0, self.think_time))
+                    answer_sent_at = time.perf_counter()
+                    await client.send({
+                        'action': 'submit_answer',
+                        'selected_option': random.choice('ABCD'),
+                    })
+                elif kind == 'answer_result' and answer_sent_at is not None:
+                    self.ack_latencies.append(time.perf_counter() - answer_sent_at)
+                    answer_sent_at = None
+                    if message.get('late'):
+                        self.late_answers += 1
+                elif kind == 'game_ended':
+                    return
+        finally:
+            await client.close()
+
+
+class Command(BaseCommand):
+    help = (
+        "Kahoot swarm load test: a host and many simulated players play a full game, "
+        "in-process (Channels communicator) or against a running daphne (raw WebSockets)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players', type=int, default=1000)
+        parser.add_argument('--questions', type=int, default=5)
+        parser.add_argument('--time-limit', type=int, default=10, help="Seconds per question")
+        parser.add_argument('--think-time', type=float, default=2.0,
+                            help="Players answer a random delay of up to this many seconds after the question opens")
+        parser.add_argument('--results-pause', type=float, default=0.5,
+                            help="Host waits this long on the results screen")
+        parser.add_argument('--transport', choices=['communicator', 'websocket'], default='communicator')
+        parser.add_argument('--url', default='ws://127.0.0.1:8000',
+                            help="daphne address for the websocket transport")
+        parser.add_argument('--layer', choices=['inmemory', 'redis'], default='inmemory',
+                            help="Channel layer and state store for the communicator transport")
+        parser.add_argument('--redis-url', default=None,
+                            help=f"Redis for --layer redis (default REDIS_URL or {REDIS_URL_DEFAULT})")
+        parser.add_argument('--capacity', type=int, default=None,
+                            help="Per-channel capacity of the in-memory layer (layer default: 100); "
+                                 "the Redis pub/sub layer has no capacity")
+        parser.add_argument('--connect-concurrency', type=int, default=200)
+        parser.add_argument('--keep', action='store_true',
+                            help="Keep the generated host user, quiz, session and players")
+
+    def handle(self, *args, **options):
+        if options['transport'] == 'websocket':
+            try:
+                import websockets  # noqa: F401
+            except ImportError:
+                raise CommandError("The websocket transport needs the 'websockets' package")
+        # RedisPubSubChannelLayer capacity'ni **kwargs orqali qabul qilib, e'tiborsiz qoldiradi;
+        # daphne esa o'z layer sozlamalari bilan ishlaydi
+        if options['capacity'] and (options['transport'] == 'websocket' or options['layer'] == 'redis'):
+            raise CommandError("--capacity only applies to the in-memory layer of the communicator transport")
+
+        session, players = self.create_game(options)
+        self.stdout.write(
+            f"Session {session.pin}: {len(players)} players, {options['questions']} questions, "
+            f"{options['transport']} transport"
+        )
+        try:
+            if options['transport'] == 'websocket':
+                url = options['url']
+                swarm, elapsed, db = self.play(
+                    lambda session_key: WebSocketClient(url, session.pin, session_key), players, options,
+                )
+            else:
+                with override_settings(**self.layer_settings(options)):
+                    # State store settings'dan bir marta yaratiladi, shu sababli qayta tiklanadi
+                    kahoot_state._state_store = None
+                    from quizplatform.asgi import application
+                    swarm, elapsed, db = self.play(
+                        lambda session_key: CommunicatorClient(application, session.pin, session_key),
+                        players, options,
+                    )
+                kahoot_state._state_store = None
+        finally:
+            if not options['keep']:
+                self.delete_game(session, players)
+
+        self.report(swarm, elapsed, db, options)
+
+    def layer_settings(self, options):
+        if options['layer'] == 'inmemory':
+            layer_config = {}
+            if options['capacity']:
+                layer_config['capacity'] = options['capacity']
+            return {
+                'CHANNEL_LAYERS': {'default': {
+                    'BACKEND': 'channels.layers.InMemoryChannelLayer',
+                    'CONFIG': layer_config,
+                }},
+                'KAHOOT_STATE_STORE': {'BACKEND': 'quizzes.kahoot_state.InMemoryGameStateStore'},
+            }
+        from django.conf import settings
+        url = options['redis_url'] or getattr(settings, 'REDIS_URL', None) or REDIS_URL_DEFAULT
+        return {
+            'CHANNEL_LAYERS': {'default': {
+                'BACKEND': 'channels_redis.pubsub.RedisPubSubChannelLayer',
+                'CONFIG': {'hosts': [url]},
+            }},
+            'KAHOOT_STATE_STORE': {
+                'BACKEND': 'quizzes.kahoot_state.RedisGameStateStore',
+                'CONFIG': {'url': url},
+            },
+        }
+
+    @transaction.atomic
+    def create_game(self, options):
+        host, _ = User.objects.get_or_create(username='kahoot_swarm_host')
+        quiz = KahootQuiz.objects.create(title='Swarm load test', creator=host)
+        KahootQuestion.objects.bulk_create([
+            KahootQuestion(
+                quiz=quiz,
+                text=f"Swarm question {i + 1}",
+                option_a='A', option_b='B', option_c='C', option_d='D',
+                correct_option=random.choice('ABCD'),
+                time_limit=options['time_limit'],
+                order=i,
+            )
+            for i in range(options['questions'])
+        ])
+        session = KahootSession.objects.create(
+            quiz=quiz, host=host, max_players=options['players'], player_count=options['players'],
+            quiz_snapshot=quiz.compile_snapshot(),
+        )
+        KahootPlayer.objects.bulk_create([
+            KahootPlayer(session=session, nickname=f'bot{i:05d}', avatar_id=i % 15 + 1)
+            for i in range(options['players'])
+        ])
+        players = list(session.players.values('id', 'nickname', 'avatar_id'))
+        for player in players:
+            player['session_key'] = player_session_key(session.pin, player['id'])
+        return session, players
+
+    @transaction.atomic
+    def delete_game(self, session, players):
+        host = session.host
+        # Quiz o'chirilganda sessiya, savollar, o'yinchilar, javoblar va reyting ham o'chadi
+        session.quiz.delete()
+        Session.objects.filter(session_key__in=[p['session_key'] for p in players]).delete()
+        # --keep bilan qoldirilgan oldingi o'yinlar bo'lsa, host foydalanuvchisi saqlanadi
+        User.objects.filter(
+            pk=host.pk, kahoot_quizzes__isnull=True, hosted_sessions__isnull=True,
+        ).delete()
+
+    def play(self, make_client, players, options):
+        swarm = Swarm(
+            make_client, players,
+            think_time=options['think_time'],
+            results_pause=options['results_pause'],
+            connect_concurrency=options['connect_concurrency'],
+            log=self.stdout.write if options['verbosity'] > 1 else None,
+        )
+        DB_STATS.reset()
+        with QueryCounter() as counter:
+            started = time.perf_counter()
+            asyncio.run(swarm.run())
+            elapsed = time.perf_counter() - started
+        # Alohida daphne jarayonidagi so'rovlarni bu yerdan sanab bo'lmaydi
+        if options['transport'] == 'communicator':
+            return swarm, elapsed, (counter.count, DB_STATS.snapshot())
+        return swarm, elapsed, None
+
+    def report(self, swarm, elapsed, db, options):
+        def line(name, values):
+            ms = [v * 1000 for v in values]
+            self.stdout.write(
+                f"  {name:<14} p50 {percentile(ms, 50):8.1f} ms  p95 {percentile(ms, 95):8.1f} ms  "
+                f"p99 {percentile(ms, 99):8.1f} ms  ({len(ms)} samples)"
+            )
+
+        answers = len(swarm.ack_latencies)
+        if swarm.stalled:
+            self.stdout.write(self.style.WARNING(
+                f"Game stalled after {elapsed:.1f}s: the host got no frame for {IDLE_TIMEOUT}s"
+            ))
+        else:
+            self.stdout.write(f"Game finished in {elapsed:.1f}s")
+        line('join', swarm.join_latencies)
+        self.stdout.write(f"  {'join timeouts':<14} {swarm.join_timeouts}")
+        line('answer ack', swarm.ack_latencies)
+        self.stdout.write(f"  {'late answers':<14} {swarm.late_answers}")
+        self.stdout.write(f"  {'no game_ended':<14} {swarm.unfinished}")
+        self.stdout.write(
+            f"  {'messages':<14} {swarm.messages} received, {swarm.messages / elapsed:.0f} per second"
+        )
+        if db is None:
+            self.stdout.write(f"  {'db queries':<14} n/a (server runs in another process)")
+            return
+        queries, stats = db
+        if answers:
+            self.stdout.write(f"  {'db queries':<14} {queries} total, {queries / answers:.2f} per answer")
+        self.stdout.write(
+            f"  {'db queue':<14} max depth {stats['max_queued']}, wait avg "
+            f"{stats['avg_wait'] * 1000:.1f} ms max {stats['max_wait'] * 1000:.1f} ms "
+            f"({stats['completed']} jobs)"
+        )
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.10 on 2026-10-16 20:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quizzes', '0008_kahootsession_max_players'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='kahootsession',
+            name='quiz_snapshot',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
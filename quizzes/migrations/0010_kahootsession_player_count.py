@@ -0,0 +1,26 @@
+# Generated by Django 5.2.10 on 2026-10-16 23:02
+
+from django.db import migrations, models
+
+
+def count_players(apps, schema_editor):
+    KahootSession = apps.get_model('quizzes', 'KahootSession')
+    for session in KahootSession.objects.annotate(players_total=models.Count('players')):
+        if session.players_total:
+            KahootSession.objects.filter(pk=session.pk).update(player_count=session.players_total)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quizzes', '0009_kahootsession_quiz_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='kahootsession',
+            name='player_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_players, migrations.RunPython.noop),
+    ]
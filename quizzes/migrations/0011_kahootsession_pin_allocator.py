@@ -0,0 +1,18 @@
+# Generated by Django 5.2.10 on 2026-10-16 23:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quizzes', '0010_kahootsession_player_count'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='kahootsession',
+            name='pin',
+            field=models.CharField(blank=True, max_length=6, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.10 on 2026-10-16 23:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quizzes', '0011_kahootsession_pin_allocator'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='kahootsession',
+            name='live_checkpoint',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.10 on 2026-10-16 23:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_standings(apps, schema_editor):
+    KahootPlayer = apps.get_model('quizzes', 'KahootPlayer')
+    KahootSession = apps.get_model('quizzes', 'KahootSession')
+    KahootStanding = apps.get_model('quizzes', 'KahootStanding')
+    for session_id in KahootSession.objects.filter(status='FINISHED').values_list('id', flat=True):
+        players = (
+            KahootPlayer.objects.filter(session_id=session_id)
+            .annotate(
+                correct_count=models.Count('answers', filter=models.Q(answers__is_correct=True)),
+                avg_time=models.Avg('answers__time_taken'),
+            )
+            .order_by('-score', 'joined_at', 'id')
+        )
+        standings, rank, previous = [], 0, None
+        for position, player in enumerate(players, 1):
+            if player.score != previous:
+                rank, previous = position, player.score
+            standings.append(KahootStanding(
+                session_id=session_id, player_id=player.id, rank=rank, score=player.score,
+                correct_count=player.correct_count, avg_time=player.avg_time,
+            ))
+        KahootStanding.objects.bulk_create(standings)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quizzes', '0012_kahootsession_live_checkpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KahootStanding',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveIntegerField()),
+                ('score', models.IntegerField(default=0)),
+                ('correct_count', models.PositiveIntegerField(default=0)),
+                ('avg_time', models.FloatField(blank=True, null=True)),
+                ('player', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='standing', to='quizzes.kahootplayer')),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='standings', to='quizzes.kahootsession')),
+            ],
+            options={
+                'ordering': ['rank', 'id'],
+                'indexes': [models.Index(fields=['session', 'rank'], name='quizzes_kah_session_1fd14c_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_standings, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,7 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
+from datetime import timedelta
 import uuid
 
 
@@ -155,7 +156,7 @@ import string
 
 
 def generate_pin():
-    """6 xonali unikal PIN yaratish"""
+    """6 xonali tasodifiy PIN (eski migratsiyalar uchun; yangi PIN'lar kahoot_pins'da)"""
     return ''.join(random.choices(string.digits, k=6))
 
 
@@ -170,6 +171,33 @@ class KahootQuiz(models.Model):
     
     def __str__(self):
         return self.title
+    
+    def has_live_session(self):
+        """
+        Lobby yoki o'yindagi sessiyasi bormi: ularning snapshot'i savollarga
+        bog'langan. PIN_REUSE_AFTER'dan eski tugamagan sessiyalar tashlab
+        ketilgan hisoblanadi.
+        """
+        from .kahoot_pins import PIN_REUSE_AFTER
+
+        cutoff = timezone.now() - timedelta(seconds=PIN_REUSE_AFTER)
+        return self.sessions.filter(
+            status__in=['LOBBY', 'PLAYING'], created_at__gte=cutoff,
+        ).exists()
+
+    def compile_snapshot(self):
+        """Savollarning o'zgarmas nusxasi (sessiya boshlanganda saqlanadi)"""
+        return [
+            {
+                'question_id': q.id,
+                'text': q.text,
+                'image': q.image.url if q.image else None,
+                'options': {'A': q.option_a, 'B': q.option_b, 'C': q.option_c, 'D': q.option_d},
+                'correct_option': q.correct_option,
+                'time_limit': q.time_limit,
+            }
+            for q in self.questions.all().order_by('order', 'id')
+        ]
 
 
 class KahootQuestion(models.Model):
@@ -207,11 +235,18 @@ class KahootSession(models.Model):
     
     quiz = models.ForeignKey(KahootQuiz, on_delete=models.CASCADE, related_name='sessions')
     host = models.ForeignKey(User, on_delete=models.CASCADE, related_name='hosted_sessions')
-    pin = models.CharField(max_length=6, unique=True, default=generate_pin)
+    # Saqlanganda id'dan ajratiladi; qaytarib olingan eski sessiyalarda NULL
+    pin = models.CharField(max_length=6, unique=True, null=True, blank=True)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='LOBBY')
     max_players = models.PositiveIntegerField(default=50, help_text="Maksimal o'yinchilar soni")
+    # Band qilingan joylar (qo'shilishda shartli UPDATE bilan oshiriladi)
+    player_count = models.PositiveIntegerField(default=0)
     current_question_index = models.IntegerField(default=-1)  # -1 = hali boshlanmagan
     question_start_time = models.DateTimeField(null=True, blank=True)
+    # Sessiya yaratilganda muzlatilgan savollar (o'yin davomida quiz tahrirlansa ham o'zgarmaydi)
+    quiz_snapshot = models.JSONField(default=list, blank=True)
+    # O'yin bosqichi o'zgarganda yoziladigan jonli holat (worker qayta ishga tushsa tiklanadi)
+    live_checkpoint = models.JSONField(default=dict, blank=True)
     created_at = models.DateTimeField(default=timezone.now)
     
     class Meta:
@@ -220,17 +255,31 @@ class KahootSession(models.Model):
     def __str__(self):
         return f"Session {self.pin} - {self.quiz.title}"
     
+    def save(self, *args, **kwargs):
+        from .kahoot_pins import allocate_pin
+
+        if not self._state.adding or self.pin:
+            return super().save(*args, **kwargs)
+        # PIN id'ga bog'liq: INSERT va PIN ajratish bitta tranzaksiyada
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self.pin = allocate_pin(self.id)
+    
+    def get_questions(self):
+        """Snapshot savollari (eski sessiyalar uchun quizdan yig'iladi)"""
+        if not self.quiz_snapshot:
+            self.quiz_snapshot = self.quiz.compile_snapshot()
+        return self.quiz_snapshot
+    
     def get_current_question(self):
-        """Joriy savolni qaytarish"""
-        if self.current_question_index < 0:
-            return None
-        questions = list(self.quiz.questions.all())
-        if self.current_question_index < len(questions):
+        """Joriy savol (snapshot'dagi dict)"""
+        questions = self.get_questions()
+        if 0 <= self.current_question_index < len(questions):
             return questions[self.current_question_index]
         return None
     
     def total_questions(self):
-        return self.quiz.questions.count()
+        return len(self.get_questions())
 
 
 class KahootPlayer(models.Model):
@@ -252,6 +301,23 @@ class KahootPlayer(models.Model):
         return f"{self.nickname} ({self.score} pts)"
 
 
+class KahootStanding(models.Model):
+    """Tugagan o'yinning yakuniy natijasi: o'yin oxirida bir marta yoziladi"""
+    session = models.ForeignKey(KahootSession, on_delete=models.CASCADE, related_name='standings')
+    player = models.OneToOneField(KahootPlayer, on_delete=models.CASCADE, related_name='standing')
+    rank = models.PositiveIntegerField()  # Teng ball - teng o'rin
+    score = models.IntegerField(default=0)
+    correct_count = models.PositiveIntegerField(default=0)
+    avg_time = models.FloatField(null=True, blank=True)  # Soniyalarda; javob bo'lmasa NULL
+    
+    class Meta:
+        ordering = ['rank', 'id']
+        indexes = [models.Index(fields=['session', 'rank'])]
+    
+    def __str__(self):
+        return f"#{self.rank} {self.player_id} ({self.score} pts)"
+
+
 class KahootAnswer(models.Model):
     """O'yinchi javobi har bir savol uchun"""
     player = models.ForeignKey(KahootPlayer, on_delete=models.CASCADE, related_name='answers')
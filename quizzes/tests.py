@@ -1,3 +1,1312 @@
-from django.test import TestCase
+import asyncio
+import json
+from io import StringIO
+import random
+import shutil
+import subprocess
+import threading
+import time
+import unittest
+from unittest import mock
 
-# Create your tests here.
+import msgpack
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.backends.signals import connection_created
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from quizplatform.asgi import application
+
+from . import kahoot_loop, kahoot_state
+from .kahoot_admission import JoinRejected, admit_player, remove_player
+from .kahoot_clock import MAX_LATENCY_COMPENSATION, SYNC_SAMPLES, ClockSync
+from .kahoot_codec import CODECS, COMPACT_TYPES, MSGPACK_SUBPROTOCOL, SHORT_KEYS, negotiate_codec
+from .kahoot_db import DB_STATS, db_task
+from .kahoot_persistence import flush_pending_answers, write_standings
+from .kahoot_pins import PIN_SPACE, allocate_pin, permute_pin
+from .kahoot_ranking import RankingIndex
+from .models import (
+    KahootAnswer, KahootPlayer, KahootQuestion, KahootQuiz, KahootSession, User,
+)
+
+
+KAHOOT_TEST_SETTINGS = {
+    'CHANNEL_LAYERS': {'default': {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        'CONFIG': {'capacity': 1000},
+    }},
+    'KAHOOT_STATE_STORE': {'BACKEND': 'quizzes.kahoot_state.InMemoryGameStateStore'},
+}
+
+ROOM_SIZES = (2, 6)
+
+# Coalesced host-only updates (answer_count_update, ready_progress,
+# roster_update) send at most one immediate and one trailing frame per burst
+COALESCED_FRAMES = 2
+
+
+class QueryRecorder:
+    """
+    execute_wrapper installed on every connection, including the ones the
+    Kahoot DB executor threads open; appends SQL to `sink` while it is set.
+    """
+    sink = None
+
+    def __call__(self, execute, sql, params, many, context):
+        if self.sink is not None:
+            self.sink.append(sql)
+        return execute(sql, params, many, context)
+
+    def install(self, sender=None, connection=None, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+
+QUERY_RECORDER = QueryRecorder()
+connection_created.connect(QUERY_RECORDER.install)
+
+
+def player_session_key(session, player_id):
+    """Django session that kahoot_join would have created for the player"""
+    store = SessionStore()
+    store['kahoot_player_id'] = player_id
+    store['kahoot_session_pin'] = session.pin
+    store.create()
+    return store.session_key
+
+
+class Room:
+    """A host and `size` players connected through WebsocketCommunicators"""
+
+    def __init__(self, session, player_ids, session_keys, queries):
+        self.session = session
+        self.player_ids = player_ids
+        self.session_keys = session_keys
+        self.queries = queries
+        self.host = self.communicator()
+        self.players = [self.communicator(key) for key in session_keys]
+
+    def communicator(self, session_key=None, subprotocols=None):
+        headers = [(b'host', b'localhost'), (b'origin', b'http://localhost')]
+        if session_key:
+            headers.append((b'cookie', f'{settings.SESSION_COOKIE_NAME}={session_key}'.encode()))
+        return WebsocketCommunicator(
+            application, f'/ws/kahoot/{self.session.pin}/', headers=headers, subprotocols=subprotocols,
+        )
+
+    @property
+    def communicators(self):
+        return [self.host, *self.players]
+
+    async def connect(self):
+        for communicator in self.communicators:
+            connected, _ = await communicator.connect()
+            assert connected
+
+    async def disconnect(self):
+        for communicator in self.communicators:
+            await communicator.disconnect()
+
+    async def send(self, communicator, payload):
+        await communicator.send_to(text_data=json.dumps(payload))
+
+    async def settle(self, quiet=0.3):
+        """Wait until no communicator has received a frame for `quiet` seconds"""
+        sizes = None
+        while sizes != [c.output_queue.qsize() for c in self.communicators]:
+            sizes = [c.output_queue.qsize() for c in self.communicators]
+            await asyncio.sleep(quiet)
+
+    def drain(self):
+        """[(communicator, payload), ...] of every frame sent since the last drain"""
+        frames = []
+        for communicator in self.communicators:
+            while not communicator.output_queue.empty():
+                message = communicator.output_queue.get_nowait()
+                # Serverning close xabari frame emas
+                if message['type'] == 'websocket.close':
+                    continue
+                frames.append((communicator, json.loads(message['text'])))
+        return frames
+
+    async def measure(self, *actions):
+        """Send (communicator, payload) actions; returns (frames, queries)"""
+        before = len(self.queries)
+        for communicator, payload in actions:
+            await self.send(communicator, payload)
+        await self.settle()
+        return self.drain(), len(self.queries) - before
+
+
+@override_settings(**KAHOOT_TEST_SETTINGS)
+class KahootMessageBudgetTests(TransactionTestCase):
+    """
+    Frames sent and SQL queries run by each KahootConsumer action, as a
+    function of room size. Broadcasts must stay O(N) frames and the answer
+    path must not touch the database.
+    """
+
+    def setUp(self):
+        # Consumer DB calls run on the Kahoot DB executor's threads and connections
+        self.queries = []
+        QUERY_RECORDER.install(connection=connection)
+        QUERY_RECORDER.sink = self.queries
+        self.addCleanup(setattr, QUERY_RECORDER, 'sink', None)
+        # Heartbeat'lar faqat ular tekshiriladigan testda yuboriladi
+        self.enterContext(mock.patch('quizzes.consumers.HEARTBEAT_INTERVAL', 3600))
+        kahoot_state._state_store = None
+        kahoot_loop._game_loops.clear()
+        self.host_user = User.objects.create(username='host')
+        self.quiz = KahootQuiz.objects.create(title='Budget', creator=self.host_user)
+        for i in range(2):
+            KahootQuestion.objects.create(
+                quiz=self.quiz, text=f'Q{i}', option_a='a', option_b='b', option_c='c',
+                option_d='d', correct_option='A', time_limit=30, order=i,
+            )
+
+    def tearDown(self):
+        kahoot_state._state_store = None
+        kahoot_loop._game_loops.clear()
+
+    def create_room(self, size):
+        session = KahootSession.objects.create(
+            quiz=self.quiz, host=self.host_user, max_players=size, player_count=size,
+            quiz_snapshot=self.quiz.compile_snapshot(),
+        )
+        player_ids = [
+            KahootPlayer.objects.create(session=session, nickname=f'p{i}').id
+            for i in range(size)
+        ]
+        session_keys = [player_session_key(session, player_id) for player_id in player_ids]
+        return Room(session, player_ids, session_keys, self.queries)
+
+    def assertBudget(self, measured, frames, max_queries):
+        """`frames` is {type: count}; coalesced types are given as (0, max) ranges"""
+        sent, queries = measured
+        counts = {}
+        for _, payload in sent:
+            counts[payload['type']] = counts.get(payload['type'], 0) + 1
+        self.assertLessEqual(set(counts), set(frames), "unexpected frame types")
+        for frame_type, expected in frames.items():
+            if isinstance(expected, tuple):
+                self.assertLessEqual(counts.get(frame_type, 0), expected[1], frame_type)
+            else:
+                self.assertEqual(counts.get(frame_type, 0), expected, frame_type)
+        self.assertLessEqual(queries, max_queries)
+
+    async def start_room(self, size=2):
+        """Room whose players are on the first question; returns (room, player_ready frames)"""
+        room = await database_sync_to_async(self.create_room)(size)
+        await room.connect()
+        await room.measure((room.host, {'action': 'host_join'}))
+        await room.measure(*[(c, {'action': 'player_join'}) for c in room.players])
+        await room.measure((room.host, {'action': 'start_game'}))
+        sent, _ = await room.measure(*[(c, {'action': 'player_ready'}) for c in room.players])
+        return room, sent
+
+    async def play_game(self, size):
+        room = await database_sync_to_async(self.create_room)(size)
+        everyone = size + 1
+        coalesced = (0, COALESCED_FRAMES)
+        await room.connect()
+
+        # Sessiya bazadan bir marta yuklanadi
+        self.assertBudget(
+            await room.measure((room.host, {'action': 'host_join'})),
+            {'host_connected': 1, 'clock_ping': 1}, max_queries=2,
+        )
+        for communicator in room.players:
+            self.assertBudget(
+                await room.measure((communicator, {'action': 'player_join'})),
+                {'roster_update': coalesced}, max_queries=0,
+            )
+        self.assertBudget(
+            await room.measure((room.host, {'action': 'start_game'})),
+            {'game_started': everyone, 'ready_progress': 1}, max_queries=1,
+        )
+        self.assertBudget(
+            await room.measure(*[(communicator, {'action': 'player_ready'}) for communicator in room.players]),
+            {
+                'sync_current_state': size, 'clock_ping': size, 'show_question': everyone,
+                'ready_progress': coalesced,
+            },
+            max_queries=1,
+        )
+
+        # Javob yo'li bazaga tegmaydi; javoblar savol yopilganda bulk yoziladi
+        first, *rest = room.players
+        self.assertBudget(
+            await room.measure((first, {'action': 'submit_answer', 'selected_option': 'A'})),
+            {'answer_result': 1, 'answer_count_update': coalesced}, max_queries=0,
+        )
+        self.assertBudget(
+            await room.measure(*[
+                (communicator, {'action': 'submit_answer', 'selected_option': 'B'}) for communicator in rest
+            ]),
+            # Savol yopilishi: javoblar bulk yoziladi va bosqich checkpoint qilinadi
+            {'answer_result': size - 1, 'answer_count_update': coalesced, 'question_results': everyone},
+            max_queries=4,
+        )
+
+        self.assertBudget(
+            await room.measure((room.host, {'action': 'next_question'})),
+            {'show_question': everyone}, max_queries=1,
+        )
+        self.assertBudget(
+            await room.measure((room.host, {'action': 'show_results'})),
+            {'question_results': everyone}, max_queries=1,
+        )
+        self.assertBudget(
+            await room.measure((room.host, {'action': 'end_game'})),
+            # Checkpoint, yakuniy reyting uchun bitta aggregate SELECT va bitta bulk INSERT (BEGIN bilan)
+            {'game_ended': everyone}, max_queries=4,
+        )
+        standings = await database_sync_to_async(room.session.standings.count)()
+        self.assertEqual(standings, size)
+        await room.disconnect()
+
+    async def test_game_actions_stay_linear(self):
+        for size in ROOM_SIZES:
+            with self.subTest(size=size):
+                await self.play_game(size)
+
+    async def test_kick_player(self):
+        for size in ROOM_SIZES:
+            with self.subTest(size=size):
+                room = await database_sync_to_async(self.create_room)(size)
+                await room.connect()
+                await room.measure((room.host, {'action': 'host_join'}))
+                await room.measure(*[(communicator, {'action': 'player_join'}) for communicator in room.players])
+                self.assertBudget(
+                    await room.measure((room.host, {'action': 'kick_player', 'player_id': room.player_ids[-1]})),
+                    # O'chirish (javoblar va yakuniy reyting kaskadi bilan) va joy hisoblagichini kamaytirish
+                    {'roster_update': 2}, max_queries=6,
+                )
+                await room.disconnect()
+
+    async def test_kicked_player_does_not_hold_question_open(self):
+        room = await database_sync_to_async(self.create_room)(3)
+        await room.connect()
+        await room.measure((room.host, {'action': 'host_join'}))
+        await room.measure(*[(communicator, {'action': 'player_join'}) for communicator in room.players])
+        kicked, kicked_id = room.players.pop(), room.player_ids[-1]
+        await room.measure((room.host, {'action': 'kick_player', 'player_id': kicked_id}))
+        self.assertEqual(json.loads((await kicked.receive_output())['text'])['type'], 'roster_update')
+        self.assertEqual((await kicked.receive_output())['type'], 'websocket.close')
+
+        # Yopilgan ulanishdan kelgan heartbeat o'yinchini presence'ga qaytarmaydi
+        await room.send(kicked, {'action': 'heartbeat'})
+        await room.measure((room.host, {'action': 'start_game'}))
+        await room.measure(*[(communicator, {'action': 'player_ready'}) for communicator in room.players])
+        sent, _ = await room.measure(
+            *[(communicator, {'action': 'submit_answer', 'selected_option': 'A'}) for communicator in room.players]
+        )
+        self.assertIn('question_results', [p['type'] for _, p in sent])
+
+        await kicked.disconnect()
+        await room.settle()
+        self.assertNotIn(kicked_id, [pid for _, p in room.drain() for pid in p.get('left', ())])
+        await room.disconnect()
+
+    async def test_answer_spam_is_limited_and_merged(self):
+        room, _ = await self.start_room()
+        player = room.players[0]
+
+        # Takroriy javoblar savolni yopmaydi; limitdan oshganlari javobsiz qoladi
+        answer = {'action': 'submit_answer', 'selected_option': 'A'}
+        sent, queries = await room.measure(*[(player, answer)] * 20)
+        results = [payload for _, payload in sent if payload['type'] == 'answer_result']
+        self.assertEqual(len(results), 3)
+        self.assertEqual({r['points_earned'] for r in results}, {results[0]['points_earned']})
+        self.assertBudget((sent, queries), {
+            'answer_result': 3, 'answer_count_update': (0, COALESCED_FRAMES),
+        }, max_queries=0)
+        await room.disconnect()
+
+    async def test_reconnect_replays_missed_events(self):
+        room, sent = await self.start_room()
+        player = room.players[0]
+        last_seq = max(p['seq'] for c, p in sent if c is player and p['type'] == 'show_question')
+
+        # O'yinchi uzilgan paytda savol yopiladi va keyingisi ochiladi
+        await player.disconnect()
+        room.players[0] = player = room.communicator(room.session_keys[0])
+        await room.measure((room.host, {'action': 'show_results'}))
+        await room.measure((room.host, {'action': 'next_question'}))
+        connected, _ = await player.connect()
+        self.assertTrue(connected)
+
+        sent, queries = await room.measure(
+            (player, {'action': 'player_ready', 'last_seq': last_seq}),
+        )
+        replayed = [p for c, p in sent if c is player]
+        self.assertEqual(
+            [p['type'] for p in replayed], ['clock_ping', 'question_results', 'show_question'],
+        )
+        self.assertEqual([p['seq'] for p in replayed[1:]], [last_seq + 1, last_seq + 2])
+        self.assertEqual(queries, 0)
+
+        # Buferda bo'lmagan ketma-ketlik: to'liq sinxronizatsiya
+        sent, _ = await room.measure(
+            (player, {'action': 'player_ready', 'last_seq': last_seq + 10}),
+        )
+        self.assertEqual([p['type'] for c, p in sent if c is player], ['sync_current_state'])
+        self.assertEqual(sent[-1][1]['seq'], last_seq + 2)
+        await room.disconnect()
+
+    async def test_lobby_roster_is_batched(self):
+        size = ROOM_SIZES[-1]
+        room = await database_sync_to_async(self.create_room)(size)
+        await room.connect()
+        await room.measure((room.host, {'action': 'host_join'}))
+
+        # Butun lobby bir vaqtda kiradi: host bir nechta roster_update oladi, o'yinchilar hech narsa
+        sent, _ = await room.measure(*[(communicator, {'action': 'player_join'}) for communicator in room.players])
+        self.assertBudget((sent, 0), {'roster_update': (0, COALESCED_FRAMES)}, max_queries=0)
+        self.assertTrue(all(c is room.host for c, _ in sent))
+        joined = {p['player_id'] for _, payload in sent for p in payload['joined']}
+        self.assertEqual(joined, set(room.player_ids))
+
+        for communicator in room.players:
+            await communicator.disconnect()
+        await room.settle()
+        sent = room.drain()
+        self.assertBudget((sent, 0), {'roster_update': (0, COALESCED_FRAMES)}, max_queries=0)
+        self.assertEqual({pid for _, payload in sent for pid in payload['left']}, set(room.player_ids))
+        await room.host.disconnect()
+
+    async def test_silent_connection_is_closed(self):
+        self.enterContext(mock.patch('quizzes.consumers.HEARTBEAT_INTERVAL', 0.1))
+        self.enterContext(mock.patch('quizzes.consumers.HEARTBEAT_TIMEOUT', 0.4))
+        room = await database_sync_to_async(self.create_room)(2)
+        (silent, silent_id), (alive, alive_id) = zip(room.players, room.player_ids)
+        for communicator in room.players:
+            await communicator.connect()
+            await room.send(communicator, {'action': 'player_join'})
+        await asyncio.sleep(0.05)
+        store = kahoot_state.get_state_store()
+        self.assertEqual(await store.get_present(room.session.pin), {silent_id, alive_id})
+
+        async def answer_heartbeats():
+            while True:
+                message = await alive.receive_output(timeout=2)
+                # Serverning close xabari frame emas
+                if message['type'] == 'websocket.close':
+                    return 'closed'
+                await room.send(alive, {'action': 'heartbeat'})
+
+        keeper = asyncio.ensure_future(answer_heartbeats())
+        received = []
+        while (message := await silent.receive_output(timeout=2))['type'] != 'websocket.close':
+            received.append(json.loads(message['text'])['type'])
+        self.assertIn('heartbeat', received)
+
+        # Server yopgan ulanish disconnect bo'ladi va presence'dan chiqadi
+        await silent.disconnect()
+        self.assertEqual(await store.get_present(room.session.pin), {alive_id})
+        self.assertFalse(keeper.done())
+        keeper.cancel()
+        await asyncio.gather(keeper, return_exceptions=True)
+        await alive.disconnect()
+
+    async def test_disconnected_player_does_not_hold_question_open(self):
+        room, _ = await self.start_room()
+        player, other = room.players
+        await other.disconnect()
+        room.players = [player]
+
+        # Ulangan yagona o'yinchi javob berdi: savol taymerni kutmasdan yopiladi
+        sent, _ = await room.measure(
+            (player, {'action': 'submit_answer', 'selected_option': 'A'}),
+        )
+        types = [p['type'] for _, p in sent]
+        self.assertIn('question_results', types)
+        count = next(p for _, p in sent if p['type'] == 'answer_count_update')
+        self.assertEqual((count['count'], count['total'], count['connected']), (1, 2, 1))
+        await room.disconnect()
+
+    async def test_orphaned_answer_does_not_block_the_game(self):
+        room, _ = await self.start_room()
+        (player, player_id), (other, other_id) = zip(room.players, room.player_ids)
+
+        # Yaroqsiz variant qabul qilinmaydi
+        sent, _ = await room.measure(
+            (other, {'action': 'submit_answer', 'selected_option': ['A']}),
+            (other, {'action': 'submit_answer', 'selected_option': 'AB'}),
+        )
+        self.assertEqual([p['points_earned'] for _, p in sent if p['type'] == 'answer_result'], [0, 0])
+
+        # Javoblar buferda turganda savol bazadan o'chiriladi (FK endi buziladi)
+        await room.measure((player, {'action': 'submit_answer', 'selected_option': 'A'}))
+        await database_sync_to_async(KahootQuestion.objects.filter(order=0).delete)()
+        sent, _ = await room.measure((other, {'action': 'submit_answer', 'selected_option': 'A'}))
+        self.assertIn('question_results', [p['type'] for _, p in sent])
+
+        # Keyingi savol javoblari bazaga yetib boradi
+        sent, _ = await room.measure((room.host, {'action': 'next_question'}))
+        self.assertIn('show_question', [p['type'] for _, p in sent])
+        await room.measure((player, {'action': 'submit_answer', 'selected_option': 'A'}))
+        sent, _ = await room.measure((other, {'action': 'submit_answer', 'selected_option': 'B'}))
+        self.assertIn('question_results', [p['type'] for _, p in sent])
+        saved = await database_sync_to_async(
+            lambda: sorted(KahootAnswer.objects.values_list('player_id', 'selected_option'))
+        )()
+        self.assertEqual(saved, sorted([(player_id, 'A'), (other_id, 'B')]))
+        self.assertEqual(await kahoot_state.get_state_store().get_pending_answers(room.session.pin), [])
+        await room.disconnect()
+
+    async def test_answer_before_question_opens_is_rejected(self):
+        self.enterContext(mock.patch('quizzes.kahoot_loop.QUESTION_LEAD', 5))
+        room, sent = await self.start_room()
+        player = room.players[0]
+        question = next(p['question'] for _, p in sent if p['type'] == 'show_question')
+        self.assertGreater(question['starts_at'], time.time())
+
+        # starts_at'ni kutmagan klient 0 soniyalik to'liq ball ololmaydi
+        sent, _ = await room.measure((player, {'action': 'submit_answer', 'selected_option': 'A'}))
+        result = next(p for _, p in sent if p['type'] == 'answer_result')
+        self.assertEqual(result['points_earned'], 0)
+        answers = await kahoot_state.get_state_store().get_answers(room.session.pin, question['question_id'])
+        self.assertEqual(answers, {})
+        await room.disconnect()
+
+    async def test_player_identity_comes_from_session(self):
+        room = await database_sync_to_async(self.create_room)(2)
+        (player, player_id), (other, other_id) = zip(room.players, room.player_ids)
+        stranger = room.communicator()
+        room.players.append(stranger)
+        await room.connect()
+        await room.measure((room.host, {'action': 'host_join'}))
+
+        # Sessiyasiz ulanish birovning id'si bilan qo'shila olmaydi
+        sent, _ = await room.measure((stranger, {'action': 'player_join', 'player_id': other_id}))
+        self.assertEqual(sent, [])
+        sent, _ = await room.measure((player, {'action': 'player_join', 'player_id': other_id}))
+        self.assertEqual([p['player_id'] for _, payload in sent for p in payload['joined']], [player_id])
+
+        await room.measure((other, {'action': 'player_join'}))
+        await room.measure((room.host, {'action': 'start_game'}))
+        await room.measure(
+            (player, {'action': 'player_ready'}),
+            (other, {'action': 'player_ready'}),
+        )
+        sent, queries = await room.measure(
+            (player, {'action': 'submit_answer', 'player_id': other_id, 'selected_option': 'A'}),
+            (stranger, {'action': 'submit_answer', 'player_id': other_id, 'selected_option': 'A'}),
+        )
+        self.assertEqual(queries, 0)
+        store = kahoot_state.get_state_store()
+        state = await store.get_state(room.session.pin)
+        answers = await store.get_answers(room.session.pin, state['questions'][0]['question_id'])
+        self.assertEqual(set(answers), {player_id})
+        await room.disconnect()
+
+    async def test_msgpack_subprotocol_gets_binary_frames(self):
+        self.enterContext(mock.patch('quizzes.kahoot_loop.QUESTION_LEAD', 0))
+        room = await database_sync_to_async(self.create_room)(1)
+        room.players[0] = player = room.communicator(room.session_keys[0], [MSGPACK_SUBPROTOCOL])
+        await room.host.connect()
+        connected, subprotocol = await player.connect()
+        self.assertTrue(connected)
+        self.assertEqual(subprotocol, MSGPACK_SUBPROTOCOL)
+
+        async def receive(frame_type):
+            """Raw (short key) msgpack map of the next `frame_type` frame"""
+            while True:
+                message = await player.receive_output(timeout=2)
+                self.assertNotIn('text', message)
+                raw = msgpack.unpackb(message['bytes'])
+                if CODECS['msgpack'].decode(message['bytes'])['type'] == frame_type:
+                    return raw
+
+        # Klient ham qisqa kalitlar bilan yuboradi
+        await room.send(room.host, {'action': 'host_join'})
+        await player.send_to(bytes_data=msgpack.packb({'a': 'player_join'}))
+        await room.send(room.host, {'action': 'start_game'})
+        await player.send_to(bytes_data=msgpack.packb({'a': 'player_ready'}))
+        await receive('game_started')
+        question = await receive('show_question')
+        self.assertEqual(question['t'], 'show_question')
+        self.assertEqual(set(question['q']['op']), {'A', 'B', 'C', 'D'})
+
+        await player.send_to(bytes_data=msgpack.packb({'a': 'submit_answer', 'o': 'A'}))
+        result = await receive('answer_result')
+        self.assertEqual((result['c'], result['r']), (True, 1))
+        self.assertGreater(result['e'], 0)
+        await room.disconnect()
+
+    async def test_restart_restores_live_game(self):
+        room, sent = await self.start_room()
+        player = room.players[0]
+        last_seq = max(p['seq'] for c, p in sent if c is player and p['type'] == 'show_question')
+        answer = {'action': 'submit_answer', 'selected_option': 'A'}
+        sent, _ = await room.measure((player, answer))
+        first = next(p for _, p in sent if p['type'] == 'answer_result')
+        store = kahoot_state.get_state_store()
+        before = await store.get_state(room.session.pin)
+        seq = await store.get_event_seq(room.session.pin)
+
+        # Worker to'xtaydi: bufer bazaga yoziladi, jarayondagi holat yo'qoladi
+        await flush_pending_answers(room.session.pin, store)
+        for loop in list(kahoot_loop._game_loops.values()):
+            loop.task.cancel()
+            await asyncio.gather(loop.task, return_exceptions=True)
+        await room.disconnect()
+        kahoot_state._state_store = None
+
+        room.host = room.communicator()
+        room.players = [room.communicator(key) for key in room.session_keys]
+        player = room.players[0]
+        await room.connect()
+        sent, _ = await room.measure((room.host, {'action': 'host_join'}))
+        self.assertEqual(sent[0][1]['current_question']['index'], 0)
+
+        store = kahoot_state.get_state_store()
+        after = await store.get_state(room.session.pin)
+        for key in ('status', 'current_question_index', 'question_deadline', 'question_closed'):
+            self.assertEqual(after[key], before[key], key)
+        # Keyingi voqea klientlar allaqachon ko'rgan raqamni qayta ishlatmaydi
+        self.assertEqual(seq, last_seq)
+        self.assertEqual(await store.get_event_seq(room.session.pin), last_seq)
+
+        # Uzilmasdan oldingi oxirgi voqeani ko'rgan klient hech narsani o'tkazib yubormagan
+        sent, _ = await room.measure((player, {'action': 'player_ready', 'last_seq': seq}))
+        self.assertEqual([p['type'] for c, p in sent if c is player], ['clock_ping'])
+        sent, _ = await room.measure((player, {'action': 'player_ready'}))
+        sync = next(p for _, p in sent if p['type'] == 'sync_current_state')
+        self.assertEqual(sync['seq'], last_seq)
+        self.assertTrue(sync['question']['has_answered'])
+        self.assertEqual(sync['current_score'], first['total_score'])
+
+        # Tiklangan savolga qayta javob ball qo'shmaydi
+        sent, _ = await room.measure((player, answer))
+        again = next(p for _, p in sent if p['type'] == 'answer_result')
+        self.assertEqual(again['total_score'], first['total_score'])
+        await room.disconnect()
+
+
+@override_settings(**KAHOOT_TEST_SETTINGS)
+class GameLoopLeaseTests(SimpleTestCase):
+    """Transitions are fenced by the session lease; idle games end on their own"""
+    pin = '515151'
+
+    def setUp(self):
+        kahoot_state._state_store = None
+        self.store = kahoot_state.get_state_store()
+        # Baza va guruh xabarlari bu testlarda kerak emas
+        self.broadcast = self.enterContext(mock.patch.object(kahoot_loop.GameLoop, 'broadcast'))
+        self.enterContext(mock.patch.object(kahoot_loop, 'save_checkpoint'))
+        self.enterContext(mock.patch.object(kahoot_loop, 'save_standings'))
+
+    def tearDown(self):
+        kahoot_state._state_store = None
+        kahoot_loop._game_loops.clear()
+
+    async def seed(self, **state):
+        questions = [
+            {
+                'question_id': i, 'text': f'Q{i}', 'image': None, 'correct_option': 'A',
+                'options': {'A': 'a', 'B': 'b', 'C': 'c', 'D': 'd'}, 'time_limit': 30,
+            }
+            for i in range(3)
+        ]
+        await self.store.init_session(self.pin, dict({
+            'status': 'PLAYING', 'current_question_index': 0, 'question_start_time': 0,
+            'question_deadline': 30, 'question_closed': True, 'ready_deadline': None, 'ending': False,
+            'quiz_title': 'Lease', 'max_players': 50, 'questions': questions,
+        }, **state), {}, {})
+
+    def loop(self, channel_name):
+        loop = kahoot_loop.GameLoop(self.pin)
+        loop.channel_name = channel_name
+        return loop
+
+    async def test_stalled_leader_cannot_advance(self):
+        await self.seed()
+        await self.store.acquire_lease(self.pin, 'stalled', 0.1)
+
+        async def slow_flush(*args):
+            await asyncio.sleep(0.2)
+            return 0
+
+        with mock.patch.object(kahoot_loop, 'flush_pending_answers', slow_flush):
+            stalled = asyncio.ensure_future(self.loop('stalled').next_question())
+            # Flush lease'dan uzoq davom etdi: boshqa worker o'yinni oladi
+            await asyncio.sleep(0.15)
+            self.assertTrue(await self.store.acquire_lease(self.pin, 'other', 10))
+            taken_over = asyncio.ensure_future(self.loop('other').next_question())
+            with self.assertRaises(kahoot_loop.LeaseLost):
+                await stalled
+            await taken_over
+
+        state = await self.store.get_state(self.pin)
+        self.assertEqual(state['current_question_index'], 1)
+        self.assertEqual(self.broadcast.await_count, 1)
+
+    async def test_finished_is_checkpointed_after_standings(self):
+        await self.seed(question_closed=False)
+        await self.store.acquire_lease(self.pin, 'leader', 10)
+        calls = []
+
+        async def record(name, *args):
+            state = await self.store.get_state(self.pin)
+            calls.append((name, state['status'], state['question_closed']))
+
+        with mock.patch.object(kahoot_loop, 'flush_pending_answers', lambda *a: record('flush')), \
+                mock.patch.object(kahoot_loop, 'save_standings', lambda *a: record('standings')), \
+                mock.patch.object(kahoot_loop, 'save_checkpoint', lambda *a: record('checkpoint')):
+            await self.loop('leader').end_game()
+        # Podium sahifasi FINISHED'ni ko'rganda reyting allaqachon yozilgan
+        self.assertEqual(calls, [
+            ('flush', 'PLAYING', True), ('standings', 'PLAYING', True), ('checkpoint', 'FINISHED', True),
+        ])
+
+    async def wait_for_state(self, key, value, timeout=2):
+        deadline = time.monotonic() + timeout
+        while (await self.store.get_state(self.pin))[key] != value:
+            self.assertLess(time.monotonic(), deadline, f'{key} != {value!r}')
+            await asyncio.sleep(0.02)
+
+    async def test_interrupted_end_is_resumed(self):
+        await self.seed(question_closed=False, question_deadline=time.time() + 30)
+        self.enterContext(mock.patch.object(kahoot_loop, 'LEASE_RENEW_INTERVAL', 0.05))
+        await self.store.acquire_lease(self.pin, 'stalled', 0.1)
+
+        async def slow_flush(*args):
+            await asyncio.sleep(0.2)
+            return 0
+
+        with mock.patch.object(kahoot_loop, 'flush_pending_answers', slow_flush):
+            with self.assertRaises(kahoot_loop.LeaseLost):
+                await self.loop('stalled').end_game()
+            state = await self.store.get_state(self.pin)
+            self.assertEqual((state['status'], state['question_closed']), ('PLAYING', True))
+
+            # Lease'ni olgan loop yakunni IDLE_TIMEOUT'ni kutmasdan davom ettiradi
+            loop = kahoot_loop.get_game_loop(self.pin)
+            loop.ensure_running()
+            await asyncio.wait_for(loop.task, timeout=2)
+        state = await self.store.get_state(self.pin)
+        self.assertEqual(state['status'], 'FINISHED')
+        self.assertEqual(self.broadcast.await_args.args[0]['type'], 'game_ended')
+
+    async def test_command_forwarded_to_dead_owner_is_not_lost(self):
+        await self.seed(question_deadline=time.time())
+        self.enterContext(mock.patch.object(kahoot_loop, 'LEASE_RENEW_INTERVAL', 0.05))
+        await self.store.acquire_lease(self.pin, 'dead', 0.3)
+        loop = kahoot_loop.get_game_loop(self.pin)
+        loop.submit('next_question')
+        await asyncio.sleep(0.1)
+        self.assertEqual((await self.store.get_state(self.pin))['current_question_index'], 0)
+
+        # O'lgan egasining lease'i tugaydi: buyruq yangi leader'da bajariladi
+        await self.wait_for_state('current_question_index', 1)
+        self.assertEqual(self.broadcast.await_args.args[0]['type'], 'show_question')
+        loop.task.cancel()
+        await asyncio.gather(loop.task, return_exceptions=True)
+
+    async def test_command_executed_by_owner_is_not_repeated(self):
+        await self.seed()
+        self.enterContext(mock.patch.object(kahoot_loop, 'LEASE_RENEW_INTERVAL', 0.05))
+        await self.store.acquire_lease(self.pin, 'owner', 0.3)
+        loop = kahoot_loop.get_game_loop(self.pin)
+        loop.submit('next_question')
+        await asyncio.sleep(0.1)
+        # Egasi buyruqni bajarib, keyin o'ldi
+        await self.store.compare_and_set_state(
+            self.pin, 'owner', {}, current_question_index=1, question_closed=False,
+            question_deadline=time.time() + 30,
+        )
+
+        await asyncio.sleep(0.5)
+        self.assertEqual(await self.store.get_lease_owner(self.pin), loop.channel_name)
+        self.assertEqual((await self.store.get_state(self.pin))['current_question_index'], 1)
+        self.broadcast.assert_not_awaited()
+        loop.task.cancel()
+        await asyncio.gather(loop.task, return_exceptions=True)
+
+    async def test_idle_game_is_ended(self):
+        await self.seed(question_deadline=time.time() - 1)
+        self.enterContext(mock.patch.object(kahoot_loop, 'IDLE_TIMEOUT', 0.1))
+        loop = kahoot_loop.get_game_loop(self.pin)
+        loop.ensure_running()
+        await asyncio.wait_for(loop.task, timeout=2)
+        state = await self.store.get_state(self.pin)
+        self.assertEqual(state['status'], 'FINISHED')
+        self.assertEqual(self.broadcast.await_args.args[0]['type'], 'game_ended')
+        self.assertNotIn(self.pin, kahoot_loop._game_loops)
+
+
+class KahootAdmissionTests(TestCase):
+    """Joins take a seat and create the player in one transaction"""
+
+    def setUp(self):
+        host = User.objects.create(username='host')
+        quiz = KahootQuiz.objects.create(title='Admission', creator=host)
+        self.session = KahootSession.objects.create(quiz=quiz, host=host, max_players=2)
+
+    def admit(self, nickname):
+        return admit_player(self.session.pin, nickname)
+
+    def seats(self):
+        self.session.refresh_from_db()
+        return self.session.player_count
+
+    def test_join_is_two_queries(self):
+        with CaptureQueriesContext(connection) as captured:
+            player_id = self.admit('ali')
+        queries = [q for q in captured if 'SAVEPOINT' not in q['sql']]
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(KahootPlayer.objects.get(id=player_id).session_id, self.session.id)
+        self.assertEqual(self.seats(), 1)
+
+    def test_capacity(self):
+        self.admit('ali')
+        self.admit('vali')
+        with self.assertRaisesMessage(JoinRejected, "to'ldi"):
+            self.admit('gani')
+        self.assertEqual(self.seats(), 2)
+
+        # Kick qilingan o'yinchi joyini bo'shatadi
+        remove_player(self.session.pin, KahootPlayer.objects.get(nickname='vali').id)
+        self.admit('gani')
+        self.assertEqual(self.seats(), 2)
+
+    def test_duplicate_nickname_frees_the_seat(self):
+        self.admit('ali')
+        with self.assertRaisesMessage(JoinRejected, 'band'):
+            self.admit('ali')
+        self.assertEqual(self.seats(), 1)
+
+    def test_only_lobby_sessions(self):
+        KahootSession.objects.filter(id=self.session.id).update(status='PLAYING')
+        with self.assertRaisesMessage(JoinRejected, 'topilmadi'):
+            self.admit('ali')
+        with self.assertRaisesMessage(JoinRejected, 'topilmadi'):
+            admit_player('000000', 'ali')
+
+
+class KahootStandingsTests(TestCase):
+    """Final standings are written once and read with indexed lookups"""
+
+    def setUp(self):
+        self.host = User.objects.create(username='host')
+        quiz = KahootQuiz.objects.create(title='Standings', creator=self.host)
+        questions = [
+            KahootQuestion.objects.create(
+                quiz=quiz, text=f'Q{i}', option_a='a', option_b='b', option_c='c',
+                option_d='d', correct_option='A', time_limit=30, order=i,
+            )
+            for i in range(2)
+        ]
+        self.session = KahootSession.objects.create(
+            quiz=quiz, host=self.host, status='FINISHED', player_count=4,
+            quiz_snapshot=quiz.compile_snapshot(),
+        )
+        self.players = [
+            KahootPlayer.objects.create(session=self.session, nickname=f'p{i}', score=score)
+            for i, score in enumerate((300, 200, 200, 0))
+        ]
+        # (player, question, is_correct, time_taken)
+        for player, question, is_correct, time_taken in (
+            (0, 0, True, 2.0), (0, 1, True, 4.0),
+            (1, 0, True, 3.0), (2, 0, True, 1.0), (2, 1, False, 5.0),
+        ):
+            KahootAnswer.objects.create(
+                player=self.players[player], question=questions[question],
+                selected_option='A' if is_correct else 'B', is_correct=is_correct, time_taken=time_taken,
+            )
+
+    def test_ranks_and_aggregates(self):
+        with self.assertNumQueries(2):
+            write_standings(self.session.pin)
+        rows = [
+            (s.player_id, s.rank, s.score, s.correct_count, s.avg_time)
+            for s in self.session.standings.all()
+        ]
+        p = [player.id for player in self.players]
+        self.assertEqual(rows, [
+            (p[0], 1, 300, 2, 3.0),
+            (p[1], 2, 200, 1, 3.0),
+            (p[2], 2, 200, 1, 3.0),
+            (p[3], 4, 0, 0, None),
+        ])
+        # Qayta chaqirish (kechikkan javoblar yozilgandan keyin) reytingni almashtiradi
+        KahootPlayer.objects.filter(id=p[3]).update(score=400)
+        with self.assertNumQueries(2):
+            write_standings(self.session.pin)
+        ranks = dict(self.session.standings.values_list('player_id', 'rank'))
+        self.assertEqual(ranks, {p[3]: 1, p[0]: 2, p[1]: 3, p[2]: 3})
+
+    def test_podium_page(self):
+        write_standings(self.session.pin)
+        session = self.client.session
+        session['kahoot_player_id'] = self.players[2].id
+        session['kahoot_session_pin'] = self.session.pin
+        session.save()
+        # Django sessiyasi, o'yinchining natijasi va top 3
+        with self.assertNumQueries(3):
+            response = self.client.get(f'/kahoot/play/{self.session.pin}/podium/', secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['player_rank'], 2)
+        self.assertEqual(response.context['total_players'], 4)
+        self.assertEqual(
+            [place['standing'].player_id for place in response.context['podium']],
+            [self.players[1].id, self.players[0].id, self.players[2].id],
+        )
+
+    def test_result_pages_only_read(self):
+        self.client.force_login(self.host)
+        # Reyting yozilmagan tugagan sessiya: sahifalar uni yozmaydi
+        response = self.client.get(f'/kahoot/host/{self.session.pin}/results/', secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['standings'], [])
+        session = self.client.session
+        session['kahoot_player_id'] = self.players[0].id
+        session.save()
+        response = self.client.get(f'/kahoot/play/{self.session.pin}/podium/', secure=True)
+        self.assertRedirects(response, '/kahoot/join/', fetch_redirect_response=False)
+        self.assertFalse(self.session.standings.exists())
+
+    def test_missing_standings_are_written_by_command(self):
+        other = KahootSession.objects.create(quiz=self.session.quiz, host=self.host, status='FINISHED')
+        KahootPlayer.objects.create(session=other, nickname='solo', score=10)
+        write_standings(other.pin)
+        KahootPlayer.objects.filter(session=other).update(score=20)
+
+        out = StringIO()
+        call_command('kahoot_standings', stdout=out)
+        self.assertIn('Wrote standings of 1 session(s)', out.getvalue())
+        self.assertEqual(
+            list(self.session.standings.values_list('rank', flat=True)), [1, 2, 2, 4],
+        )
+        # Yozilgan reyting faqat --rewrite bilan almashtiriladi
+        self.assertEqual(other.standings.get().score, 10)
+        call_command('kahoot_standings', other.pin, rewrite=True, stdout=StringIO())
+        self.assertEqual(other.standings.get().score, 20)
+
+
+class KahootQuizEditTests(TestCase):
+    """Questions of a quiz that is being played keep their answers' foreign keys"""
+
+    def test_question_of_live_session_cannot_be_deleted(self):
+        host = User.objects.create(username='host')
+        quiz = KahootQuiz.objects.create(title='Edit', creator=host)
+        question = KahootQuestion.objects.create(
+            quiz=quiz, text='Q', option_a='a', option_b='b', option_c='c',
+            option_d='d', correct_option='A',
+        )
+        session = KahootSession.objects.create(
+            quiz=quiz, host=host, status='PLAYING', quiz_snapshot=quiz.compile_snapshot(),
+        )
+        self.client.force_login(host)
+        url = f'/kahoot/question/{question.id}/delete/'
+        self.client.post(url, secure=True)
+        self.assertTrue(KahootQuestion.objects.filter(id=question.id).exists())
+
+        KahootSession.objects.filter(id=session.id).update(status='FINISHED')
+        self.client.post(url, secure=True)
+        self.assertFalse(KahootQuestion.objects.filter(id=question.id).exists())
+
+
+class KahootPinTests(TestCase):
+    """PINs come from a permutation of session ids, not random draws"""
+
+    def setUp(self):
+        self.host = User.objects.create(username='host')
+        self.quiz = KahootQuiz.objects.create(title='Pins', creator=self.host)
+
+    def create_session(self):
+        return KahootSession.objects.create(quiz=self.quiz, host=self.host)
+
+    def test_permutation_has_no_collisions(self):
+        pins = {permute_pin(n) for n in range(20000)}
+        self.assertEqual(len(pins), 20000)
+        self.assertTrue(all(len(pin) == 6 and pin.isdigit() for pin in pins))
+        self.assertEqual(permute_pin(123), permute_pin(123 + PIN_SPACE))
+
+    def test_session_gets_pin_of_its_id(self):
+        session = self.create_session()
+        self.assertEqual(session.pin, permute_pin(session.id))
+        session.refresh_from_db()
+        self.assertEqual(session.pin, permute_pin(session.id))
+
+    def test_pin_is_recycled_only_from_finished_sessions(self):
+        # Keyingi sikldagi sessiya eski sessiya PIN'ini oladi
+        old, new = self.create_session(), self.create_session()
+        KahootSession.objects.filter(id=new.id).update(pin=None)
+        KahootSession.objects.filter(id=old.id).update(pin=permute_pin(new.id), status='FINISHED')
+
+        self.assertEqual(allocate_pin(new.id), permute_pin(new.id))
+        old.refresh_from_db()
+        self.assertIsNone(old.pin)
+
+    def test_pin_held_by_live_session_is_skipped(self):
+        # Tirik legacy sessiya (tasodifiy PIN yoki eski SECRET_KEY) yangi sessiya PIN'ini ushlab turibdi
+        legacy, new = self.create_session(), self.create_session()
+        KahootSession.objects.filter(id=new.id).update(pin=None)
+        KahootSession.objects.filter(id=legacy.id).update(pin=permute_pin(new.id))
+
+        with transaction.atomic():
+            self.assertEqual(allocate_pin(new.id), permute_pin(new.id, 1))
+        legacy.refresh_from_db()
+        self.assertEqual(legacy.pin, permute_pin(new.id))
+        self.assertEqual(KahootSession.objects.get(id=new.id).pin, permute_pin(new.id, 1))
+
+        # Hamma urinish band bo'lsagina xato
+        KahootSession.objects.filter(id=new.id).update(pin=None)
+        with mock.patch('quizzes.kahoot_pins.PIN_ATTEMPTS', 1), \
+                self.assertRaises(IntegrityError), transaction.atomic():
+            allocate_pin(new.id)
+
+
+class ClockSyncTests(SimpleTestCase):
+    """NTP-style ping exchange of one connection"""
+
+    def test_best_sample_wins(self):
+        clock = ClockSync()
+        for _ in range(SYNC_SAMPLES):
+            ping = clock.ping()
+            self.assertEqual(ping['type'], 'clock_ping')
+            # Klient soati serverdan 5 soniya oldinda
+            self.assertTrue(clock.pong(ping['server_time'], ping['server_time'] + 5))
+        final = clock.ping()
+        self.assertEqual(final['type'], 'clock_sync')
+        self.assertAlmostEqual(final['offset'], 5, places=1)
+        self.assertLess(clock.latency(), 0.1)
+
+    def test_unsolicited_pong_is_ignored(self):
+        clock = ClockSync()
+        self.assertFalse(clock.pong(0, 0))
+        ping = clock.ping()
+        self.assertFalse(clock.pong(ping['server_time'] - 30, 0))
+        self.assertEqual(clock.latency(), 0.0)
+
+    def test_latency_compensation_is_capped(self):
+        clock = ClockSync()
+        clock.rtt = 10
+        self.assertEqual(clock.latency(), MAX_LATENCY_COMPENSATION)
+
+
+class KahootCodecTests(SimpleTestCase):
+    """Frames survive both codecs; hot messages travel with SHORT_KEYS in msgpack"""
+
+    # Har bir COMPACT_TYPES turi uchun namunaviy xabar
+    payloads = {
+        'submit_answer': {'action': 'submit_answer', 'selected_option': 'B', 'player_id': 7},
+        'answer_result': {
+            'type': 'answer_result', 'is_correct': True, 'points_earned': 950,
+            'total_score': 1900, 'rank': 2, 'late': False,
+        },
+        'show_question': {
+            'type': 'show_question', 'seq': 4,
+            'question': {
+                'question_id': 12, 'index': 0, 'total': 10, 'text': 'Poytaxt?', 'image': None,
+                'options': {'A': 'Toshkent', 'B': 'Samarqand', 'C': 'Buxoro', 'D': 'Xiva'},
+                'time_limit': 20, 'starts_at': 1700000000.25, 'deadline': 1700000020.25,
+            },
+        },
+    }
+    # Qisqa kalitlarsiz yuboriladigan xabar
+    other = {
+        'type': 'question_results', 'seq': 5,
+        'results': {'correct_option': 'A', 'answer_counts': {'A': 3, 'B': 0, 'C': 1, 'D': 0}, 'top_players': [
+            {'nickname': 'Ali', 'score': 1900, 'avatar_id': 3},
+        ]},
+    }
+
+    def wire(self, payload):
+        """Frame the way the sending side puts it on the wire (clients shorten actions too)"""
+        if 'action' in payload:
+            return msgpack.packb({SHORT_KEYS.get(k, k): v for k, v in payload.items()})
+        return CODECS['msgpack'].encode(payload)
+
+    def test_every_compact_type_has_a_sample(self):
+        self.assertEqual(set(self.payloads), COMPACT_TYPES)
+
+    def test_round_trip(self):
+        for name, codec in CODECS.items():
+            for payload in [*self.payloads.values(), self.other]:
+                with self.subTest(codec=name, payload=payload.get('type') or payload['action']):
+                    self.assertEqual(codec.decode(codec.encode(payload)), payload)
+                    if codec.binary:
+                        self.assertEqual(codec.decode(self.wire(payload)), payload)
+
+    def test_compact_types_use_short_keys(self):
+        result = msgpack.unpackb(self.wire(self.payloads['answer_result']))
+        self.assertEqual(result, {'t': 'answer_result', 'c': True, 'e': 950, 's': 1900, 'r': 2, 'l': False})
+        question = msgpack.unpackb(self.wire(self.payloads['show_question']))
+        self.assertEqual(set(question), {'t', 'seq', 'q'})
+        self.assertEqual(
+            set(question['q']), {'i', 'x', 'n', 'tx', 'im', 'op', 'tl', 'starts_at', 'deadline'},
+        )
+        self.assertEqual(question['q']['op']['A'], 'Toshkent')
+        answer = msgpack.unpackb(self.wire(self.payloads['submit_answer']))
+        self.assertEqual(answer, {'a': 'submit_answer', 'o': 'B', 'p': 7})
+        # Qolgan xabarlar to'liq kalitlar bilan
+        self.assertEqual(msgpack.unpackb(self.wire(self.other)), self.other)
+
+    def test_negotiate_codec(self):
+        self.assertEqual(negotiate_codec([MSGPACK_SUBPROTOCOL]), (CODECS['msgpack'], MSGPACK_SUBPROTOCOL))
+        self.assertEqual(negotiate_codec(['chat', MSGPACK_SUBPROTOCOL]), (CODECS['msgpack'], MSGPACK_SUBPROTOCOL))
+        for subprotocols in (None, [], ['kahoot.json']):
+            self.assertEqual(negotiate_codec(subprotocols), (CODECS['json'], None))
+
+    @unittest.skipUnless(shutil.which('node'), 'node is not installed')
+    def test_player_page_codec_matches_python(self):
+        # O'yinchi sahifasidagi static/kahoot/msgpack.js Python msgpack bilan bir xil frame'lar beradi
+        script = settings.BASE_DIR / 'static' / 'kahoot' / 'msgpack.js'
+        frames = [self.wire(payload).hex() for payload in [*self.payloads.values(), self.other]]
+        runner = f"""
+            require({json.dumps(str(script))});
+            const frames = JSON.parse(require('fs').readFileSync(0, 'utf8'));
+            const hex = bytes => Buffer.from(bytes).toString('hex');
+            console.log(JSON.stringify(frames.map(frame => {{
+                const value = MessagePack.decode(Buffer.from(frame, 'hex'));
+                return [value, hex(MessagePack.encode(value))];
+            }})));
+        """
+        output = subprocess.run(
+            ['node', '-e', runner], input=json.dumps(frames), capture_output=True, text=True, check=True,
+        ).stdout
+        for frame, (decoded, encoded) in zip(frames, json.loads(output)):
+            expected = msgpack.unpackb(bytes.fromhex(frame))
+            self.assertEqual(decoded, expected)
+            self.assertEqual(msgpack.unpackb(bytes.fromhex(encoded)), expected)
+
+
+class RankingIndexTests(SimpleTestCase):
+    """Order-statistic treap behind the in-memory ranking"""
+
+    def test_scores_and_removal(self):
+        ranking = RankingIndex()
+        ranking.set_score(1, 100, joined_at=1)
+        ranking.set_score(2, 50, joined_at=2)
+        self.assertEqual(ranking.add_points(2, 70), 120)
+        self.assertEqual(ranking.scores(), {1: 100, 2: 120})
+        self.assertEqual(ranking.top(5), [(2, 120), (1, 100)])
+
+        ranking.remove(2)
+        ranking.remove(2)
+        self.assertNotIn(2, ranking)
+        self.assertEqual(len(ranking), 1)
+        self.assertEqual((ranking.score(2), ranking.rank(2)), (0, 0))
+        self.assertEqual(ranking.top(5), [(1, 100)])
+
+    def test_competition_rank_with_ties(self):
+        ranking = RankingIndex()
+        for player_id, score in enumerate((300, 200, 200, 0)):
+            ranking.set_score(player_id, score, joined_at=player_id)
+        self.assertEqual([ranking.rank(player_id) for player_id in range(4)], [1, 2, 2, 4])
+        self.assertEqual(ranking.rank_for_score(250), 2)
+        self.assertEqual(ranking.rank_for_score(200), 2)
+
+    def test_top_breaks_ties_by_join_order(self):
+        ranking = RankingIndex()
+        for player_id, score, joined_at in ((5, 100, 3), (4, 100, 1), (6, 100, 2), (7, 200, 9)):
+            ranking.set_score(player_id, score, joined_at)
+        self.assertEqual(ranking.top(3), [(7, 200), (4, 100), (6, 100)])
+        # Ball qo'shilganda qo'shilish vaqti saqlanadi
+        ranking.add_points(5, 100)
+        self.assertEqual(ranking.top(2), [(5, 200), (7, 200)])
+
+    def test_matches_full_sort(self):
+        rng = random.Random(7)
+        ranking, players = RankingIndex(), {}
+        for _ in range(2000):
+            player_id = rng.randrange(50)
+            if player_id in players and rng.random() < 0.1:
+                ranking.remove(player_id)
+                del players[player_id]
+            elif player_id in players:
+                points = rng.choice((0, 500, 1000))
+                ranking.add_points(player_id, points)
+                players[player_id] = (players[player_id][0] + points, players[player_id][1])
+            else:
+                players[player_id] = (rng.choice((0, 500)), rng.random())
+                ranking.set_score(player_id, *players[player_id])
+        ordered = sorted(players, key=lambda pid: (-players[pid][0], players[pid][1], pid))
+        self.assertEqual(ranking.top(10), [(pid, players[pid][0]) for pid in ordered[:10]])
+        for player_id, (score, _) in players.items():
+            higher = sum(1 for other, _ in players.values() if other > score)
+            self.assertEqual(ranking.rank(player_id), higher + 1)
+
+
+class GameStateStoreContract:
+    """Behaviour both state store backends must agree on"""
+    pin = '424242'
+
+    def make_store(self):
+        raise NotImplementedError
+
+    async def seed(self, store):
+        # Id tartibi (Redis a'zo nomi tartibi) qo'shilish tartibidan farq qiladi
+        roster = {
+            player_id: {'nickname': f'p{player_id}', 'avatar_id': 1, 'joined_at': joined_at}
+            for player_id, joined_at in ((10, 1.0), (11, 2.0), (9, 3.0), (12, 4.0))
+        }
+        state = {'status': 'PLAYING', 'current_question_index': 0, 'questions': []}
+        await store.init_session(self.pin, state, roster, dict.fromkeys(roster, 0))
+
+    async def test_ranking(self):
+        store = self.make_store()
+        await self.seed(store)
+        for player_id in (9, 10, 11):
+            self.assertEqual(await store.add_points(self.pin, player_id, 500), 500)
+        self.assertEqual(await store.add_points(self.pin, 12, 200), 200)
+
+        top = await store.get_top_players(self.pin, 2)
+        self.assertEqual([(p['id'], p['score'], p['nickname']) for p in top], [(10, 500, 'p10'), (11, 500, 'p11')])
+        ranks = [await store.get_rank(self.pin, player_id) for player_id in (9, 10, 11, 12)]
+        self.assertEqual(ranks, [1, 1, 1, 4])
+        self.assertEqual(await store.get_rank(self.pin, 99), 0)
+
+        await store.remove_player(self.pin, 10)
+        top = await store.get_top_players(self.pin, 5)
+        self.assertEqual([p['id'] for p in top], [11, 9, 12])
+        self.assertEqual(await store.get_scores(self.pin), {9: 500, 11: 500, 12: 200})
+
+    async def test_compare_and_set_state(self):
+        store = self.make_store()
+        await self.seed(store)
+        expected = {'current_question_index': 0, 'status': 'PLAYING'}
+        # Lease'siz yozilmaydi
+        self.assertFalse(await store.compare_and_set_state(self.pin, 'a', expected, current_question_index=1))
+        self.assertTrue(await store.acquire_lease(self.pin, 'a', 10))
+        self.assertTrue(await store.compare_and_set_state(self.pin, 'a', expected, current_question_index=1))
+        # Eski qiymat bilan ikkinchi urinish ham, boshqa egasi ham yoza olmaydi
+        self.assertFalse(await store.compare_and_set_state(self.pin, 'a', expected, current_question_index=2))
+        self.assertFalse(await store.compare_and_set_state(
+            self.pin, 'b', {'current_question_index': 1}, current_question_index=2,
+        ))
+        state = await store.get_state(self.pin)
+        self.assertEqual((state['current_question_index'], state['status']), (1, 'PLAYING'))
+
+    async def test_answers_pending_and_tally(self):
+        store = self.make_store()
+        await self.seed(store)
+        answer = {
+            'selected_option': 'B', 'is_correct': False, 'time_taken': 1.0,
+            'points_earned': 0, 'answered_at': 1.0,
+        }
+        self.assertTrue(await store.record_answer(self.pin, 7, 10, answer))
+        self.assertFalse(await store.record_answer(self.pin, 7, 10, dict(answer, selected_option='A')))
+        self.assertTrue(await store.record_answer(self.pin, 7, 11, dict(answer, selected_option='A')))
+        self.assertEqual(await store.count_answers(self.pin, 7), 2)
+        self.assertEqual((await store.get_answer(self.pin, 7, 10))['selected_option'], 'B')
+        self.assertEqual(await store.get_answer_tally(self.pin, 7), {'A': 1, 'B': 1, 'C': 0, 'D': 0})
+
+        pending = await store.get_pending_answers(self.pin)
+        self.assertEqual(sorted((q, p, a['selected_option']) for q, p, a in pending), [(7, 10, 'B'), (7, 11, 'A')])
+        await store.discard_pending_answers(self.pin, [(7, 10)])
+        self.assertEqual([(q, p) for q, p, _ in await store.get_pending_answers(self.pin)], [(7, 11)])
+
+        # Bazadan yuklangan javoblar hisoblanadi, lekin buferga tushmaydi
+        await store.init_session(self.pin, {}, {}, {}, {8: {12: dict(answer, selected_option='C')}})
+        self.assertEqual((await store.get_answer_tally(self.pin, 8))['C'], 1)
+        self.assertEqual(len(await store.get_pending_answers(self.pin)), 1)
+
+
+class RedisGameStateStoreTests(GameStateStoreContract, SimpleTestCase):
+    """Runs against settings.REDIS_URL (or a local Redis); skipped when none answers"""
+    prefix = 'kahoot-test'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        import redis
+
+        cls.url = getattr(settings, 'REDIS_URL', None) or 'redis://localhost:6379/0'
+        cls.redis = redis.Redis.from_url(cls.url, socket_connect_timeout=0.5)
+        try:
+            cls.redis.ping()
+        except redis.RedisError:
+            cls.redis.close()
+            raise unittest.SkipTest(f"Redis is not available at {cls.url}")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.redis.close()
+        super().tearDownClass()
+
+    def tearDown(self):
+        keys = list(self.redis.scan_iter(match=f'{self.prefix}:*'))
+        if keys:
+            self.redis.delete(*keys)
+
+    def make_store(self):
+        return kahoot_state.RedisGameStateStore(url=self.url, prefix=self.prefix)
+
+    async def test_answer_is_buffered_in_one_step(self):
+        from redis.asyncio.client import Pipeline
+
+        store = self.make_store()
+        await self.seed(store)
+        answer = {
+            'selected_option': 'C', 'is_correct': False, 'time_taken': 1.0,
+            'points_earned': 0, 'answered_at': 1.0,
+        }
+        # Javobdan keyingi alohida round trip'da o'lgan worker javobni buferdan tashqarida qoldirmaydi
+        with mock.patch.object(Pipeline, 'execute', side_effect=ConnectionError):
+            self.assertTrue(await store.record_answer(self.pin, 7, 10, answer))
+        self.assertEqual([(q, p) for q, p, _ in await store.get_pending_answers(self.pin)], [(7, 10)])
+        self.assertEqual((await store.get_answer_tally(self.pin, 7))['C'], 1)
+        self.assertFalse(await store.record_answer(self.pin, 7, 10, answer))
+        self.assertEqual(len(await store.get_pending_answers(self.pin)), 1)
+
+
+class InMemoryGameStateStoreTests(GameStateStoreContract, SimpleTestCase):
+    """Process-local store keeps sessions only while they are written to"""
+
+    def make_store(self):
+        return kahoot_state.InMemoryGameStateStore()
+
+    async def test_idle_sessions_expire(self):
+        store = kahoot_state.InMemoryGameStateStore(ttl=0.1)
+        await store.update_state('111111', status='FINISHED')
+        await store.append_event('111111', {'type': 'game_ended'})
+        await store.acquire_lease('111111', 'owner', 0.1)
+        await asyncio.sleep(0.05)
+        await store.update_state('222222', status='PLAYING')
+        await asyncio.sleep(0.1)
+        self.assertIsNone(await store.get_state('111111'))
+        self.assertEqual(await store.get_event_seq('111111'), 0)
+
+        # Yangi sessiya yaratilganda eskirganlar (lease'lari bilan) tozalanadi
+        await store.update_state('333333', status='LOBBY')
+        self.assertEqual(set(store.sessions), {'333333'})
+        self.assertEqual(store.leases, {})
+
+
+class KahootDBExecutorTests(SimpleTestCase):
+    """Consumer DB work runs on the dedicated executor and is measured"""
+
+    async def test_slow_task_does_not_block_other_games(self):
+        release = threading.Event()
+
+        @db_task
+        def slow_query():
+            release.wait(5)
+
+        @db_task
+        def fast_query():
+            return threading.current_thread().name
+
+        DB_STATS.reset()
+        slow = asyncio.ensure_future(slow_query())
+        await asyncio.sleep(0.05)
+        # Boshqa o'yinning so'rovi sekin so'rov tugashini kutmaydi
+        thread_name = await asyncio.wait_for(fast_query(), timeout=1)
+        self.assertTrue(thread_name.startswith('kahoot-db'))
+        self.assertEqual(DB_STATS.snapshot()['running'], 1)
+        release.set()
+        await slow
+
+        stats = DB_STATS.snapshot()
+        self.assertEqual((stats['queued'], stats['running'], stats['completed']), (0, 0, 2))
+        self.assertLess(stats['max_wait'], 1)
@@ -0,0 +1,166 @@
+// Kahoot Mode msgpack codec (brauzer uchun)
+//
+// Uchinchi tomon CDN skripti o'rniga o'z serverimizdan beriladi: o'yinchi
+// sahifasida sessiya cookie'si bor. Kahoot frame'lari ishlatadigan qism
+// amalga oshirilgan: nil, bool, butun va float sonlar, str, bin, array, map.
+// window.MessagePack.encode(value) -> Uint8Array, decode(Uint8Array) -> value
+(function (global) {
+    'use strict';
+
+    const textEncoder = new TextEncoder();
+    const textDecoder = new TextDecoder();
+
+    function encode(value) {
+        const bytes = [];
+        const view = new DataView(new ArrayBuffer(8));
+
+        function pushView(length) {
+            for (let i = 0; i < length; i++) bytes.push(view.getUint8(i));
+        }
+
+        function pushLength(length, fix, fixMax, tag8, tag16, tag32) {
+            if (length <= fixMax && fix !== null) {
+                bytes.push(fix | length);
+            } else if (length < 0x100 && tag8 !== null) {
+                bytes.push(tag8, length);
+            } else if (length < 0x10000) {
+                bytes.push(tag16, length >> 8, length & 0xff);
+            } else {
+                view.setUint32(0, length);
+                bytes.push(tag32);
+                pushView(4);
+            }
+        }
+
+        function pushNumber(n) {
+            if (!Number.isInteger(n) || !Number.isSafeInteger(n)) {
+                view.setFloat64(0, n);
+                bytes.push(0xcb);
+                pushView(8);
+            } else if (n >= 0) {
+                if (n < 0x80) bytes.push(n);
+                else if (n < 0x100) bytes.push(0xcc, n);
+                else if (n < 0x10000) bytes.push(0xcd, n >> 8, n & 0xff);
+                else if (n < 0x100000000) { view.setUint32(0, n); bytes.push(0xce); pushView(4); }
+                else { view.setBigUint64(0, BigInt(n)); bytes.push(0xcf); pushView(8); }
+            } else {
+                if (n >= -0x20) bytes.push(n & 0xff);
+                else if (n >= -0x80) { view.setInt8(0, n); bytes.push(0xd0); pushView(1); }
+                else if (n >= -0x8000) { view.setInt16(0, n); bytes.push(0xd1); pushView(2); }
+                else if (n >= -0x80000000) { view.setInt32(0, n); bytes.push(0xd2); pushView(4); }
+                else { view.setBigInt64(0, BigInt(n)); bytes.push(0xd3); pushView(8); }
+            }
+        }
+
+        function pushValue(v) {
+            if (v === null || v === undefined) {
+                bytes.push(0xc0);
+            } else if (v === false || v === true) {
+                bytes.push(v ? 0xc3 : 0xc2);
+            } else if (typeof v === 'number') {
+                pushNumber(v);
+            } else if (typeof v === 'string') {
+                const encoded = textEncoder.encode(v);
+                pushLength(encoded.length, 0xa0, 31, 0xd9, 0xda, 0xdb);
+                for (const b of encoded) bytes.push(b);
+            } else if (v instanceof Uint8Array) {
+                pushLength(v.length, null, -1, 0xc4, 0xc5, 0xc6);
+                for (const b of v) bytes.push(b);
+            } else if (Array.isArray(v)) {
+                pushLength(v.length, 0x90, 15, null, 0xdc, 0xdd);
+                v.forEach(pushValue);
+            } else if (typeof v === 'object') {
+                const entries = Object.entries(v).filter(([, item]) => item !== undefined);
+                pushLength(entries.length, 0x80, 15, null, 0xde, 0xdf);
+                for (const [key, item] of entries) {
+                    pushValue(key);
+                    pushValue(item);
+                }
+            } else {
+                throw new TypeError('msgpack: unsupported type ' + typeof v);
+            }
+        }
+
+        pushValue(value);
+        return new Uint8Array(bytes);
+    }
+
+    function decode(buffer) {
+        const data = buffer instanceof Uint8Array ? buffer : new Uint8Array(buffer);
+        const view = new DataView(data.buffer, data.byteOffset, data.byteLength);
+        let pos = 0;
+
+        function take(length) {
+            if (pos + length > data.length) throw new RangeError('msgpack: truncated frame');
+            const start = pos;
+            pos += length;
+            return start;
+        }
+
+        function str(length) {
+            const start = take(length);
+            return textDecoder.decode(data.subarray(start, start + length));
+        }
+
+        function array(length) {
+            const out = new Array(length);
+            for (let i = 0; i < length; i++) out[i] = read();
+            return out;
+        }
+
+        function map(length) {
+            const out = {};
+            for (let i = 0; i < length; i++) {
+                const key = read();
+                out[key] = read();
+            }
+            return out;
+        }
+
+        function bin(length) {
+            const start = take(length);
+            return data.slice(start, start + length);
+        }
+
+        function read() {
+            const tag = data[take(1)];
+            if (tag < 0x80) return tag;
+            if (tag < 0x90) return map(tag & 0x0f);
+            if (tag < 0xa0) return array(tag & 0x0f);
+            if (tag < 0xc0) return str(tag & 0x1f);
+            if (tag >= 0xe0) return tag - 0x100;
+            switch (tag) {
+                case 0xc0: return null;
+                case 0xc2: return false;
+                case 0xc3: return true;
+                case 0xc4: return bin(data[take(1)]);
+                case 0xc5: return bin(view.getUint16(take(2)));
+                case 0xc6: return bin(view.getUint32(take(4)));
+                case 0xca: return view.getFloat32(take(4));
+                case 0xcb: return view.getFloat64(take(8));
+                case 0xcc: return data[take(1)];
+                case 0xcd: return view.getUint16(take(2));
+                case 0xce: return view.getUint32(take(4));
+                case 0xcf: return Number(view.getBigUint64(take(8)));
+                case 0xd0: return view.getInt8(take(1));
+                case 0xd1: return view.getInt16(take(2));
+                case 0xd2: return view.getInt32(take(4));
+                case 0xd3: return Number(view.getBigInt64(take(8)));
+                case 0xd9: return str(data[take(1)]);
+                case 0xda: return str(view.getUint16(take(2)));
+                case 0xdb: return str(view.getUint32(take(4)));
+                case 0xdc: return array(view.getUint16(take(2)));
+                case 0xdd: return array(view.getUint32(take(4)));
+                case 0xde: return map(view.getUint16(take(2)));
+                case 0xdf: return map(view.getUint32(take(4)));
+                default: throw new TypeError('msgpack: unsupported tag 0x' + tag.toString(16));
+            }
+        }
+
+        const value = read();
+        if (pos !== data.length) throw new RangeError('msgpack: trailing bytes');
+        return value;
+    }
+
+    global.MessagePack = { encode: encode, decode: decode };
+})(typeof window !== 'undefined' ? window : globalThis);